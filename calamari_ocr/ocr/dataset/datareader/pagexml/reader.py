@@ -37,6 +37,145 @@ class CutMode(IntEnum):
     MBR = 2
 
 
+class PageLineCutter:
+    """
+    Cuts all lines of a page image. The coordinates of the lines are parsed at once (see `parse_coords`), the
+    background colour is computed once per page, and the polygon masks are rasterized into a buffer that is shared by
+    the lines. Lines that are cut by CutMode.BOX without rotation are views of the page image.
+    """
+
+    def __init__(self, pageimg: np.ndarray, mode: CutMode, cval=None):
+        """
+        Parameters
+        ----------
+        pageimg : page image
+        mode : see `PageXMLReader.cutout`
+        cval :
+            colour : mask and fill empty regions with
+            None : calculate via the maximum pixel of the page (on first use)
+        """
+        self.pageimg = pageimg
+        self.mode = mode
+        self._cval = cval
+        self._mask = np.zeros(0, dtype=np.uint8)
+
+    @staticmethod
+    def background(img: np.ndarray):
+        """The colour of the maximum pixel (the brightest pixel for colour images)"""
+        if img.ndim == 2:
+            return np.amax(img).item()
+        x, y = np.unravel_index(np.argmax(np.mean(img, axis=2)), img.shape[:2])
+        return img[x, y, :].tolist()
+
+    @property
+    def cval(self):
+        if self._cval is None:
+            self._cval = self.background(self.pageimg)
+        return self._cval
+
+    @staticmethod
+    def parse_coords(coordstrings: List[str], scale=1) -> List[np.ndarray]:
+        """
+        Parse the PAGE coordinates "c1_1,c_2 c2_1,c2_2 ..." of several lines in one pass. Returns the scaled points of
+        each line as (row, column) in an int32 array of shape [n, 1, 2].
+        """
+        counts = [s.count(",") for s in coordstrings]
+        values = " ".join(coordstrings).replace(",", " ").split()
+        if len(values) != 2 * sum(counts):
+            # irregular points (e.g. "x,y,z"), parse line by line
+            return [PageLineCutter._parse_line_coords(s, scale) for s in coordstrings]
+
+        points = (scale * np.array(values, dtype=np.int64).reshape((-1, 2))[:, ::-1]).astype(np.int32)
+        return [p.reshape((-1, 1, 2)) for p in np.split(points, np.cumsum(counts)[:-1])]
+
+    @staticmethod
+    def _parse_line_coords(coordstring: str, scale=1) -> np.ndarray:
+        coords = [p.split(",") for p in coordstring.split()]
+        coords = [(int(scale * int(c[1])), int(scale * int(c[0]))) for c in coords]
+        return np.array(coords, np.int32).reshape((-1, 1, 2))
+
+    def _mask_buffer(self, h: int, w: int) -> np.ndarray:
+        if self._mask.size < h * w:
+            self._mask = np.empty(h * w, dtype=np.uint8)
+        mask = self._mask[: h * w].reshape((h, w))
+        mask.fill(0)
+        return mask
+
+    def cut(self, coords: np.ndarray, angle=0, max_auto_angle=0) -> np.ndarray:
+        """Cut a line given by its points (see `parse_coords`), see `PageXMLReader.cutout` for the parameters"""
+        if len(coords) == 0:
+            return self.pageimg[0:0, 0:0]
+        maxX, maxY = np.amax(coords, 0).squeeze()
+        minX, minY = np.amin(coords, 0).squeeze()
+        cut = self.pageimg[minX : maxX + 1, minY : maxY + 1]
+        if cut.size == 0:
+            return cut  # empty image
+        coords = coords - (minX, minY)
+        maxX, maxY = (maxX - minX, maxY - minY)
+        minX, minY = (0, 0)
+
+        # calculate angle if needed
+        if angle is None:
+            if max_auto_angle > 0:
+                mbr = cv.minAreaRect(coords)
+                angle = mbr[2] - 90 if mbr[2] > 45 else mbr[2]
+                if abs(angle) > max_auto_angle:
+                    angle = 0
+            else:
+                angle = 0
+
+        # rotate cut
+        if angle:
+            (h, w) = cut.shape[:2]
+            (cX, cY) = (w // 2, h // 2)
+            M = cv.getRotationMatrix2D((cX, cY), -angle, 1.0)
+            cos = np.abs(M[0, 0])
+            sin = np.abs(M[0, 1])
+            # compute the new bounding dimensions of the image
+            nW = np.ceil((h * sin) + (w * cos)).astype(int)
+            nH = np.ceil((h * cos) + (w * sin)).astype(int)
+            # adjust the rotation matrix to take into account translation
+            M[0, 2] += (nW / 2) - cX
+            M[1, 2] += (nH / 2) - cY
+            # rotate coords
+            coords = cv.transform(coords[..., ::-1], M)
+            minX, minY = np.amin(coords, 0).squeeze()
+            maxX, maxY = np.amax(coords, 0).squeeze()
+            # rotate image
+            cut = cv.warpAffine(
+                cut,
+                M,
+                (nW, nH),
+                flags=cv.INTER_LINEAR,
+                borderMode=cv.BORDER_CONSTANT,
+                borderValue=self.cval,
+            )
+        else:
+            coords = coords[..., ::-1]
+            minX, minY = minY, minX
+            maxX, maxY = maxY, maxX
+
+        # simplify coordinates with MBR
+        if self.mode is CutMode.MBR:
+            mbr = cv.minAreaRect(coords)
+            coords = cv.boxPoints(mbr).astype(int).reshape(-1, 1, 2)
+
+        rows, cols = slice(minY, maxY + 1), slice(minX, maxX + 1)
+        if self.mode not in (CutMode.POLYGON, CutMode.MBR):
+            return cut[rows, cols]
+
+        # mask pixels outside coords, the mask is rasterized on the full cut (the MBR may exceed the cropped region)
+        mask = self._mask_buffer(*cut.shape[:2])
+        cv.fillPoly(mask, [coords], color=1)
+        cut, mask = cut[rows, cols], mask[rows, cols]
+        if cut.size == 0:
+            return cut
+        line = np.empty_like(cut)
+        line[...] = self.cval
+        np.copyto(line, cut, where=mask.view(bool) if cut.ndim == 2 else mask.view(bool)[:, :, np.newaxis])
+        return line
+
+
 class PageXMLDatasetLoader:
     def __init__(
         self,
@@ -296,89 +435,18 @@ class PageXMLReader(CalamariDataGenerator[PageXML]):
             float : if angle is None, try to guess angle up to boundary
         cval :
             colour : mask and fill empty regions with
-            None : calculate via maximum pixel
+            None : calculate via maximum pixel of the cut
         scale : factor to scale the coordinates with
-        """
-
-        coords = [p.split(",") for p in coordstring.split()]
-        if not coords:
-            return pageimg[0:0, 0:0]
-        coords = [(int(scale * int(c[1])), int(scale * int(c[0]))) for c in coords]
-        coords = np.array(coords, np.int32).reshape((-1, 1, 2))
-        maxX, maxY = np.amax(coords, 0).squeeze()
-        minX, minY = np.amin(coords, 0).squeeze()
-        cut = pageimg[minX : maxX + 1, minY : maxY + 1]
-        if cut.size == 0:
-            return cut  # empty image
-        coords -= (minX, minY)
-        maxX, maxY = (maxX - minX, maxY - minY)
-        minX, minY = (0, 0)
-
-        # calculate angle if needed
-        if angle is None:
-            if max_auto_angle > 0:
-                mbr = cv.minAreaRect(coords)
-                angle = mbr[2] - 90 if mbr[2] > 45 else mbr[2]
-                if abs(angle) > max_auto_angle:
-                    angle = 0
-            else:
-                angle = 0
 
-        # set cval if needed
-        if cval is None:
-            if cut.ndim == 2:
-                cval = np.amax(cut).item()
-            else:
-                x, y = np.unravel_index(np.argmax(np.mean(cut, axis=2)), cut.shape[:2])
-                cval = cut[x, y, :].tolist()
-
-        # rotate cut
-        if angle:
-            (h, w) = cut.shape[:2]
-            (cX, cY) = (w // 2, h // 2)
-            M = cv.getRotationMatrix2D((cX, cY), -angle, 1.0)
-            cos = np.abs(M[0, 0])
-            sin = np.abs(M[0, 1])
-            # compute the new bounding dimensions of the image
-            nW = np.ceil((h * sin) + (w * cos)).astype(int)
-            nH = np.ceil((h * cos) + (w * sin)).astype(int)
-            # adjust the rotation matrix to take into account translation
-            M[0, 2] += (nW / 2) - cX
-            M[1, 2] += (nH / 2) - cY
-            # rotate coords
-            coords = cv.transform(coords[..., ::-1], M)
-            minX, minY = np.amin(coords, 0).squeeze()
-            maxX, maxY = np.amax(coords, 0).squeeze()
-            # rotate image
-            cut = cv.warpAffine(
-                cut,
-                M,
-                (nW, nH),
-                flags=cv.INTER_LINEAR,
-                borderMode=cv.BORDER_CONSTANT,
-                borderValue=cval,
-            )
-        else:
-            coords = coords[..., ::-1]
-            minX, minY = minY, minX
-            maxX, maxY = maxY, maxX
-
-        # simplify coordinates with MBR
-        if mode is CutMode.MBR:
-            mbr = cv.minAreaRect(coords)
-            coords = cv.boxPoints(mbr).astype(int).reshape(-1, 1, 2)
-
-        # mask pixels outside coords
-        if mode in (CutMode.POLYGON, CutMode.MBR):
-            box = (np.ones(cut.shape) * cval).astype(cut.dtype)
-            mask = np.zeros(cut.shape, dtype=np.uint8)
-            mask = cv.fillPoly(mask, [coords], color=[255] * cut.ndim)
-            mask_inv = cv.bitwise_not(mask)
-            fg = cv.bitwise_and(cut, mask)
-            bg = cv.bitwise_and(box, mask_inv)
-            cut = cv.add(fg, bg)
-
-        return cut[minY : maxY + 1, minX : maxX + 1]
+        To cut all lines of a page, use a `PageLineCutter` instead.
+        """
+        coords = PageLineCutter.parse_coords([coordstring], scale)[0]
+        if cval is None and len(coords) > 0:
+            (minX, minY), (maxX, maxY) = np.amin(coords, 0)[0], np.amax(coords, 0)[0]
+            cut = pageimg[minX : maxX + 1, minY : maxY + 1]
+            if cut.size > 0:
+                cval = PageLineCutter.background(cut)
+        return PageLineCutter(pageimg, mode, cval).cut(coords, angle, max_auto_angle)
 
     def prepare_store(self):
         self._last_page_id = None
@@ -581,38 +649,38 @@ class PageXMLReader(CalamariDataGenerator[PageXML]):
             self.params.skip_commented,
         )
         image_path, xml_path, idx = sample
+        samples = list(loader.load(image_path, xml_path))
 
-        img = None
-        if self.mode in INPUT_PROCESSOR:
+        cutter, line_coords = None, []
+        if not text_only and self.mode in INPUT_PROCESSOR and samples:
+            # all lines of the page are cut from the same image, with the background of the page
             img = self._load_image(image_path)
+            cutter = PageLineCutter(img, self.params.cut_mode)
+            line_coords = PageLineCutter.parse_coords(
+                [s["coords"] for s in samples], scale=img.shape[1] / samples[0]["img_width"]
+            )
 
-        for i, sample in enumerate(loader.load(image_path, xml_path)):
+        for i, sample in enumerate(samples):
             fold_id = (idx + i) % self.params.n_folds if self.params.n_folds > 0 else -1
             text = sample["text"]
             orientation = sample["orientation"]
 
-            if not text_only and self.mode in INPUT_PROCESSOR:
-                ly, lx = img.shape[:2]
-
+            if cutter is not None:
                 # rotate by orientation angle in clockwise direction to correct present skew
                 angle = orientation if orientation and orientation % 360 != 0 else 0
 
-                line_img = PageXMLReader.cutout(
-                    img,
-                    sample["coords"],
-                    mode=self.params.cut_mode,
-                    angle=angle,
-                    cval=None,
-                    scale=lx / sample["img_width"],
-                )
+                line_img = cutter.cut(line_coords[i], angle=angle)
 
                 # add padding as required from normal files
                 if self.params.pad:
-                    img = np.pad(
-                        img,
-                        self.params.pad,
+                    pad_width = np.broadcast_to(self.params.pad, (2, 2)).tolist()
+                    if line_img.ndim == 3:
+                        pad_width.append([0, 0])  # the channels are not padded
+                    line_img = np.pad(
+                        line_img,
+                        pad_width,
                         mode="constant",
-                        constant_values=img.max(initial=0),
+                        constant_values=line_img.max(initial=0),
                     )
             else:
                 line_img = None
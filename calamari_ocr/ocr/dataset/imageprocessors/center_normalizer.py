@@ -54,12 +54,31 @@ class CenterNormalizerProcessor(ImageProcessor[CenterNormalizerProcessorParams])
         kernel = cv.getGaussianKernel(int((8.0 * h * self.extra) + 1), h * self.extra)
         center = cv.filter2D(a, cv.CV_16U, kernel, borderType=cv.BORDER_REFLECT).flatten()
 
-        deltas = abs(np.arange(h)[:, np.newaxis] - center[np.newaxis, :])
-        mad = np.mean(deltas[line != 0])
+        # mean absolute deviation of the ink pixels from the center of their column
+        rows, cols = np.nonzero(line)
+        mad = np.mean(np.abs(rows - center[cols].astype(np.int64)))
         r = int(1 + self.range * mad)
 
         return center, r
 
+    def measure_image(self, img):
+        """Measure the center and range of the uint8 image, returns None for a white image"""
+        if img.ndim > 2:
+            assert img.ndim == 3, img.shape
+            if img.shape[-1] == 1:
+                temp = np.squeeze(img, axis=-1).astype(np.float32) / 255
+            elif img.shape[-1] == 3:
+                temp = cv.cvtColor(img, cv.COLOR_RGB2GRAY).astype(np.float32) / 255
+            else:
+                temp = np.mean(img, axis=-1, dtype=np.float32) / 255
+        else:
+            temp = img.astype(np.float32) / 255
+        temp = np.amax(temp) - temp
+        amax = np.amax(temp)
+        if amax == 0:
+            return None
+        return self.measure(temp / amax)
+
     def dewarp(self, img, cval=0):
         """
 
@@ -76,37 +95,24 @@ class CenterNormalizerProcessor(ImageProcessor[CenterNormalizerProcessorParams])
             # Empty image
             return img
 
-        if img.ndim > 2:
-            assert img.ndim == 3, img.shape
-            if img.shape[-1] == 1:
-                temp = np.squeeze(img, axis=-1)
-            elif img.shape[-1] == 3:
-                temp = (cv.cvtColor(img, cv.COLOR_RGB2GRAY) / 255).astype(np.float32)
-            else:
-                temp = np.mean(img, axis=-1)
-        else:
-            temp = (img / 255).astype(np.float32)
-        temp = np.amax(temp) - temp
-        amax = np.amax(temp)
-        if amax == 0:
+        measured = self.measure_image(img)
+        if measured is None:
             # white image
-            return (temp * 255).astype(np.uint8)
-        inverted = temp * 1.0 / np.amax(temp)
-
-        center, r = self.measure(inverted)
+            return np.zeros(img.shape[:2], dtype=np.uint8)
+        center, r = measured
 
         # The actual image img is embedded into a larger image by
         # adding vertical space on top and at the bottom (padding)
         hpad = r  # this is large enough
         padded = cv.copyMakeBorder(img, hpad, hpad, 0, 0, cv.BORDER_CONSTANT, value=cval)
 
-        center = center + hpad - r
-        new_h = 2 * r
-        dewarped = [padded[c : c + new_h, i] for i, c in enumerate(center)]
-
-        # transpose and convert
-        dewarped = np.swapaxes(np.array(dewarped, dtype=np.uint8), 1, 0)
-        return dewarped
+        # gather the rows [c, c + 2 * r) of each column of the padded image, c is the (padded) center minus r
+        center = center.astype(np.intp) + hpad - r
+        rows = center[np.newaxis, :] + np.arange(2 * r)[:, np.newaxis]
+        if padded.ndim > 2:
+            rows = rows[:, :, np.newaxis]
+        dewarped = np.take_along_axis(padded, rows, axis=0)
+        return dewarped.astype(np.uint8, copy=False)
 
     def normalize(self, img):
         """
@@ -119,6 +125,21 @@ class CenterNormalizerProcessor(ImageProcessor[CenterNormalizerProcessorParams])
         -------
 
         """
+        img, m1 = self.downscale(img)
+        dewarped = self.dewarp(img, cval=self.border_value(img))
+
+        t = dewarped.shape[0] - img.shape[0]
+        # scale to target height
+        scaled = scale_to_h(dewarped, self.target_height)
+
+        if dewarped.size == 0:
+            # Empty image
+            m2 = 1
+        else:
+            m2 = scaled.shape[1] / dewarped.shape[1]
+        return scaled, (m1, m2, t)
+
+    def downscale(self, img):
         # resize the image to a appropriate height close to the target height to speed up dewarping
         intermediate_height = int(self.target_height * 1.5)
         m1 = 1
@@ -126,27 +147,18 @@ class CenterNormalizerProcessor(ImageProcessor[CenterNormalizerProcessorParams])
         if intermediate_height < img.shape[0]:
             m1 = intermediate_height / img.shape[0]
             img = scale_to_h(img, intermediate_height)
+        return img, m1
 
+    @staticmethod
+    def border_value(img):
+        # the brightest pixel (the background) fills the space added by dewarping
         if img.size == 0:
-            cval = 1
+            return 1
         elif img.ndim == 2:
-            cval = np.amax(img).item()
+            return np.amax(img).item()
         else:
             x, y = np.unravel_index(np.argmax(np.mean(img, axis=2)), img.shape[:2])
-            cval = img[x, y, :].tolist()
-
-        dewarped = self.dewarp(img, cval=cval)
-
-        t = dewarped.shape[0] - img.shape[0]
-        # scale to target height
-        scaled = scale_to_h(dewarped, self.target_height)
-
-        if dewarped.size == 0:
-            # Empty image
-            m2 = 1
-        else:
-            m2 = scaled.shape[1] / dewarped.shape[1]
-        return scaled, (m1, m2, t)
+            return img[x, y, :].tolist()
 
     def local_to_global_pos(self, x, params):
         m1, m2, t = params["center"]
@@ -0,0 +1,135 @@
+from dataclasses import dataclass, field
+from typing import Tuple, Type
+
+import cv2 as cv
+import numpy as np
+from paiargparse import pai_dataclass, pai_meta
+
+from calamari_ocr.ocr.dataset.imageprocessors.center_normalizer import (
+    CenterNormalizerProcessorParams,
+    CenterNormalizerProcessor,
+)
+from calamari_ocr.ocr.dataset.imageprocessors.data_preprocessor import ImageProcessor
+from calamari_ocr.utils.image import to_uint8
+
+
+@pai_dataclass(alt="FusedLinePreparation")
+@dataclass
+class FusedLinePreparationProcessorParams(CenterNormalizerProcessorParams):
+    """
+    Replaces the chain DataRange (optional) -> CenterNormalizer -> FinalPreparation by a single processor with the same
+    meta data that works on uint8 images. The dewarping and the scaling to the line height are a single remap that
+    writes the transposed line into the preallocated padded array, normalization and inversion are a lookup table
+    applied in place. Lines that are scaled down are interpolated linearly instead of by area, otherwise the output
+    equals the one of the chain.
+    """
+
+    data_range: bool = field(
+        default=False, metadata=pai_meta(help="Apply the DataRange processor first (convert to uint8 and grayscale)")
+    )
+    normalize: bool = True
+    invert: bool = True
+    transpose: bool = True
+    pad: int = field(default=16, metadata=pai_meta(help="Padding (left right) of the line"))
+    pad_value: int = 0
+
+    @staticmethod
+    def cls() -> Type["ImageProcessor"]:
+        return FusedLinePreparation
+
+
+class FusedLinePreparation(CenterNormalizerProcessor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the pad value of FinalPreparation as uint8, the padding is an int array so the line is promoted to float64
+        self._pad_dtype = np.result_type(np.float32, np.asarray(self.params.pad_value))
+        self._pad_value = to_uint8(np.full(1, self.params.pad_value, dtype=self._pad_dtype))[0]
+
+    def _apply_single(self, data, meta):
+        assert self.target_height > 0  # Not set yet
+        if self.params.data_range:
+            data = to_uint8(data)
+            if data.ndim == 3:
+                data = np.mean(data.astype("float32"), axis=2).astype(data.dtype)
+        data = data.astype(np.uint8)
+        if data.ndim == 3 and data.shape[-1] == 1:
+            data = np.squeeze(data, axis=-1)
+
+        img, m1 = self.downscale(data)
+        measured = self.measure_image(img) if img.size > 0 else None
+        if measured is None:
+            # empty or white image
+            line, params = self.normalize(data)
+            meta["center"] = params
+            return self.prepare(line)
+
+        center, r = measured
+        h, w = img.shape[:2]
+        scale = self.target_height * 1.0 / (2 * r)
+        target_width = np.maximum(round(scale * w), 1)
+        meta["center"] = (m1, target_width / w, 2 * r - h)
+
+        # sample the dewarped line at the pixel centers of the scaled line as cv.resize (clamped to its border), the
+        # row r of the dewarped line is the center of its column, between two columns the center is interpolated
+        x = np.arange(target_width, dtype=np.float32)
+        x = np.clip((x + 0.5) * (w / target_width) - 0.5, 0, w - 1)
+        y = np.arange(self.target_height, dtype=np.float32)
+        y = np.clip((y + 0.5) / scale - 0.5, 0, 2 * r - 1) - r
+        map_x = np.broadcast_to(x[:, np.newaxis], (target_width, self.target_height))
+        map_y = np.interp(x, np.arange(w), center).astype(np.float32)[:, np.newaxis] + y
+        if not self.params.transpose:
+            map_x, map_y = map_x.T, map_y.T
+
+        out, line = self._output(target_width, img.shape[2:])
+        cval = self.border_value(img)
+        remapped = cv.remap(
+            img,
+            np.ascontiguousarray(map_x),
+            np.ascontiguousarray(map_y),
+            cv.INTER_LINEAR,
+            dst=line if line.flags.c_contiguous else None,
+            borderMode=cv.BORDER_CONSTANT,
+            borderValue=tuple(cval) if isinstance(cval, list) else cval,
+        )
+        if remapped is not line:
+            line[...] = remapped
+        line[...] = self._lookup_table(int(np.amax(line)))[line]
+        return out
+
+    def _output(self, width: int, channels: Tuple[int, ...]) -> Tuple[np.ndarray, np.ndarray]:
+        # the padded output filled with the pad value and the view of the line inside of it
+        pad = self.params.pad if self.params.pad > 0 else 0
+        if self.params.transpose:
+            out = np.full((width + 2 * pad, self.target_height) + channels, self._pad_value, dtype=np.uint8)
+            return out, out[pad : pad + width]
+        else:
+            out = np.full((self.target_height, width + 2 * pad) + channels, self._pad_value, dtype=np.uint8)
+            return out, out[:, pad : pad + width]
+
+    def _lookup_table(self, amax: int) -> np.ndarray:
+        # apply the float operations of FinalPreparation on all values up to the maximum value of the line
+        data = np.arange(amax + 1, dtype=np.uint8).astype("float32") / 255
+        if self.params.normalize and data[amax] > 0:
+            data = data * 1.0 / data[amax]
+        if self.params.invert:
+            data = data[amax] - data
+        if self.params.pad > 0:
+            data = data.astype(self._pad_dtype)
+        lut = np.zeros(256, dtype=np.uint8)
+        lut[: amax + 1] = to_uint8(data)
+        return lut
+
+    def prepare(self, line: np.ndarray) -> np.ndarray:
+        """Normalize, invert, transpose, and pad the scaled uint8 line as FinalPreparation"""
+        out, view = self._output(line.shape[1], line.shape[2:])
+        if line.size > 0:
+            line = self._lookup_table(int(np.amax(line)))[line]
+        view[...] = np.swapaxes(line, 1, 0) if self.params.transpose else line
+        return out
+
+    def local_to_global_pos(self, x, params):
+        x = super().local_to_global_pos(x, params)
+        if self.params.pad > 0 and self.params.transpose:
+            return x - self.params.pad
+        else:
+            return x
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import struct
+import tempfile
+from copy import copy
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+from paiargparse import pai_dataclass, pai_meta
+from tfaip.data.pipeline.processor.dataprocessor import DataProcessorParams
+from tfaip.data.pipeline.processor.params import SequentialProcessorPipelineParams
+
+from calamari_ocr.ocr.dataset.imageprocessors.data_preprocessor import ImageProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class LineCache:
+    """
+    Content-addressed on-disk store of pre-processed lines. Each line is one file `<key[:2]>/<key>.line` that holds a
+    pickled header (dtype, shape, and meta data of the line) followed by the raw array, so that the line is
+    memory-mapped on load. Files are written atomically, hence several processes can share the cache.
+
+    The modification time of a file is updated on each hit. If the cache exceeds `max_bytes`, the least recently used
+    files are deleted. The size is only checked after a process wrote a tenth of `max_bytes`, and only a tenth of the
+    shards (the directories `<key[:2]>`) is checked at once, see `evict`.
+    """
+
+    MAGIC = b"CLC1"
+    EVICTED = "evicted"  # marker file of a shard, its modification time is the time of the last eviction
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._written_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".line")
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                magic, header_size = f.read(len(self.MAGIC)), struct.unpack("<Q", f.read(8))[0]
+                if magic != self.MAGIC:
+                    return None
+                header = pickle.loads(f.read(header_size))
+            os.utime(path)
+        except (OSError, struct.error, pickle.UnpicklingError, EOFError):
+            return None  # not cached (or evicted meanwhile)
+
+        offset = len(self.MAGIC) + 8 + header_size
+        if int(np.prod(header["shape"])) == 0:
+            data = np.zeros(header["shape"], dtype=header["dtype"])
+        else:
+            # copy-on-write, the following processors may modify the line
+            data = np.asarray(np.memmap(path, header["dtype"], mode="c", offset=offset, shape=header["shape"]))
+        return data, header["meta"]
+
+    def put(self, key: str, data: np.ndarray, meta: Dict[str, Any]):
+        data = np.ascontiguousarray(data)
+        header = pickle.dumps({"dtype": data.dtype.str, "shape": data.shape, "meta": meta})
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.MAGIC)
+                f.write(struct.pack("<Q", len(header)))
+                f.write(header)
+                f.write(data.tobytes())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._written_bytes += len(self.MAGIC) + 8 + len(header) + data.nbytes
+        if self._written_bytes > self.max_bytes // 10:
+            self._written_bytes = 0
+            self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used lines of the tenth of the shards that were evicted the longest time ago, if the
+        size of the cache (estimated from these shards) exceeds `max_bytes`. The keys are hashes, hence each shard holds
+        a similar share of the lines. The shards are trimmed to half of their share of `max_bytes`, so that the cache
+        stays below `max_bytes` until all other shards were evicted.
+        """
+        try:
+            shards = [entry.path for entry in os.scandir(self.cache_dir) if entry.is_dir()]
+        except OSError:
+            return
+        if not shards:
+            return
+
+        shards.sort(key=self._evicted_at)
+        shards, n_shards = shards[: -(-len(shards) // 10)], len(shards)
+        files = []
+        total = 0
+        for shard in shards:
+            try:
+                with open(os.path.join(shard, self.EVICTED), "a"):
+                    pass
+                os.utime(os.path.join(shard, self.EVICTED))
+                entries = list(os.scandir(shard))
+            except OSError:
+                continue  # evicted by another process
+            for entry in entries:
+                if not entry.name.endswith(".line"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total * n_shards / len(shards) <= self.max_bytes:
+            return
+
+        files.sort()
+        for _, size, path in files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # evicted by another process
+            total -= size
+            if total <= self.max_bytes * len(shards) / n_shards / 2:
+                break
+
+    def _evicted_at(self, shard: str) -> float:
+        try:
+            return os.stat(os.path.join(shard, self.EVICTED)).st_mtime
+        except OSError:
+            return 0
+
+
+@pai_dataclass(alt="LineCache")
+@dataclass
+class LineCacheProcessorParams(DataProcessorParams):
+    """
+    Applies the wrapped image processors, or loads their output (the line and the meta data written by the processors)
+    from a `LineCache`. The lines are identified by the hash of the input image and the parameters of the processors.
+    Is not meant to be set up manually, see `with_line_cache`.
+    """
+
+    processors: List[DataProcessorParams] = field(default_factory=list)
+    cache_dir: str = ""
+    max_size_mb: int = 16384
+    # the pre-processing that was wrapped, restored by `without_line_cache`
+    uncached: Optional[SequentialProcessorPipelineParams] = field(default=None, metadata=pai_meta(mode="ignore"))
+
+    @staticmethod
+    def cls() -> Type["ImageProcessor"]:
+        return LineCacheProcessor
+
+
+class LineCacheProcessor(ImageProcessor[LineCacheProcessorParams]):
+    VERSION = 1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        processor_params = [p for p in self.params.processors if self.mode in p.modes]
+        self.processors = [p.create(self.data_params, self.mode) for p in processor_params]
+        self._cache: Optional[LineCache] = None
+        self._cache_failed = False
+
+        # the modes are not part of the key, only the processors of the current mode are applied
+        description = {
+            "version": self.VERSION,
+            "line_height": self.data_params.line_height,
+            "input_channels": self.data_params.input_channels,
+            "processors": [{k: v for k, v in p.to_dict().items() if k != "modes"} for p in processor_params],
+        }
+        self._key_prefix = json.dumps(description, sort_keys=True, default=str).encode("utf-8")
+
+    @property
+    def cache(self) -> Optional[LineCache]:
+        if self._cache is None and not self._cache_failed:
+            try:
+                self._cache = LineCache(self.params.cache_dir, self.params.max_size_mb * 1024 * 1024)
+            except OSError as e:
+                # e.g. the cache dir of a model that was trained on a different machine
+                logger.warning(f"The line cache {self.params.cache_dir} can not be used, lines are not cached: {e}")
+                self._cache_failed = True
+        return self._cache
+
+    def key(self, data: np.ndarray) -> str:
+        h = hashlib.sha1(self._key_prefix)
+        h.update(f"{data.dtype.str}{data.shape}".encode("utf-8"))
+        h.update(np.ascontiguousarray(data).data)
+        return h.hexdigest()
+
+    def _apply_single(self, data, meta):
+        cache = self.cache
+        key = self.key(data) if cache is not None and isinstance(data, np.ndarray) else None
+        if key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                data, processor_meta = cached
+                meta.update(processor_meta)
+                return data
+
+        before = dict(meta)
+        for processor in self.processors:
+            data = processor._apply_single(data, meta)
+
+        if key is not None and isinstance(data, np.ndarray):
+            try:
+                cache.put(key, data, {k: v for k, v in meta.items() if k not in before or before[k] is not v})
+            except OSError as e:
+                logger.warning(f"The line could not be stored in the line cache: {e}")
+        return data
+
+    def local_to_global_pos(self, x, params):
+        for processor in self.processors:
+            x = processor.local_to_global_pos(x, params)
+        return x
+
+
+def with_line_cache(
+    pre_proc: SequentialProcessorPipelineParams, cache_dir: Optional[str], max_size_mb: int
+) -> SequentialProcessorPipelineParams:
+    """Wrap the leading image processors of the pre-processing into a LineCacheProcessor if a cache dir is set"""
+    if not cache_dir or not pre_proc.processors or isinstance(pre_proc.processors[0], LineCacheProcessorParams):
+        return pre_proc
+
+    n = 0
+    while n < len(pre_proc.processors) and issubclass(pre_proc.processors[n].cls(), ImageProcessor):
+        n += 1
+    if n == 0:
+        return pre_proc
+
+    image_processors = pre_proc.processors[:n]
+    cached = copy(pre_proc)
+    cached.processors = [
+        LineCacheProcessorParams(
+            modes=set().union(*(p.modes for p in image_processors)),
+            processors=image_processors,
+            cache_dir=cache_dir,
+            max_size_mb=max_size_mb,
+            uncached=pre_proc,
+        )
+    ] + pre_proc.processors[n:]
+    return cached
+
+
+def without_line_cache(pre_proc: SequentialProcessorPipelineParams) -> SequentialProcessorPipelineParams:
+    """The inverse of `with_line_cache`, returns the original pre-processing if available"""
+    if not pre_proc.processors or not isinstance(pre_proc.processors[0], LineCacheProcessorParams):
+        return pre_proc
+    if pre_proc.processors[0].uncached is not None:
+        return pre_proc.processors[0].uncached
+
+    uncached = copy(pre_proc)
+    uncached.processors = pre_proc.processors[0].processors + pre_proc.processors[1:]
+    return uncached
@@ -82,9 +82,11 @@ class PrepareSample(MappingDataProcessor[PrepareSampleProcessorParams]):
             line = np.expand_dims(line, axis=-1)
 
         # Validate if the line is valid for training
-        if not self.is_valid_line(
-            text, len(line) // self.data_params.downscale_factor, len(line), sample.meta.get("id", "Unknown Sample ID")
-        ):
+        width, downscaled_width = len(line), len(line) // self.data_params.downscale_factor
+        if self.data_params.tf_image_processing:
+            # the width is only known after the image processing in the input graph, see TFImageProcessing
+            width, downscaled_width = 0, np.inf
+        if not self.is_valid_line(text, downscaled_width, width, sample.meta.get("id", "Unknown Sample ID")):
             return sample.new_invalid()
 
         if text is not None:
@@ -0,0 +1,332 @@
+import math
+from abc import ABC, abstractmethod
+from copy import copy
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Type
+
+import numpy as np
+import tensorflow as tf
+from paiargparse import pai_dataclass, pai_meta
+from tfaip import PipelineMode
+from tfaip.data.pipeline.processor.dataprocessor import DataProcessorParams
+from tfaip.data.pipeline.processor.params import SequentialProcessorPipelineParams
+
+from calamari_ocr.ocr.dataset.imageprocessors.center_normalizer import CenterNormalizerProcessorParams
+from calamari_ocr.ocr.dataset.imageprocessors.data_preprocessor import ImageProcessor
+from calamari_ocr.ocr.dataset.imageprocessors.data_range_normalizer import DataRangeProcessorParams
+from calamari_ocr.ocr.dataset.imageprocessors.final_preparation import FinalPreparationProcessorParams
+from calamari_ocr.ocr.dataset.imageprocessors.preparesample import PrepareSampleProcessorParams
+from calamari_ocr.ocr.dataset.imageprocessors.scale_to_height_processor import ScaleToHeightProcessorParams
+from calamari_ocr.utils.image import to_uint8
+
+Shape = Tuple[int, int]
+
+
+def scaled_width(shape: Shape, target_height: int) -> int:
+    """The width of a line of the given (height, width) after `scale_to_h`"""
+    h, w = shape
+    if h == target_height or h == 0 or w == 0:
+        return w  # unchanged or empty
+    return int(np.maximum(round(target_height * 1.0 / h * w), 1))
+
+
+def tf_scale_to_h(img: tf.Tensor, target_height: int) -> tf.Tensor:
+    """`scale_to_h` of a uint8 image [h, w, c]: area interpolation for down-, bilinear interpolation for up-sampling"""
+    h, w = tf.shape(img)[0], tf.shape(img)[1]
+
+    def resize():
+        scale = tf.cast(target_height, tf.float64) / tf.cast(h, tf.float64)
+        target_width = tf.maximum(tf.cast(tf.round(scale * tf.cast(w, tf.float64)), tf.int32), 1)
+        size = tf.stack([target_height, target_width])
+        resized = tf.cond(
+            scale <= 1,
+            lambda: tf.image.resize(img, size, method=tf.image.ResizeMethod.AREA),
+            lambda: tf.image.resize(img, size, method=tf.image.ResizeMethod.BILINEAR),
+        )
+        return tf.saturate_cast(tf.round(resized), tf.uint8)
+
+    def empty():
+        return tf.zeros(tf.stack([target_height, w, tf.shape(img)[2]]), dtype=tf.uint8)
+
+    return tf.cond(
+        tf.equal(h, target_height),
+        lambda: img,
+        lambda: tf.cond(tf.equal(tf.size(img), 0), empty, resize),
+    )
+
+
+class TFImageProcessor(ABC):
+    """
+    The implementation of an image processor by TF ops that are applied on a single line [h, w, c] (uint8) in the
+    input graph. `apply_shape` records the same meta data as the python processor (required for `local_to_global_pos`)
+    based on the shape of the line only and returns the (height, width) of the processed line.
+    """
+
+    def __init__(self, params: DataProcessorParams, data_params):
+        self.params = params
+        self.data_params = data_params
+
+    @abstractmethod
+    def apply_tf(self, img: tf.Tensor) -> tf.Tensor:
+        raise NotImplementedError
+
+    @abstractmethod
+    def apply_shape(self, shape: Shape, meta: dict) -> Shape:
+        raise NotImplementedError
+
+
+class TFDataRange(TFImageProcessor):
+    # the conversion to uint8 is applied in python, see TFImageProcessingProcessor
+    def apply_tf(self, img):
+        # the lines always have a channel axis in the input graph, the mean of a single channel is the channel itself
+        return tf.cast(tf.reduce_mean(tf.cast(img, tf.float32), axis=-1, keepdims=True), tf.uint8)
+
+    def apply_shape(self, shape, meta):
+        return shape
+
+
+class TFScaleToHeight(TFImageProcessor):
+    def apply_tf(self, img):
+        return tf_scale_to_h(img, self.params.height)
+
+    def apply_shape(self, shape, meta):
+        width = scaled_width(shape, self.params.height)
+        meta["scale_to_height"] = (width / shape[1],)
+        return self.params.height, width
+
+
+class TFCenterNormalizer(TFImageProcessor):
+    """
+    A vectorized approximation of the CenterNormalizerProcessor: the center of each column is the ink weighted mean of
+    its rows smoothed by a horizontal Gaussian (instead of the argmax of a 2D Gaussian). The window around the centers
+    has the height of the line (instead of a height based on the deviation of the ink from the centers), so that the
+    geometry of the output only depends on the shape of the line.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.target_height = self.params.line_height
+        self.intermediate_height = int(self.target_height * 1.5)
+        _, self.smoothness, _ = self.params.extra_params
+
+    def dewarp_radius(self, height: int) -> int:
+        return max(1, math.ceil(height / 2))
+
+    def apply_shape(self, shape, meta):
+        h, w = shape
+        m1 = 1
+        if self.intermediate_height < h:
+            m1 = self.intermediate_height / h
+            h, w = self.intermediate_height, scaled_width(shape, self.intermediate_height)
+
+        if h == 0 or w == 0:
+            meta["center"] = (m1, 1, 0)
+            return self.target_height, w
+
+        dewarped_height = 2 * self.dewarp_radius(h)
+        width = scaled_width((dewarped_height, w), self.target_height)
+        meta["center"] = (m1, width / w, dewarped_height - h)
+        return self.target_height, width
+
+    def apply_tf(self, img):
+        img = tf.cond(
+            tf.shape(img)[0] > self.intermediate_height,
+            lambda: tf_scale_to_h(img, self.intermediate_height),
+            lambda: img,
+        )
+        return tf.cond(
+            tf.equal(tf.size(img), 0),
+            lambda: tf.zeros(tf.stack([self.target_height, tf.shape(img)[1], tf.shape(img)[2]]), dtype=tf.uint8),
+            lambda: tf_scale_to_h(self.dewarp(img), self.target_height),
+        )
+
+    def dewarp(self, img):
+        h = tf.shape(img)[0]
+        hf = tf.cast(h, tf.float32)
+        gray = tf.reduce_mean(tf.cast(img, tf.float32), axis=-1)
+        ink = tf.reduce_max(gray) - gray
+        ink = ink / tf.maximum(tf.reduce_max(ink), 1e-6)
+
+        # ink weighted mean row of the columns within a horizontal Gaussian window
+        sigma = tf.maximum(hf * self.smoothness, 1.0)
+        radius = tf.cast(tf.math.ceil(3 * sigma), tf.int32)
+        x = tf.cast(tf.range(-radius, radius + 1), tf.float32)
+        kernel = tf.exp(-0.5 * tf.square(x / sigma))
+        kernel = tf.reshape(kernel / tf.reduce_sum(kernel), [-1, 1, 1])
+        rows = tf.cast(tf.range(h), tf.float32)[:, tf.newaxis]
+        weighted = tf.stack([tf.reduce_sum(ink * rows, axis=0), tf.reduce_sum(ink, axis=0)], axis=0)
+        smoothed = tf.nn.conv1d(weighted[:, :, tf.newaxis], kernel, stride=1, padding="SAME")[:, :, 0]
+        eps = 1e-3  # columns without any ink nearby are centered in the middle of the line
+        center = (smoothed[0] + eps * (hf - 1) / 2) / (smoothed[1] + eps)
+        center = tf.clip_by_value(tf.cast(tf.round(center), tf.int32), 0, h - 1)
+
+        # gather the rows [center - r, center + r) of each column from the image padded by the background
+        r = tf.maximum(1, (h + 1) // 2)
+        background = tf.reduce_max(img, axis=[0, 1])
+        pad = tf.broadcast_to(background, tf.stack([r, tf.shape(img)[1], tf.shape(img)[2]]))
+        padded = tf.concat([pad, img, pad], axis=0)
+        indices = center[:, tf.newaxis] + tf.range(2 * r)[tf.newaxis, :]
+        columns = tf.gather(tf.transpose(padded, [1, 0, 2]), indices, batch_dims=1)
+        return tf.transpose(columns, [1, 0, 2])
+
+
+class TFFinalPreparation(TFImageProcessor):
+    def apply_tf(self, img):
+        data = tf.cast(img, tf.float32) / 255
+        if self.params.normalize:
+            amax = tf.reduce_max(data)
+            data = data / tf.where(amax > 0, amax, 1.0)
+        if self.params.invert:
+            data = tf.reduce_max(data) - data
+        if self.params.transpose:
+            data = tf.transpose(data, [1, 0, 2])
+        if self.params.pad > 0:
+            padding = [[self.params.pad, self.params.pad], [0, 0], [0, 0]]
+            if not self.params.transpose:
+                padding = [padding[1], padding[0], padding[2]]
+            data = tf.pad(data, padding, constant_values=float(self.params.pad_value))
+        return tf.cast(data * 255, tf.uint8)
+
+    def apply_shape(self, shape, meta):
+        return shape
+
+
+TF_IMAGE_PROCESSORS: Dict[Type[DataProcessorParams], Type[TFImageProcessor]] = {
+    DataRangeProcessorParams: TFDataRange,
+    ScaleToHeightProcessorParams: TFScaleToHeight,
+    CenterNormalizerProcessorParams: TFCenterNormalizer,
+    FinalPreparationProcessorParams: TFFinalPreparation,
+}
+
+
+@pai_dataclass(alt="TFImageProcessing")
+@dataclass
+class TFImageProcessingProcessorParams(DataProcessorParams):
+    """
+    Replaces image processors that are applied in the TF input graph instead (see `TFImageProcessing`). In python, the
+    line is only converted to uint8 and the meta data of the processors is recorded.
+    Is not meant to be set up manually, see `with_tf_image_processing`.
+    """
+
+    processors: List[DataProcessorParams] = field(default_factory=list)
+    # the pre-processing that was wrapped, restored by `without_tf_image_processing`
+    python_pre_proc: Optional[SequentialProcessorPipelineParams] = field(default=None, metadata=pai_meta(mode="ignore"))
+
+    @staticmethod
+    def cls() -> Type["ImageProcessor"]:
+        return TFImageProcessingProcessor
+
+
+class TFImageProcessingProcessor(ImageProcessor[TFImageProcessingProcessorParams]):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        processor_params = [p for p in self.params.processors if self.mode in p.modes]
+        self.processors = [p.create(self.data_params, self.mode) for p in processor_params]
+        self.tf_processors = [TF_IMAGE_PROCESSORS[type(p)](p, self.data_params) for p in processor_params]
+
+    def _apply_single(self, data, meta):
+        if self.tf_processors and isinstance(self.tf_processors[0], TFDataRange):
+            data = to_uint8(data)
+        else:
+            data = data.astype(np.uint8)
+        shape = data.shape[:2]
+        for processor in self.tf_processors:
+            shape = processor.apply_shape(shape, meta)
+        return data
+
+    def local_to_global_pos(self, x, params):
+        for processor in self.processors:
+            x = processor.local_to_global_pos(x, params)
+        return x
+
+
+class TFImageProcessing:
+    """
+    Applies the image processors of a TFImageProcessingProcessor on the samples of a tf.data.Dataset (parallel map).
+    The line width is only known afterwards, so the `img_len` and the checks of the line width of PrepareSample
+    (training and evaluation only) are applied here, too.
+    """
+
+    def __init__(self, params: TFImageProcessingProcessorParams, data_params, mode: PipelineMode):
+        self.data_params = data_params
+        self.mode = mode
+        self.processors = [TF_IMAGE_PROCESSORS[type(p)](p, data_params) for p in params.processors if mode in p.modes]
+        self.max_line_width = 0
+        for p in data_params.pre_proc.processors_of_type(PrepareSampleProcessorParams):
+            if mode in p.modes:
+                self.max_line_width = p.max_line_width
+
+    def apply(self, img: tf.Tensor) -> tf.Tensor:
+        for processor in self.processors:
+            img = processor.apply_tf(img)
+        return tf.ensure_shape(img, [None, self.data_params.line_height, self.data_params.input_channels])
+
+    def transform(self, dataset: "tf.data.Dataset") -> "tf.data.Dataset":
+        def apply(inputs, *args):
+            inputs = dict(inputs)
+            inputs["img"] = self.apply(inputs["img"])
+            inputs["img_len"] = tf.shape(inputs["img"])[:1]
+            return (inputs,) + args
+
+        dataset = dataset.map(apply, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        if self.mode in {PipelineMode.TRAINING, PipelineMode.EVALUATION}:
+            dataset = dataset.filter(self.is_valid_line)
+        return dataset
+
+    def is_valid_line(self, inputs, targets, *args) -> tf.Tensor:
+        """The width checks of `PrepareSample.is_valid_line`"""
+        width = inputs["img_len"][0]
+        gt = targets["gt"]
+        required_len = tf.size(gt) + tf.reduce_sum(tf.cast(tf.equal(gt[1:], gt[:-1]), tf.int32))
+        valid = required_len <= width // self.data_params.downscale_factor
+        if self.max_line_width > 0:
+            valid = tf.logical_and(valid, width <= self.max_line_width)
+        return valid
+
+
+def with_tf_image_processing(pre_proc: SequentialProcessorPipelineParams) -> SequentialProcessorPipelineParams:
+    """
+    Replace the leading image processors of the pre-processing by a TFImageProcessingProcessor. All image processors
+    must have a TF implementation (see `TF_IMAGE_PROCESSORS`).
+    """
+    if pre_proc.processors and isinstance(pre_proc.processors[0], TFImageProcessingProcessorParams):
+        return pre_proc
+
+    n = 0
+    while n < len(pre_proc.processors) and issubclass(pre_proc.processors[n].cls(), ImageProcessor):
+        if type(pre_proc.processors[n]) not in TF_IMAGE_PROCESSORS:
+            raise ValueError(f"The image processor {pre_proc.processors[n]} can not be applied in the TF input graph.")
+        n += 1
+    if n == 0:
+        return pre_proc
+
+    image_processors = pre_proc.processors[:n]
+    tf_processing = copy(pre_proc)
+    tf_processing.processors = [
+        TFImageProcessingProcessorParams(
+            modes=set().union(*(p.modes for p in image_processors)),
+            processors=image_processors,
+            python_pre_proc=pre_proc,
+        )
+    ] + pre_proc.processors[n:]
+    return tf_processing
+
+
+def without_tf_image_processing(pre_proc: SequentialProcessorPipelineParams) -> SequentialProcessorPipelineParams:
+    """The inverse of `with_tf_image_processing`, returns the original pre-processing if available"""
+    if not pre_proc.processors or not isinstance(pre_proc.processors[0], TFImageProcessingProcessorParams):
+        return pre_proc
+    if pre_proc.processors[0].python_pre_proc is not None:
+        return pre_proc.processors[0].python_pre_proc
+
+    python_pre_proc = copy(pre_proc)
+    python_pre_proc.processors = pre_proc.processors[0].processors + pre_proc.processors[1:]
+    return python_pre_proc
+
+
+def tf_image_processing_of(
+    pre_proc: SequentialProcessorPipelineParams, data_params, mode: PipelineMode
+) -> Optional[TFImageProcessing]:
+    if pre_proc.processors and isinstance(pre_proc.processors[0], TFImageProcessingProcessorParams):
+        return TFImageProcessing(pre_proc.processors[0], data_params, mode)
+    return None
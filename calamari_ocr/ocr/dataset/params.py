@@ -23,6 +23,26 @@ class DataParams(DataBaseParams):
     line_height: int = field(default=48, metadata=pai_meta(help="The line height"))
     ensemble: int = field(default=0, metadata=pai_meta(mode="ignore"))  # Set based on model
     codec: Optional[Codec] = field(default=None, metadata=pai_meta(mode="ignore"))
+    line_cache_dir: Optional[str] = field(
+        default=None,
+        metadata=pai_meta(
+            help="Directory of an on-disk cache of the pre-processed lines. Lines that were already pre-processed by "
+            "the same image processors (e.g. in a previous training run) are loaded instead of processed again."
+        ),
+    )
+    line_cache_max_size_mb: int = field(
+        default=16384,
+        metadata=pai_meta(help="Maximum size of the line cache, the least recently used lines are evicted"),
+    )
+    tf_image_processing: bool = field(
+        default=False,
+        metadata=pai_meta(
+            help="Apply the image processors in the TF input graph (parallel map of tf.data) instead of in python. "
+            "The CenterNormalizer is approximated, so use the same setting for training and prediction. Not "
+            "supported with preloaded data, data augmentation, and the width batching, chunking, or blank line "
+            "skipping of the predictor."
+        ),
+    )
 
     @staticmethod
     def cls():
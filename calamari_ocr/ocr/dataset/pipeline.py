@@ -1,9 +1,18 @@
 from typing import Iterable
 
+import tensorflow as tf
 from tfaip.data.pipeline.datapipeline import DataPipeline, DataGenerator
 from tfaip.data.pipeline.definitions import Sample, PipelineMode
+from tfaip.data.pipeline.tfdatasetgenerator import TFDatasetGenerator
 
 from calamari_ocr.ocr.dataset.datareader.base import CalamariDataGeneratorParams
+from calamari_ocr.ocr.dataset.imageprocessors.line_cache import with_line_cache, without_line_cache
+from calamari_ocr.ocr.dataset.imageprocessors.tf_image_processing import (
+    TFImageProcessing,
+    tf_image_processing_of,
+    with_tf_image_processing,
+    without_tf_image_processing,
+)
 
 
 class CalamariPipeline(DataPipeline):
@@ -15,6 +24,8 @@ class CalamariPipeline(DataPipeline):
         input_processors=None,
         output_processors=None,
     ):
+        self._line_cache = (data_base.params.line_cache_dir, data_base.params.line_cache_max_size_mb)
+        self._tf_image_processing = data_base.params.tf_image_processing
         super(CalamariPipeline, self).__init__(
             pipeline_params,
             data_base,
@@ -29,6 +40,24 @@ class CalamariPipeline(DataPipeline):
             False  # TODO: parallel support, but currently in voter this makes one prediction per pipeline, mega slow
         )
 
+    @property
+    def _input_processors(self):
+        # the image processors are wrapped on access, so that changes of the pre-processing (e.g. erasing the
+        # augmentation) are applied
+        if self._tf_image_processing:
+            return with_tf_image_processing(self._pre_proc)
+        return with_line_cache(self._pre_proc, *self._line_cache)
+
+    @_input_processors.setter
+    def _input_processors(self, pre_proc):
+        self._pre_proc = without_line_cache(without_tf_image_processing(pre_proc))
+
+    def create_tf_dataset_generator(self) -> TFDatasetGenerator:
+        image_processing = tf_image_processing_of(self._input_processors, self.data.params, self.mode)
+        if image_processing is None:
+            return super().create_tf_dataset_generator()
+        return CalamariTFDatasetGenerator(self, image_processing)
+
     def reader(self):
         if self._reader is None:
             self._reader = self.generator_params.create(self.mode)
@@ -58,3 +87,19 @@ class CalamariPipeline(DataPipeline):
                 return reader.generate()
 
         return Gen(self.mode, self.generator_params)
+
+
+class CalamariTFDatasetGenerator(TFDatasetGenerator):
+    """Applies the image processors in the input graph, the generated lines thus have an arbitrary shape"""
+
+    def __init__(self, data_pipeline: DataPipeline, image_processing: TFImageProcessing):
+        super().__init__(data_pipeline)
+        self.image_processing = image_processing
+
+    def input_layer_specs(self):
+        specs = dict(super().input_layer_specs())
+        specs["img"] = tf.TensorSpec([None, None, None], dtype=tf.uint8)
+        return specs
+
+    def _transform(self, dataset: "tf.data.Dataset") -> "tf.data.Dataset":
+        return self.image_processing.transform(super()._transform(dataset))
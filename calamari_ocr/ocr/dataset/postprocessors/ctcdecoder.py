@@ -1,6 +1,7 @@
 from dataclasses import dataclass, field
-from typing import Type
+from typing import Type, List, Dict, Optional
 
+import numpy as np
 from paiargparse import pai_dataclass
 from tfaip.data.pipeline.definitions import PipelineMode, Sample
 from tfaip.data.pipeline.processor.dataprocessor import (
@@ -11,7 +12,13 @@ from tfaip.data.pipeline.processor.dataprocessor import (
 from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder import (
     create_ctc_decoder,
     CTCDecoderParams,
+    ctc_log_probabilities,
 )
+from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder_pool import CTCDecoderPool
+from calamari_ocr.ocr.predict.params import Prediction
+
+# Key of the outputs of a sample that holds the Prediction if the sample was already decoded as part of its batch
+DECODED_PREDICTION = "decoded_prediction"
 
 
 @pai_dataclass
@@ -19,6 +26,17 @@ from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder import (
 class CTCDecoderProcessorParams(DataProcessorParams):
     ctc_decoder_params: CTCDecoderParams = field(default_factory=CTCDecoderParams)
 
+    # decode the padded outputs of complete batches in the predictor (see `CTCDecoderProcessor.decode_batch`)
+    # instead of decoding each sample individually
+    batched: bool = False
+
+    # decode the samples of a batch in a pool of processes (> 1) that share the decoder, implies batched decoding
+    decoder_processes: int = 1
+
+    # compute the probability of the decoded sentence (sum of all paths) by the CTC forward algorithm and store it as
+    # the total_probability of the Prediction, the forward pass costs about as much as the default decoding
+    total_probability: bool = False
+
     @staticmethod
     def cls() -> Type["MappingDataProcessor"]:
         return CTCDecoderProcessor
@@ -39,17 +57,24 @@ class CTCDecoderProcessor(MappingDataProcessor[CTCDecoderProcessorParams]):
     ):
         super().__init__(params, data_params, mode)
         self.ctc_decoder = create_ctc_decoder(data_params.codec, self.params.ctc_decoder_params)
+        self.ctc_decoder_pool = None
+        if self.params.decoder_processes > 1:
+            # the workers of the pool receive the prebuilt decoder (and its language model) when they are started
+            self.ctc_decoder_pool = CTCDecoderPool(self.ctc_decoder, self.params.decoder_processes)
 
     def apply(self, sample: Sample) -> Sample:
         if sample.targets and "gt" in sample.targets:
             sample.targets["sentence"] = "".join(self.data_params.codec.decode(sample.targets["gt"]))
         if sample.outputs:
+            if DECODED_PREDICTION in sample.outputs:
+                return sample.new_outputs(sample.outputs[DECODED_PREDICTION])
 
             def decode(suffix):
-                outputs = self.ctc_decoder.decode(sample.outputs["softmax" + suffix].astype(float))
-                outputs.labels = list(map(int, outputs.labels))
-                outputs.sentence = "".join(self.data_params.codec.decode(outputs.labels))
-                return outputs
+                softmax = sample.outputs["softmax" + suffix]
+                prediction = self._finalize(self.ctc_decoder.decode(softmax))
+                if self.params.total_probability:
+                    self._set_total_probabilities(softmax[np.newaxis], [len(softmax)], [prediction])
+                return prediction
 
             outputs = decode("")
             outputs.voter_predictions = []
@@ -58,3 +83,69 @@ class CTCDecoderProcessor(MappingDataProcessor[CTCDecoderProcessorParams]):
 
             sample = sample.new_outputs(outputs)
         return sample
+
+    def decode_batch(self, outputs: Dict[str, np.ndarray]) -> List[Prediction]:
+        """
+        Decode the padded outputs of a complete batch as produced by the model, i.e. before the
+        `ReshapeOutputsProcessor` cuts the individual samples. The softmax of all samples and of all ensemble members
+        is decoded in one call of the CTCDecoder.
+
+        Returns
+        -------
+            the Prediction of each sample in the batch, including the predictions of the ensemble members
+        """
+        suffixes = [""] + [f"_{i}" for i in range(self.data_params.ensemble)]
+        softmax = np.concatenate([outputs["softmax" + suffix] for suffix in suffixes], axis=0)
+        lengths = np.concatenate([np.reshape(outputs["out_len" + suffix], -1) for suffix in suffixes])
+        decoder = self.ctc_decoder_pool or self.ctc_decoder
+        predictions = [self._finalize(p) for p in decoder.decode_batch(softmax, lengths)]
+        if self.params.total_probability:
+            self._set_total_probabilities(softmax, lengths, predictions)
+
+        batch_size = len(predictions) // len(suffixes)
+        batch_predictions = predictions[:batch_size]
+        for i, prediction in enumerate(batch_predictions):
+            prediction.voter_predictions = predictions[batch_size + i :: batch_size]
+
+        return batch_predictions
+
+    def _set_total_probabilities(self, softmax, lengths, predictions: List[Prediction]):
+        log_p = ctc_log_probabilities(
+            softmax, lengths, [p.labels for p in predictions], self.params.ctc_decoder_params.blank_index
+        )
+        for prediction, p in zip(predictions, np.exp(log_p).tolist()):
+            prediction.total_probability = p
+
+    def _finalize(self, prediction: Prediction) -> Prediction:
+        prediction.labels = list(map(int, prediction.labels))
+        prediction.sentence = "".join(self.data_params.codec.decode(prediction.labels))
+        return prediction
+
+
+class BatchCTCDecoder:
+    """
+    Decodes complete batches in the predictor if the CTCDecoderProcessor of the post-processing pipeline is set up to
+    do so (`CTCDecoderProcessorParams.batched` or `decoder_processes`). The processor is only created on demand.
+    """
+
+    def __init__(self, data_params, mode: PipelineMode):
+        self.data_params = data_params
+        self.mode = mode
+        self._processor: Optional[CTCDecoderProcessor] = None
+
+    def __call__(self, outputs: Dict[str, np.ndarray]) -> Optional[List[Prediction]]:
+        params = next(
+            (
+                p
+                for p in self.data_params.post_proc.processors_of_type(CTCDecoderProcessorParams)
+                if (p.batched or p.decoder_processes > 1) and self.mode in p.modes
+            ),
+            None,
+        )
+        if params is None:
+            return None
+
+        if self._processor is None or self._processor.params is not params:
+            self._processor = params.create(self.data_params, self.mode)
+
+        return self._processor.decode_batch(outputs)
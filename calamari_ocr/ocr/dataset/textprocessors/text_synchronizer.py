@@ -1,18 +1,23 @@
-import numpy as np
+from typing import List, Optional, Sequence, Tuple
 
 
 class Sync:
     def __init__(self, texts, substr=None, match=None):
         self.texts = texts
 
-        if substr:
-            assert substr.shape[0] == len(self.texts)
-            self.substr = substr
+        # (start, stop, length) of the substring of each text
+        if substr is not None:
+            assert len(substr) == len(self.texts)
+            self.substr: List[Tuple[int, int, int]] = [tuple(int(v) for v in s) for s in substr]
         else:
-            self.substr = np.zeros((len(texts), 3), dtype=int)
+            self.substr = [(0, 0, 0)] * len(texts)
 
         self.match = match
 
+        # neighbours in the list of syncs during the synchronization
+        self.prev: Optional[Sync] = None
+        self.next: Optional[Sync] = None
+
     def __str__(self):
         return str(self.substr)
 
@@ -20,127 +25,197 @@ class Sync:
         return [self.texts[i][start : start + length] for i, (start, end, length) in enumerate(self.substr)]
 
     def is_valid(self):
-        return np.any(self.substr[:, 2] > 0)
+        return any(length > 0 for _, _, length in self.substr)
 
     def lengths(self):
-        return self.substr[:, 2]
+        return [length for _, _, length in self.substr]
 
     def start(self, idx):
-        return self.substr[idx, 0]
+        return self.substr[idx][0]
 
     def stop(self, idx):
-        return self.substr[idx, 1]
+        return self.substr[idx][1]
 
     def length(self, idx):
-        return self.substr[idx, 2]
+        return self.substr[idx][2]
 
     def set_start(self, idx, v):
-        self.substr[idx, 0] = v
+        _, stop, length = self.substr[idx]
+        self.substr[idx] = (v, stop, length)
 
     def set_stop(self, idx, v):
-        self.substr[idx, 1] = v
+        start, _, length = self.substr[idx]
+        self.substr[idx] = (start, v, length)
 
     def set_length(self, idx, v):
-        self.substr[idx, 2] = v
+        start, stop, _ = self.substr[idx]
+        self.substr[idx] = (start, stop, v)
 
     def set_all(self, idx, v):
-        self.substr[idx, :] = v
+        self.substr[idx] = tuple(v)
+
+    def insert_before(self, sync: "Sync"):
+        sync.prev, sync.next = self.prev, self
+        if self.prev is not None:
+            self.prev.next = sync
+        self.prev = sync
+
+    def insert_after(self, sync: "Sync"):
+        sync.prev, sync.next = self, self.next
+        if self.next is not None:
+            self.next.prev = sync
+        self.next = sync
+
+
+def longest_common_substring(a: str, b: str) -> Tuple[int, int, int]:
+    """
+    Find the longest common substring of a and b in linear time by a suffix automaton of b.
+    If there are multiple, the one that starts first in a is chosen, and its first occurrence in b.
+
+    Returns
+    -------
+        the length and the start in a and b (0, 0, 0 if there is no common character)
+    """
+    if not a or not b:
+        return 0, 0, 0
+
+    # suffix automaton of b: transitions, suffix links and the length of the longest string of each state
+    trans = [{}]
+    link = [-1]
+    length = [0]
+    last = 0
+    for c in b:
+        cur = len(length)
+        trans.append({})
+        link.append(0)
+        length.append(length[last] + 1)
+        p = last
+        while p != -1 and c not in trans[p]:
+            trans[p][c] = cur
+            p = link[p]
+        if p != -1:
+            q = trans[p][c]
+            if length[p] + 1 == length[q]:
+                link[cur] = q
+            else:
+                clone = len(length)
+                trans.append(dict(trans[q]))
+                link.append(link[q])
+                length.append(length[p] + 1)
+                while p != -1 and trans[p].get(c) == q:
+                    trans[p][c] = clone
+                    p = link[p]
+                link[q] = clone
+                link[cur] = clone
+        last = cur
+
+    # longest substring of b that ends at each position of a, the first end of the longest one is kept
+    state, cur_len = 0, 0
+    best, best_end = 0, 0
+    for i, c in enumerate(a):
+        while state and c not in trans[state]:
+            state = link[state]
+            cur_len = length[state]
+        next_state = trans[state].get(c)
+        if next_state is None:
+            state, cur_len = 0, 0
+        else:
+            state, cur_len = next_state, cur_len + 1
+        if cur_len > best:
+            best, best_end = cur_len, i
 
+    if best == 0:
+        return 0, 0, 0
 
-def synchronize(texts):
-    def init():
-        sync = Sync(texts)
-        for i, text in enumerate(texts):
-            sync.set_all(i, [0, len(text) - 1, len(text)])
+    start = best_end - best + 1
+    return best, start, b.find(a[start : start + best])
 
-        if sync.is_valid():
-            return [sync]
 
-        return []
+def _as_strings(texts: Sequence[Sequence]) -> List[str]:
+    # texts can also be lists of chars (e.g., multi code point characters), map each element to a single code point
+    if all(isinstance(t, str) for t in texts):
+        return list(texts)
+
+    codes = {}
+    return ["".join(chr(codes.setdefault(c, len(codes))) for c in t) for t in texts]
+
+
+def synchronize(texts):
+    strings = _as_strings(texts)
+
+    def longest_match(start1, stop1, idx, start2, stop2):
+        length, mstart1, mstart2 = longest_common_substring(
+            strings[0][start1 : stop1 + 1], strings[idx][start2 : stop2 + 1]
+        )
+        if length == 0:
+            return 0, 0, 0
+        return length, start1 + mstart1, start2 + mstart2
 
-    def longest_match(maxlen, c1, start1, stop1, c2, start2, stop2):
-        mstart1 = 0
-        mstart2 = 0
-        s1limit = stop1 - maxlen
-        s2limit = stop2 - maxlen
-        for s1 in range(start1, s1limit + 1):
-            for s2 in range(start2, s2limit + 1):
-                if c1[s1] == c2[s2]:
-                    i1 = s1 + 1
-                    i2 = s2 + 1
-                    while i1 <= stop1 and i2 <= stop2 and c1[i1] == c2[i2]:
-                        i1 += 1
-                        i2 += 1
-
-                    increase = i1 - s1 - maxlen
-                    if increase > 0:
-                        s1limit -= increase
-                        s2limit -= increase
-                        maxlen += increase
-                        mstart1 = s1
-                        mstart2 = s2
-
-        return maxlen, mstart1, mstart2
-
-    def save_match(synclist, num_text, sync, start, length, match):
+    def save_match(sync, start, length):
         left, right = Sync(texts), Sync(texts)
-        for i in range(num_text):
+        for i in range(len(texts)):
+            sync_start, sync_stop, _ = sync.substr[i]
             stop = start[i] + length - 1
-            left.set_all(i, [sync.start(i), start[i] - 1, start[i] - sync.start(i)])
-            right.set_all(i, [stop + 1, sync.stop(i), sync.stop(i) - stop])
-            sync.set_all(i, [start[i], stop, length])
+            left.substr[i] = (sync_start, start[i] - 1, start[i] - sync_start)
+            right.substr[i] = (stop + 1, sync_stop, sync_stop - stop)
+            sync.substr[i] = (start[i], stop, length)
 
-        sync.match = match
+        sync.match = True
         if left.is_valid():
-            synclist.insert(synclist.index(sync), left)
+            sync.insert_before(left)
 
         if right.is_valid():
-            synclist.insert(synclist.index(sync) + 1, right)
+            sync.insert_after(right)
 
-    def recursive_sync(synclist, texts, start_index):
-        sync = synclist[start_index]
-        if np.any(sync.lengths() == 0):
-            return
+    def sync_match(sync) -> bool:
+        # match the longest common substring of all texts within the sync, returns False if there is none
+        if any(length == 0 for length in sync.lengths()):
+            return False
 
-        start = np.zeros(len(texts), dtype=int)
+        start = [0] * len(texts)
         start[0] = sync.start(0)
         length = sync.length(0)
-        for i, text in enumerate(texts[1:], 1):
-            length, new_start, start[i] = longest_match(
-                0,
-                texts[0],
-                start[0],
-                start[0] + length - 1,
-                text,
-                sync.start(i),
-                sync.stop(i),
-            )
+        for i in range(1, len(texts)):
+            length, new_start, start[i] = longest_match(start[0], start[0] + length - 1, i, sync.start(i), sync.stop(i))
 
             if length == 0:
-                return
+                return False
 
             change = new_start - start[0]
             if change > 0:
                 for j in range(i):
                     start[j] += change
 
-        save_match(synclist, len(texts), sync, start, length, True)
-
-        start_index = synclist.index(sync)
-        if start_index - 1 >= 0:
-            recursive_sync(synclist, texts, start_index - 1)
-
-        start_index = synclist.index(sync)
-        if start_index + 1 < len(synclist):
-            recursive_sync(synclist, texts, start_index + 1)
+        save_match(sync, start, length)
+        return True
 
-        return
-
-    synclist = init()
-
-    if len(synclist) > 0:
-        recursive_sync(synclist, texts, 0)
+    if not any(len(text) > 0 for text in texts):
+        return []
 
+    head = Sync(texts, [(0, len(text) - 1, len(text)) for text in texts])
+    # sentinel before the first sync, since syncs are inserted in front of the first one
+    root = Sync(texts)
+    root.insert_after(head)
+
+    # recursively sync the neighbours of each new match, first the left one then the right one (stack instead of
+    # recursion, the right neighbour is determined after the left one was processed)
+    stack = [(head, False)]
+    while stack:
+        sync, left_done = stack.pop()
+        if not left_done:
+            if not sync_match(sync):
+                continue
+            stack.append((sync, True))
+            if sync.prev is not root:
+                stack.append((sync.prev, False))
+        elif sync.next is not None:
+            stack.append((sync.next, False))
+
+    synclist = []
+    sync = root.next
+    while sync is not None:
+        synclist.append(sync)
+        sync.prev, sync.next, sync = None, None, sync.next
     return synclist
 
 
@@ -0,0 +1,219 @@
+# CTC prefix beam search with optional shallow fusion of a character n-gram language model.
+#
+# The beams of a frame are extended by all characters at once: the scores of all extensions are a (beams x chars)
+# matrix from which the best candidates are selected. Frames that are (almost) certainly blank only update the scores
+# of the existing beams. As in the word beam search, the text of a beam is interned as a prefix (parent + label).
+
+from dataclasses import dataclass
+from typing import List, Tuple, Optional, Dict
+
+import numpy as np
+
+from calamari_ocr.ocr.model.ctcdecoder.blank_pruning import prune_blank_frames, restore_frames
+from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder import CTCDecoder
+from calamari_ocr.ocr.model.ctcdecoder.ngram_language_model import (
+    CharacterNGramLanguageModel,
+    load_character_ngram_language_model,
+)
+from calamari_ocr.ocr.predict.params import Prediction
+
+# characters with a lower log probability in a frame are not considered as extension of a beam
+MIN_CHAR_LOG_P = np.log(1e-5)
+
+
+class BeamSearchCTCDecoder(CTCDecoder):
+    def __init__(self, params, codec):
+        super().__init__(params, codec)
+        self.threshold = params.min_p_threshold if params.min_p_threshold > 0 else 0.0001
+        self.language_model = None
+        if params.lm_path:
+            self.language_model = load_character_ngram_language_model(params.lm_path, codec.charset)
+
+    def decode(self, probabilities) -> Prediction:
+        return self.decode_n_best(probabilities, 1)[0][0]
+
+    def decode_n_best(self, probabilities, n_best: int) -> List[Tuple[Prediction, float]]:
+        """
+        Decode the n best hypotheses of the beam search.
+
+        Returns
+        -------
+            a list of the Predictions and their scores (log space: the CTC probability of the labels plus the weighted
+            language model score and the insertion bonus) sorted by descending score
+        """
+        pruned, frame_map = prune_blank_frames(
+            probabilities, self.params.blank_pruning_threshold, self.params.blank_index
+        )
+        hypotheses = prefix_beam_search(
+            pruned,
+            self.params.beam_width if self.params.beam_width > 0 else 25,
+            blank_index=self.params.blank_index,
+            language_model=self.language_model,
+            lm_weight=self.params.lm_weight,
+            insertion_bonus=self.params.insertion_bonus,
+            blank_skip_threshold=self.params.blank_pruning_threshold,
+            n_best=n_best,
+        )
+        predictions = []
+        for h in hypotheses:
+            sentence = [(l, f, f + 1) for l, f in zip(h.labels, h.frames)]
+            prediction = self.find_alternatives(pruned, sentence, self.threshold)
+            predictions.append((restore_frames(prediction, probabilities, frame_map), h.score))
+        return predictions
+
+
+@dataclass
+class Hypothesis:
+    labels: List[int]
+    frames: List[int]  # the frame in which each label was emitted
+    score: float  # acoustic_score + weighted language model score + insertion bonus
+    acoustic_score: float  # log probability of the labels (as far as covered by the beams)
+
+
+class _Prefixes:
+    """Interned texts of the beams, each prefix is stored as its parent prefix, its label, and its emission frame"""
+
+    def __init__(self, context):
+        self.parents = [-1]  # 0 is the empty text
+        self.labels = [-1]
+        self.frames = [-1]
+        self.contexts = [context]  # language model context
+        self._ids: Dict[Tuple[int, int], int] = {}
+
+    def get(self, parent: int, label: int, frame: int, context) -> int:
+        key = (parent, label)
+        prefix = self._ids.get(key)
+        if prefix is None:
+            prefix = self._ids[key] = len(self.parents)
+            self.parents.append(parent)
+            self.labels.append(label)
+            self.frames.append(frame)
+            self.contexts.append(context)
+        return prefix
+
+    def backtrace(self, prefix: int) -> Tuple[List[int], List[int]]:
+        labels, frames = [], []
+        while prefix > 0:
+            labels.append(self.labels[prefix])
+            frames.append(self.frames[prefix])
+            prefix = self.parents[prefix]
+        return labels[::-1], frames[::-1]
+
+
+def prefix_beam_search(
+    mat,
+    beam_width: int,
+    blank_index: int = 0,
+    language_model: Optional[CharacterNGramLanguageModel] = None,
+    lm_weight: float = 0.5,
+    insertion_bonus: float = 0.0,
+    blank_skip_threshold: float = 0.999,
+    n_best: int = 1,
+) -> List[Hypothesis]:
+    """
+    Decode the probabilities (shape T x C) by a CTC prefix beam search.
+
+    Parameters
+    ----------
+    mat : array_like
+        probabilities of shape (length x chars)
+    beam_width : int
+        number of beams that are kept in each frame
+    blank_index : int
+        index of the blank label
+    language_model : CharacterNGramLanguageModel, optional
+        the language model whose weighted log probability is added to the score of each character
+    lm_weight : float
+        weight of the language model
+    insertion_bonus : float
+        added to the score of each character, compensates the penalty of the language model for longer texts
+    blank_skip_threshold : float
+        frames with a blank probability of at least this value do not extend the beams
+    n_best : int
+        number of hypotheses to return
+
+    Returns
+    -------
+        the best hypotheses sorted by descending score
+    """
+    with np.errstate(divide="ignore"):
+        log_mat = np.log(np.asarray(mat, dtype=np.float64))
+    log_blank_skip = np.log(blank_skip_threshold) if blank_skip_threshold > 0 else -np.inf
+    lm_weight = lm_weight if language_model is not None else 0
+
+    prefixes = _Prefixes(language_model.initial_context() if language_model else None)
+
+    # the current beams: their prefix, last label, log probability of ending with a blank or a non-blank, and the
+    # accumulated language model score (including the insertion bonus)
+    beam_prefixes = np.zeros(1, dtype=np.int64)
+    beam_last = np.full(1, -1, dtype=np.int64)
+    beam_pr_blank = np.zeros(1)
+    beam_pr_non_blank = np.full(1, -np.inf)
+    beam_lm = np.zeros(1)
+
+    for t, log_p in enumerate(log_mat):
+        # keep the text of a beam: ends with blank, or ends with non-blank if the last char is repeated
+        pr_total = np.logaddexp(beam_pr_blank, beam_pr_non_blank)
+        stay_pr_blank = pr_total + log_p[blank_index]
+        stay_pr_non_blank = np.where(beam_last >= 0, beam_pr_non_blank + log_p[beam_last], -np.inf)
+        chars = np.flatnonzero(log_p >= MIN_CHAR_LOG_P)
+        chars = chars[chars != blank_index]
+        if log_p[blank_index] >= log_blank_skip or len(chars) == 0:
+            beam_pr_blank, beam_pr_non_blank = stay_pr_blank, stay_pr_non_blank
+            continue
+
+        # extend all beams by all characters that are likely enough in this frame
+        # same chars must be separated by blank, different chars can be neighbours
+        ext_pr = log_p[chars] + np.where(
+            chars == beam_last[:, np.newaxis], beam_pr_blank[:, np.newaxis], pr_total[:, np.newaxis]
+        )
+        ext_lm = np.full(ext_pr.shape, insertion_bonus) + beam_lm[:, np.newaxis]
+        if lm_weight != 0:
+            ext_lm += lm_weight * np.stack([language_model.scores(prefixes.contexts[p])[chars] for p in beam_prefixes])
+
+        # an extension that results in the text of another beam is merged into that beam
+        beam_index = {p: i for i, p in enumerate(beam_prefixes.tolist())}
+        char_index = {c: i for i, c in enumerate(chars.tolist())}
+        for j, (p, c) in enumerate(zip(beam_prefixes.tolist(), beam_last.tolist())):
+            i = beam_index.get(prefixes.parents[p])
+            k = char_index.get(c)
+            if i is not None and k is not None and np.isfinite(ext_pr[i, k]):
+                stay_pr_non_blank[j] = np.logaddexp(stay_pr_non_blank[j], ext_pr[i, k])
+                ext_pr[i, k] = -np.inf
+
+        # keep the best candidates: the existing beams followed by all extensions (row major)
+        scores = np.concatenate(
+            [np.logaddexp(stay_pr_blank, stay_pr_non_blank) + beam_lm, (ext_pr + ext_lm).reshape(-1)]
+        )
+        candidates = np.flatnonzero(np.isfinite(scores))
+        if len(candidates) > beam_width:
+            candidates = candidates[np.argpartition(-scores[candidates], beam_width - 1)[:beam_width]]
+        stays = candidates[candidates < len(beam_prefixes)]
+        exts = candidates[candidates >= len(beam_prefixes)] - len(beam_prefixes)
+        ext_beams, ext_chars = np.divmod(exts, len(chars))
+
+        new_prefixes = []
+        for i, c in zip(ext_beams.tolist(), chars[ext_chars].tolist()):
+            p = int(beam_prefixes[i])
+            context = language_model.next_context(prefixes.contexts[p], c) if language_model else None
+            new_prefixes.append(prefixes.get(p, c, t, context))
+
+        beam_prefixes = np.concatenate([beam_prefixes[stays], np.array(new_prefixes, dtype=np.int64)])
+        beam_last = np.concatenate([beam_last[stays], chars[ext_chars]])
+        beam_pr_blank = np.concatenate([stay_pr_blank[stays], np.full(len(exts), -np.inf)])
+        beam_pr_non_blank = np.concatenate([stay_pr_non_blank[stays], ext_pr[ext_beams, ext_chars]])
+        beam_lm = np.concatenate([beam_lm[stays], ext_lm[ext_beams, ext_chars]])
+
+    acoustic_scores = np.logaddexp(beam_pr_blank, beam_pr_non_blank)
+    scores = acoustic_scores + beam_lm
+    if lm_weight != 0:
+        # probability of the end of the sentence
+        scores += lm_weight * np.array(
+            [language_model.scores(prefixes.contexts[p])[language_model.eos] for p in beam_prefixes]
+        )
+
+    hypotheses = []
+    for i in np.argsort(-scores, kind="stable")[:n_best]:
+        labels, frames = prefixes.backtrace(int(beam_prefixes[i]))
+        hypotheses.append(Hypothesis(labels, frames, float(scores[i]), float(acoustic_scores[i])))
+    return hypotheses
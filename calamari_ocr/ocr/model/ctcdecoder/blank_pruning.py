@@ -0,0 +1,35 @@
+# Frames that are (almost) certainly blank do not change the result of a CTC decoder, except that a blank separates
+# two equal characters. Thus, a run of such frames can be collapsed into a single frame before decoding which speeds
+# up decoders whose cost is proportional to the number of frames (token passing, word beam search, beam search).
+
+from typing import Tuple
+
+import numpy as np
+
+from calamari_ocr.ocr.predict.params import Prediction
+
+
+def prune_blank_frames(probabilities, threshold: float, blank_index: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Collapse runs of frames whose blank probability exceeds the threshold into their first frame.
+
+    Returns
+    -------
+        the remaining frames and the frame map, i.e. the index of each remaining frame in the original frames
+    """
+    probabilities = np.asarray(probabilities)
+    is_blank = probabilities[:, blank_index] > threshold
+    keep = ~is_blank
+    keep[:1] = True
+    keep[1:] |= is_blank[1:] & ~is_blank[:-1]
+    frame_map = np.flatnonzero(keep)
+    return probabilities[frame_map], frame_map
+
+
+def restore_frames(prediction: Prediction, probabilities, frame_map: np.ndarray) -> Prediction:
+    """Map the positions of a prediction of the pruned frames back to the original frames"""
+    for pos in prediction.positions:
+        pos.local_start = int(frame_map[pos.local_start])
+        pos.local_end = int(frame_map[pos.local_end])
+    prediction.logits = probabilities
+    return prediction
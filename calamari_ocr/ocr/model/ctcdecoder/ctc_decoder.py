@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from dataclasses import field, dataclass
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 from paiargparse import pai_dataclass
@@ -17,6 +17,7 @@ class CTCDecoderType(StrEnum):
     Default = "default"
     TokenPassing = "token_passing"
     WordBeamSearch = "word_beam_search"
+    BeamSearch = "beam_search"
 
 
 @pai_dataclass
@@ -30,8 +31,20 @@ class CTCDecoderParams:
     non_word_chars: List[str] = field(default_factory=lambda: list("0123456789[]()_.:;!?{}-'\""))
 
     dictionary: List[str] = field(default_factory=list)
+    # directory to store the language model built from the dictionary, it is reused by all runs with the same dictionary
+    dictionary_cache_dir: Optional[str] = None
     word_separator: str = " "
 
+    # prefix beam search: character n-gram language model (ARPA file) and its weight, the bonus is added per character
+    lm_path: Optional[str] = None
+    lm_weight: float = 0.5
+    insertion_bonus: float = 0.0
+
+    # runs of frames with a higher blank probability are collapsed into a single frame before decoding by the token
+    # passing, word beam search, and beam search decoders, the beam search does not extend its beams in the remaining
+    # frame (1 to disable)
+    blank_pruning_threshold: float = 0.999
+
 
 def create_ctc_decoder(codec, params: CTCDecoderParams = None):
     params = params or CTCDecoderParams()
@@ -47,6 +60,10 @@ def create_ctc_decoder(codec, params: CTCDecoderParams = None):
         from .ctcwordbeamsearchdecoder import WordBeamSearchCTCDecoder
 
         return WordBeamSearchCTCDecoder(params, codec)
+    elif params.type == CTCDecoderType.BeamSearch:
+        from .beam_search_ctc_decoder import BeamSearchCTCDecoder
+
+        return BeamSearchCTCDecoder(params, codec)
 
     raise NotImplemented
 
@@ -75,6 +92,24 @@ class CTCDecoder(ABC):
         """
         return Prediction()
 
+    def decode_batch(self, probabilities, lengths) -> List[Prediction]:
+        """
+        Decode a padded batch of probabilities. By default, each sample is decoded individually by `decode`,
+        decoders that can process all samples at once override this function.
+
+        Parameters
+        ----------
+        probabilities : array_like
+            Padded prediction probabilities of shape (batch size x max length x character probability).
+        lengths : array_like
+            The actual length of each sample in the batch.
+
+        Returns
+        -------
+            a list of Prediction objects, one for each sample
+        """
+        return [self.decode(p[:l]) for p, l in zip(probabilities, np.reshape(lengths, -1))]
+
     def _prediction_from_string(self, probabilities, sentence):
         pred = Prediction()
         pred.labels[:] = self.codec.encode(sentence)
@@ -96,7 +131,7 @@ class CTCDecoder(ABC):
         probabilities : array_like
             Prediction of the neural net to decode or shape (length x character probability).
             The blank index must be 0.
-        sentence : list of tuple (character index, start pos, end pos)
+        sentence : list of tuple (character index, start pos, end pos) or array_like of shape (N, 3)
             The decoded sentence (depends on the CTCDecoder).
             The position refer to the character position in the logits.
         threshold : float
@@ -106,32 +141,175 @@ class CTCDecoder(ABC):
             a Prediction object
 
         """
-        # find alternatives
+        sentence = np.asarray(sentence, dtype=np.int64).reshape(-1, 3)
+        labels, starts, ends = sentence[:, 0], sentence[:, 1], sentence[:, 2]
+        alternatives = compute_alternatives(probabilities, starts, ends, threshold)
+        return self._prediction_from_alternatives(probabilities, labels, starts, ends, *alternatives)
+
+    def _prediction_from_alternatives(self, probabilities, labels, starts, ends, num_alternatives, candidates, p):
+        # create the Prediction of a single line, see `compute_alternatives` for the parameters
         pred = Prediction()
-        pred.labels[:] = [c for c, _, _ in sentence]
+        pred.labels[:] = labels.tolist()
         pred.is_voted_result = False
         pred.logits = probabilities
         pred.avg_char_probability = 0
-        for c, start, end in sentence:
-            p = probabilities[start:end]
-            p = np.max(p, axis=0)
+        if len(labels) == 0:
+            return pred
 
+        for start, end, n, cands, cands_p in zip(
+            starts.tolist(), ends.tolist(), num_alternatives.tolist(), candidates.tolist(), p.tolist()
+        ):
             pos = PredictionPosition(local_start=start, local_end=end - 1)
             pred.positions.append(pos)
-
-            for label in reversed(sorted(range(len(p)), key=lambda v: p[v])):
-                if p[label] < threshold and len(pos.chars) > 0:
-                    break
-                else:
-                    pos.chars.append(
-                        PredictionCharacter(
-                            label=label,
-                            probability=p[label],
-                        )
+            for label, probability in zip(cands[:n], cands_p[:n]):
+                pos.chars.append(
+                    PredictionCharacter(
+                        label=label,
+                        probability=probability,
                     )
+                )
 
-            if len(pos.chars) > 0:
-                pred.avg_char_probability += pos.chars[0].probability
+            pred.avg_char_probability += pos.chars[0].probability
 
-        pred.avg_char_probability /= len(pred.positions) if len(pred.positions) > 0 else 1
+        pred.avg_char_probability /= len(pred.positions)
         return pred
+
+
+def compute_alternatives(probabilities, starts, ends, threshold):
+    """
+    Compute the alternatives of all decoded characters at once.
+
+    Parameters
+    ----------
+    probabilities : array_like
+        Probabilities of shape (length x character probability).
+    starts, ends : array_like
+        The frame range [start, end) of each decoded character. Each range must not be empty.
+    threshold : float
+        Minimum confidence for alternative characters to be listed.
+
+    Returns
+    -------
+        num_alternatives: the number of alternatives of each character, i.e. all characters that reach the threshold
+            within the range but at least one
+        candidates: the labels of the alternatives of each character sorted by descending probability (ties by
+            descending label), only the first `num_alternatives` entries of a row are valid
+        p: the (maximum) probabilities of the candidates within the range
+    """
+    num_chars = probabilities.shape[1]
+    if len(starts) == 0:
+        return (
+            np.zeros((0,), dtype=np.int64),
+            np.zeros((0, 1), dtype=np.int64),
+            np.zeros((0, 1), dtype=probabilities.dtype),
+        )
+
+    # maximum probability of each character within its range [start, end): gather the frames of all ranges and
+    # reduce each range at once
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    if len(offsets) == lengths.sum():
+        max_p = probabilities[starts]
+    else:
+        frames = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+        max_p = np.maximum.reduceat(probabilities[frames], offsets, axis=0)
+
+    # all characters above the threshold sorted by descending probability (ties by descending label), but at
+    # least the best one. Compare in float64 to match the threshold exactly.
+    num_above = np.count_nonzero(max_p.astype(np.float64) >= threshold, axis=1)
+    k = max(1, int(num_above.max()))
+    if k < num_chars:
+        candidates = np.argpartition(-max_p, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(num_chars), max_p.shape)
+    p = np.take_along_axis(max_p, candidates, axis=1)
+    order = np.lexsort((-candidates, -p), axis=-1)
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    p = np.take_along_axis(p, order, axis=1)
+
+    # if no character reaches the threshold the best one is used, for ties the one with the highest label
+    none_above = np.flatnonzero(num_above == 0)
+    if len(none_above) > 0:
+        best = num_chars - 1 - np.argmax(max_p[none_above, ::-1], axis=1)
+        candidates[none_above, 0] = best
+        p[none_above, 0] = max_p[none_above, best]
+
+    return np.maximum(num_above, 1), candidates, p
+
+
+def ctc_log_probabilities(probabilities, lengths, labels, blank_index=0) -> np.ndarray:
+    """
+    Compute the log probability of label sequences given the (padded) probabilities of a batch of lines by the CTC
+    forward algorithm, i.e. the sum of the probabilities of all paths that collapse to the labels.
+
+    The forward variables of all lines are updated at once frame by frame. Instead of working in log space, the
+    forward variables are normalized to sum 1 in each frame and the logs of the normalization factors are accumulated
+    which is numerically equivalent but avoids the expensive logaddexp.
+
+    Parameters
+    ----------
+    probabilities : array_like
+        Padded probabilities of shape (batch size x max length x character probability).
+    lengths : array_like
+        The actual length of each line.
+    labels : list of list of int
+        The label sequence of each line.
+    blank_index : int
+        Index of the blank label.
+
+    Returns
+    -------
+        the log probability of each line (-inf if a label sequence is impossible, e.g. too long for the line)
+    """
+    probabilities = np.asarray(probabilities)
+    lengths = np.reshape(lengths, -1).astype(np.int64)
+    batch_size, max_len = probabilities.shape[:2]
+    if batch_size == 0:
+        return np.zeros(0)
+
+    # the labels extended by blanks in front, back, and between labels
+    num_labels = np.array([len(l) for l in labels], dtype=np.int64)
+    num_states = 2 * num_labels + 1
+    extended = np.full((batch_size, 2 * int(num_labels.max(initial=0)) + 1), blank_index, dtype=np.int64)
+    for i, l in enumerate(labels):
+        extended[i, 1 : 2 * len(l) : 2] = l
+    valid_states = np.arange(extended.shape[1]) < num_states[:, np.newaxis]
+    # direct transition from state s - 2 to s is only allowed to a label that differs from the one at s - 2
+    allow_skip = np.zeros(extended.shape, dtype=bool)
+    allow_skip[:, 2:] = (extended[:, 2:] != blank_index) & (extended[:, 2:] != extended[:, :-2])
+
+    # probabilities of the states in each frame (frames x lines x states), zero for states beyond the labels
+    emissions = np.take_along_axis(probabilities, extended[:, np.newaxis, :], axis=2).astype(np.float64)
+    emissions *= valid_states[:, np.newaxis, :]
+    emissions = emissions.transpose((1, 0, 2))
+
+    alpha = np.zeros(extended.shape)
+    alpha[:, 0] = 1  # start before the first frame, the first transition leads to state 0 or 1
+    scales = np.ones((max_len, batch_size))
+    skip_alpha = np.zeros(extended.shape)
+    min_len = lengths.min()
+    for t in range(max_len):
+        next_alpha = alpha.copy()
+        next_alpha[:, 1:] += alpha[:, :-1]
+        np.multiply(alpha[:, :-2], allow_skip[:, 2:], out=skip_alpha[:, 2:])
+        next_alpha += skip_alpha
+        next_alpha *= emissions[t]
+        scale = next_alpha.sum(axis=1)
+        next_alpha /= np.where(scale > 0, scale, 1)[:, np.newaxis]
+        if t < min_len:
+            scales[t] = scale
+            alpha = next_alpha
+        else:
+            # lines that already ended keep their forward variables
+            active = t < lengths
+            scales[t] = np.where(active, scale, 1)
+            alpha = np.where(active[:, np.newaxis], next_alpha, alpha)
+
+    with np.errstate(divide="ignore"):
+        log_scale = np.log(scales).sum(axis=0)
+
+    # the paths must end in the last label or the last blank
+    rows = np.arange(batch_size)
+    end_p = alpha[rows, num_states - 1] + np.where(num_labels > 0, alpha[rows, np.maximum(num_states - 2, 0)], 0)
+    with np.errstate(divide="ignore"):
+        return log_scale + np.log(end_p)
@@ -0,0 +1,97 @@
+import multiprocessing
+from copy import copy
+from typing import List, Optional
+
+import numpy as np
+
+from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder import CTCDecoder
+from calamari_ocr.ocr.predict.params import Prediction
+
+# the decoder of a worker process
+_worker_decoder: Optional[CTCDecoder] = None
+
+
+def pool_context():
+    """
+    The multiprocessing context of the worker pools of the prediction. The workers are never forked from the predictor,
+    forking a process that already runs TensorFlow threads may deadlock.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _worker_args(decoder: CTCDecoder):
+    """
+    The decoder that is sent to the workers. The dictionary is only required to build the language model, which is
+    part of the decoder. A language model that is stored in the `dictionary_cache_dir` is only sent as its cache key
+    and memory-mapped again by the worker (see `WordBeamSearchLanguageModel.load_cached`).
+    """
+    decoder = copy(decoder)
+    decoder.params = copy(decoder.params)
+    decoder.params.dictionary = []
+    return (decoder,)
+
+
+def _init_worker(decoder: CTCDecoder):
+    global _worker_decoder
+    _worker_decoder = decoder
+
+
+def _decode_in_worker(args):
+    index, probabilities = args
+    prediction = _worker_decoder.decode(probabilities)
+    prediction.logits = None  # known by the caller, do not send them back
+    return index, prediction
+
+
+class CTCDecoderPool:
+    """
+    Decodes the samples of a batch in a pool of processes, which pays off for the expensive decoders (token passing,
+    word beam search, beam search).
+
+    The pool is created on the first call, i.e. after the decoder (and its language model or dictionary) is built.
+    The workers are started by a fork server (or spawned, see `pool_context`) and receive the prebuilt decoder once,
+    a language model of the `dictionary_cache_dir` is memory-mapped by each worker and thus shared by all processes.
+    """
+
+    def __init__(self, decoder: CTCDecoder, processes: int):
+        self.decoder = decoder
+        self.processes = processes
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = pool_context().Pool(
+                self.processes, initializer=_init_worker, initargs=_worker_args(self.decoder)
+            )
+        return self._pool
+
+    def decode_batch(self, probabilities, lengths) -> List[Prediction]:
+        """See `CTCDecoder.decode_batch`, the predictions are in the order of the samples"""
+        lengths = np.reshape(lengths, -1)
+        if len(lengths) <= 1:
+            return self.decoder.decode_batch(probabilities, lengths)
+
+        samples = [p[:l] for p, l in zip(probabilities, lengths)]
+        chunksize = max(1, len(samples) // (4 * self.processes))
+        predictions: List[Optional[Prediction]] = [None] * len(samples)
+        for index, prediction in self._get_pool().imap_unordered(
+            _decode_in_worker, enumerate(samples), chunksize=chunksize
+        ):
+            prediction.logits = samples[index]
+            predictions[index] = prediction
+        return predictions
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
@@ -1,9 +1,6 @@
+from .blank_pruning import prune_blank_frames, restore_frames
 from .ctc_decoder import CTCDecoder
-import numpy as np
-from calamari_ocr.thirdparty.ctcwordbeamsearch.WordBeamSearch import (
-    wordBeamSearch,
-    LanguageModel,
-)
+from .word_beam_search import word_beam_search, WordBeamSearchLanguageModel
 
 
 class WordBeamSearchCTCDecoder(CTCDecoder):
@@ -11,16 +8,24 @@ class WordBeamSearchCTCDecoder(CTCDecoder):
         super().__init__(params, codec)
         word_chars = set(codec.charset).difference(set(params.non_word_chars))
         word_chars = [c for c in word_chars if len(c) > 0]
-        self.language_model = LanguageModel(" ".join(params.dictionary), "".join(codec.charset), "".join(word_chars))
+        self.language_model = WordBeamSearchLanguageModel.create(
+            params.dictionary,
+            codec.charset,
+            word_chars,
+            blank_index=params.blank_index,
+            cache_dir=params.dictionary_cache_dir,
+        )
 
     def decode(self, probabilities):
-        if self.params.blank_index == 0:
-            probabilities = np.roll(probabilities, -1, axis=1)
-        r = wordBeamSearch(
-            probabilities,
+        pruned, frame_map = prune_blank_frames(
+            probabilities, self.params.blank_pruning_threshold, self.params.blank_index
+        )
+        labels = word_beam_search(
+            pruned,
             self.params.beam_width if self.params.beam_width > 0 else 25,
             self.language_model,
-            False,
-            allowWordToWordTransition=len(self.params.word_separator) == 0,
+            blank_index=self.params.blank_index,
+            allow_word_to_word_transition=len(self.params.word_separator) == 0,
         )
-        return self._prediction_from_string(probabilities, r)
+        prediction = self._prediction_from_string(pruned, "".join(self.codec.decode(labels)))
+        return restore_frames(prediction, probabilities, frame_map)
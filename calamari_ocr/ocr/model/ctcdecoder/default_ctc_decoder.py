@@ -1,6 +1,8 @@
+from typing import List
+
 import numpy as np
 
-from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder import CTCDecoder
+from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder import CTCDecoder, compute_alternatives, ctc_log_probabilities
 from calamari_ocr.ocr.predict.params import Prediction
 
 
@@ -11,25 +13,68 @@ class DefaultCTCDecoder(CTCDecoder):
         self.threshold = params.min_p_threshold if params.min_p_threshold > 0 else 0.0001
 
     def decode(self, probabilities) -> Prediction:
-        last_char = self.blank
         chars = np.argmax(probabilities, axis=1)
-        sentence = []
-        for idx, c in enumerate(chars):
-            if c != self.blank:
-                if c != last_char:
-                    sentence.append((c, idx, idx + 1))
-                else:
-                    _, start, end = sentence[-1]
-                    del sentence[-1]
-                    sentence.append((c, start, idx + 1))
-
-            last_char = c
+        # run-length encode the best path, then drop all runs of blanks
+        run_starts = np.flatnonzero(np.diff(chars)) + 1
+        starts = np.concatenate([[0], run_starts])[: len(chars)]
+        ends = np.append(run_starts, len(chars))[: len(chars)]
+        labels = chars[starts]
+        non_blank = labels != self.blank
+        sentence = np.stack([labels[non_blank], starts[non_blank], ends[non_blank]], axis=1)
 
         return self.find_alternatives(probabilities, sentence, self.threshold)
 
-    def prob_of_sentence(self, probabilities):
-        # do a forward pass and compute the full sentence probability
-        pass
+    def decode_batch(self, probabilities, lengths) -> List[Prediction]:
+        probabilities = np.asarray(probabilities)
+        lengths = np.reshape(lengths, -1).astype(np.int64)
+        batch_size, max_len, num_chars = probabilities.shape
+        if batch_size == 0:
+            return []
+
+        # best paths of all samples concatenated, frames beyond the length of a sample and one additional frame
+        # after each sample (to separate the runs of consecutive samples) are marked by -1
+        row_len = max_len + 1
+        chars = np.full((batch_size, row_len), -1, dtype=np.int64)
+        chars[:, :max_len] = np.argmax(probabilities, axis=2)
+        chars[np.arange(row_len) >= lengths[:, np.newaxis]] = -1
+        chars = chars.reshape(-1)
+
+        run_starts = np.flatnonzero(np.diff(chars)) + 1
+        starts = np.concatenate([[0], run_starts])
+        ends = np.append(run_starts, len(chars))
+        labels = chars[starts]
+        valid = (labels != self.blank) & (labels >= 0)
+        labels, starts, ends = labels[valid], starts[valid], ends[valid]
+
+        # runs never cross samples, so convert to positions within the sample and within the flattened batch
+        sample_idx = starts // row_len
+        starts -= sample_idx * row_len
+        ends -= sample_idx * row_len
+        offsets = sample_idx * max_len
+        alternatives = compute_alternatives(
+            probabilities.reshape(-1, num_chars), starts + offsets, ends + offsets, self.threshold
+        )
+
+        bounds = np.searchsorted(sample_idx, np.arange(batch_size + 1))
+        predictions = []
+        for i, (first, last) in enumerate(zip(bounds[:-1], bounds[1:])):
+            predictions.append(
+                self._prediction_from_alternatives(
+                    probabilities[i, : lengths[i]],
+                    labels[first:last],
+                    starts[first:last],
+                    ends[first:last],
+                    *(a[first:last] for a in alternatives),
+                )
+            )
+        return predictions
+
+    def prob_of_sentence(self, probabilities, labels=None) -> float:
+        # do a forward pass and compute the full sentence probability, by default of the decoded sentence
+        if labels is None:
+            labels = self.decode(probabilities).labels
+        log_p = ctc_log_probabilities(probabilities[np.newaxis], [len(probabilities)], [labels], self.blank)
+        return float(np.exp(log_p[0]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+# Character n-gram language model in the ARPA format, e.g. as created by KenLM or SRILM when trained on text with one
+# character per token. Besides the special tokens <s>, </s>, and <unk>, a space is written as <space>.
+
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+BOS = -1  # label of <s> in a context
+
+
+class CharacterNGramLanguageModel:
+    """
+    Back-off n-gram model over the labels of a codec. The model provides the (natural) log probabilities of all labels
+    of the charset (and of the end of the sentence) for a given context at once.
+    """
+
+    SPECIAL_TOKENS = {"<space>": " ", "<sp>": " "}
+
+    def __init__(
+        self,
+        order: int,
+        charset: List[str],
+        probabilities: Dict[Tuple[int, ...], Dict[int, float]],
+        backoffs: Dict[Tuple[int, ...], float],
+        unknown: float,
+    ):
+        self.order = order
+        self.charset = charset
+        self.eos = len(charset)  # index of </s> in the score vectors
+        self.probabilities = {
+            context: (np.array(list(p.keys()), dtype=np.int64), np.array(list(p.values())))
+            for context, p in probabilities.items()
+        }
+        self.backoffs = backoffs
+
+        self.unigrams = np.full(len(charset) + 1, unknown)
+        if () in self.probabilities:
+            labels, p = self.probabilities[()]
+            self.unigrams[labels] = p
+
+        self._scores_cache: Dict[Tuple[int, ...], np.ndarray] = {}
+
+    @staticmethod
+    def from_arpa(path: str, charset: List[str]) -> "CharacterNGramLanguageModel":
+        char_to_label = {c: i for i, c in enumerate(charset) if len(c) > 0}
+        char_to_label["</s>"] = len(charset)
+        char_to_label["<s>"] = BOS
+        for token, c in CharacterNGramLanguageModel.SPECIAL_TOKENS.items():
+            if c in char_to_label:
+                char_to_label[token] = char_to_label[c]
+
+        ln10 = np.log(10)
+        order = 0
+        probabilities: Dict[Tuple[int, ...], Dict[int, float]] = {}
+        backoffs: Dict[Tuple[int, ...], float] = {}
+        unknown = None
+        n = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("\\"):
+                    n = int(line[1:].split("-")[0]) if line.endswith("-grams:") else 0
+                    order = max(order, n)
+                    continue
+                if n == 0:
+                    continue  # header
+
+                values = line.split()
+                tokens = values[1 : n + 1]
+                log_p = float(values[0]) * ln10
+                if n == 1 and tokens[0] == "<unk>":
+                    unknown = log_p
+                    continue
+                try:
+                    labels = tuple(char_to_label[t] for t in tokens)
+                except KeyError:
+                    continue  # token that is not part of the charset
+
+                if len(values) > n + 1:
+                    backoffs[labels] = float(values[n + 1]) * ln10
+                if labels[-1] != BOS:
+                    probabilities.setdefault(labels[:-1], {})[labels[-1]] = log_p
+
+        if order == 0:
+            raise ValueError(f"No n-grams found in language model {path}")
+
+        if unknown is None:
+            # characters that are not part of the model are treated like the least probable character
+            unknown = min(probabilities.get((), {0: -99 * ln10}).values())
+
+        return CharacterNGramLanguageModel(order, charset, probabilities, backoffs, unknown)
+
+    def initial_context(self) -> Tuple[int, ...]:
+        return (BOS,)[: self.order - 1]
+
+    def next_context(self, context: Tuple[int, ...], label: int) -> Tuple[int, ...]:
+        if self.order <= 1:
+            return ()
+        return (context + (label,))[-(self.order - 1) :]
+
+    def scores(self, context: Tuple[int, ...]) -> np.ndarray:
+        """
+        The log probabilities of all labels (and of </s> at index `len(charset)`) following the context
+        """
+        r = self._scores_cache.get(context)
+        if r is None:
+            # P(w | h) = p(h w) if the n-gram is known, else backoff(h) + P(w | h without its first token)
+            r = self.unigrams.copy()
+            for k in range(1, len(context) + 1):
+                h = context[-k:]
+                r += self.backoffs.get(h, 0)
+                if h in self.probabilities:
+                    labels, p = self.probabilities[h]
+                    r[labels] = p
+            self._scores_cache[context] = r
+        return r
+
+
+_loaded_language_models: Dict[Tuple[str, float, Tuple[str, ...]], CharacterNGramLanguageModel] = {}
+
+
+def load_character_ngram_language_model(path: str, charset: List[str]) -> CharacterNGramLanguageModel:
+    """Load the ARPA file, the model is shared by all decoders of the process that use the same file and charset"""
+    path = os.path.abspath(path)
+    key = path, os.path.getmtime(path), tuple(charset)
+    lm = _loaded_language_models.get(key)
+    if lm is None:
+        lm = _loaded_language_models[key] = CharacterNGramLanguageModel.from_arpa(path, charset)
+    return lm
@@ -1,25 +1,32 @@
 # Based on: https://github.com/githubharald/CTCDecoder
 # Using the algorithm of Graves
 # Fixes of decoding for "Start of path"
+#
+# The tokens are not stored as objects but as dynamic programming arrays in log space: one score matrix of shape
+# (words x states) for each word length (bucket) which is updated frame by frame. Instead of copying the word history
+# of each token, only the frame when a token entered its word is stored (0 for tokens starting at the first frame, -1
+# for tokens that were never reached and thus have an empty history). The best word and the entry frame of its token
+# is kept for every frame, so the history is restored by following these back-pointers.
+
+from typing import List
 
-import math
 import numpy as np
+
+from calamari_ocr.ocr.model.ctcdecoder.blank_pruning import prune_blank_frames, restore_frames
 from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder import CTCDecoder
 
 
 class TokenPassingCTCDecoder(CTCDecoder):
     def __init__(self, params, codec):
         super().__init__(params, codec)
+        self.lexicon = TokenPassingLexicon(self.params.dictionary, self.codec.charset, self.params.blank_index)
 
     def decode(self, probabilities):
-        r = ctcTokenPassing(
-            probabilities,
-            self.codec.charset,
-            self.params.dictionary,
-            blankIdx=self.params.blank_index,
-            word_separator=self.params.word_separator,
+        pruned, frame_map = prune_blank_frames(
+            probabilities, self.params.blank_pruning_threshold, self.params.blank_index
         )
-        return self._prediction_from_string(probabilities, r)
+        r = self.lexicon.decode(pruned, word_separator=self.params.word_separator)
+        return restore_frames(self._prediction_from_string(pruned, r), probabilities, frame_map)
 
 
 def extendByBlanks(seq, b):
@@ -31,152 +38,142 @@ def extendByBlanks(seq, b):
     return res
 
 
-def wordToLabelSeq(w, classes):
+def wordToLabelSeq(w, char_to_label):
     """map a word to a sequence of labels (indices)"""
     try:
-        res = [classes.index(c) for c in w]
+        res = [char_to_label[c] for c in w]
         return res
-    except ValueError:
+    except KeyError:
         return None
 
 
-class Token:
-    """token for token passing algorithm. Each token contains a score and a history of visited words."""
-
-    def __init__(self, score=float("-inf"), history=None):
-        self.score = score
-        self.history = history if history else []
-
-    def __str__(self):
-        res = "class Token: " + str(self.score) + "; "
-        for w in self.history:
-            res += str(w) + "; "
-        return res
-
-
-class TokenList:
-    """this class simplifies getting/setting tokens"""
-
-    def __init__(self):
-        self.tokens = {}
-
-    def set(self, w, s, t, tok):
-        self.tokens[(w, s, t)] = tok
-
-    def get(self, w, s, t):
-        return self.tokens[(w, s, t)]
-
-    def dump(self, s, t):
-        for (k, v) in self.tokens.items():
-            if k[1] == s and k[2] == t:
-                print(k, v)
-
-
-def outputIndices(toks, words, s, t):
-    """argmax_w tok(w,s,t)"""
-    res = []
-    for (wIdx, _) in enumerate(words):
-        res.append(toks.get(wIdx, s, t))
-
-    idx = [i[0] for i in sorted(enumerate(res), key=lambda x: x[1].score)]
-    return idx
-
-
-def log(val):
-    """return -inf for log(0) instead of throwing error like python implementation does it"""
-    if val > 0:
-        return math.log(val)
-    return float("-inf")
+class WordBucket:
+    """all words of the same length, w' (word with blanks in front, back and between labels) of each word is a row"""
+
+    def __init__(self, word_indices: List[int], label_seqs: List[List[int]], blank_idx: int):
+        self.word_indices = np.array(word_indices, dtype=np.int64)
+        self.prime_words = np.array([extendByBlanks(w, blank_idx) for w in label_seqs], dtype=np.int64)
+        self.first_labels = self.prime_words[:, 1]
+        self.last_labels = self.prime_words[:, -2]
+        # direct transition from state s - 2 to s is only allowed to a label that differs from the one at s - 2
+        self.allow_skip = (self.prime_words[:, 2:] != blank_idx) & (self.prime_words[:, 2:] != self.prime_words[:, :-2])
+
+
+class TokenPassingLexicon:
+    """
+    The dictionary prepared for the token passing algorithm. Words that contain characters that are not part of the
+    classes are ignored.
+    """
+
+    def __init__(self, words: List[str], classes, blank_idx=-1):
+        if blank_idx < 0:
+            blank_idx = len(classes)
+        self.blank_idx = blank_idx
+        char_to_label = {c: i for i, c in enumerate(classes)}
+
+        self.words = []
+        by_length = {}
+        for word in words:
+            labels = wordToLabelSeq(word, char_to_label)
+            if not labels:
+                continue
+            by_length.setdefault(len(labels), ([], []))
+            by_length[len(labels)][0].append(len(self.words))
+            by_length[len(labels)][1].append(labels)
+            self.words.append(word)
+
+        self.buckets = [WordBucket(indices, label_seqs, blank_idx) for indices, label_seqs in by_length.values()]
+        self.last_labels = np.zeros(len(self.words), dtype=np.int64)
+        for bucket in self.buckets:
+            self.last_labels[bucket.word_indices] = bucket.last_labels
+
+    def decode(self, mat, word_separator=" ") -> str:
+        """implements CTC Token Passing Algorithm as shown by Graves (Dissertation, p67-69)"""
+        max_t = len(mat)
+        if max_t == 0 or len(self.words) == 0:
+            return ""
+
+        with np.errstate(divide="ignore"):
+            log_mat = np.log(np.asarray(mat, dtype=np.float64))
+
+        # the best output token (argmax_w tok(w, -1, t)) of each frame: its word and the frame its token entered the
+        # word
+        best_word = np.zeros(max_t, dtype=np.int64)
+        best_entry = np.zeros(max_t, dtype=np.int64)
+
+        # Initialisation: 1-9
+        scores, entries = [], []
+        for bucket in self.buckets:
+            score = np.full(bucket.prime_words.shape, -np.inf)
+            score[:, 0] = log_mat[0, self.blank_idx]
+            score[:, 1] = log_mat[0, bucket.first_labels]
+            scores.append(score)
+            entry = np.full(bucket.prime_words.shape, -1, dtype=np.int32)
+            entry[:, :2] = 0
+            entries.append(entry)
+        best_score = self._store_best_output_token(0, scores, entries, best_word, best_entry)
+
+        # Algorithm: 11-24
+        for t in range(1, max_t):
+            # 15-17: all words are entered by the best output token of the last frame
+            # if bigrams should be used, these lines have to be adapted
+            best_last_label = self.last_labels[best_word[t - 1]]
+            log_p = log_mat[t]
+            for i, bucket in enumerate(self.buckets):
+                prev_score, prev_entry = scores[i], entries[i]
+
+                # 18-24: the first best of [tok(s, t - 1), tok(s - 1, t - 1), tok(s - 2, t - 1), tok(0, t)]
+                better = prev_score[:, :-1] > prev_score[:, 1:]
+                score = np.concatenate([prev_score[:, :1], np.where(better, prev_score[:, :-1], prev_score[:, 1:])], 1)
+                entry = np.concatenate([prev_entry[:, :1], np.where(better, prev_entry[:, :-1], prev_entry[:, 1:])], 1)
+
+                better = bucket.allow_skip & (prev_score[:, :-2] > score[:, 2:])
+                score[:, 2:] = np.where(better, prev_score[:, :-2], score[:, 2:])
+                entry[:, 2:] = np.where(better, prev_entry[:, :-2], entry[:, 2:])
+
+                better = best_score > score[:, 0]
+                score[better, 0] = best_score
+                entry[better, 0] = t
+                # allow direct transition in state 2 (first char) if the last word ended with another char
+                better = (bucket.first_labels != best_last_label) & (best_score > score[:, 1])
+                score[better, 1] = best_score
+                entry[better, 1] = t
+
+                score += log_p[bucket.prime_words]
+                scores[i], entries[i] = score, entry
+
+            best_score = self._store_best_output_token(t, scores, entries, best_word, best_entry)
+
+        # Termination: 26-28
+        history = []
+        word, entry = best_word[-1], best_entry[-1]
+        while entry >= 0:
+            history.append(word)
+            if entry == 0:
+                break
+            word, entry = best_word[entry - 1], best_entry[entry - 1]
+
+        return word_separator.join([self.words[i] for i in reversed(history)])
+
+    def _store_best_output_token(self, t, scores, entries, best_word, best_entry) -> float:
+        # output token of each word: the better one of its last two states (tok(w, -1, t)). The best output token
+        # over all words is the last word with the maximum score.
+        best = None
+        for bucket, score, entry in zip(self.buckets, scores, entries):
+            take_last = score[:, -2] > score[:, -1]
+            output_score = np.where(take_last, score[:, -2], score[:, -1])
+            idx = len(output_score) - 1 - np.argmax(output_score[::-1])
+            word = bucket.word_indices[idx]
+            if best is None or output_score[idx] > best[0] or (output_score[idx] == best[0] and word > best[1]):
+                best = output_score[idx], word, entry[idx, -2] if take_last[idx] else entry[idx, -1]
+
+        best_score, best_word[t], best_entry[t] = best
+        return best_score
 
 
 def ctcTokenPassing(mat, classes, charWords, blankIdx=-1, word_separator=" "):
     """implements CTC Token Passing Algorithm as shown by Graves (Dissertation, p67-69)"""
-    if blankIdx < 0:
-        blankIdx = len(classes)
-    maxT, _ = mat.shape
-
-    # special s index for beginning and end of word
-    beg = 0
-    end = -1
-
-    # map characters to labels for each word
-    words = [wordToLabelSeq(w, classes) for w in charWords]
-
-    # w' in paper: word with blanks in front, back and between labels: for -> _f_o_r_
-    primeWords = [extendByBlanks(w, blankIdx) for w in words]
-
-    # data structure holding all tokens
-    toks = TokenList()
-
-    # Initialisation: 1-9
-    for (wIdx, w) in enumerate(words):
-        w = words[wIdx]
-        wPrime = primeWords[wIdx]
-
-        # set all toks(w,s,t) to init state
-        for s in range(len(wPrime)):
-            for t in range(maxT):
-                toks.set(wIdx, s + 1, t + 1, Token())
-                toks.set(wIdx, beg, t, Token())
-                toks.set(wIdx, end, t, Token())
-
-        toks.set(wIdx, 1, 1, Token(log(mat[1 - 1, blankIdx]), [wIdx]))
-        cIdx = w[1 - 1]
-        toks.set(wIdx, 2, 1, Token(log(mat[1 - 1, cIdx]), [wIdx]))
-
-        if len(w) == 1:
-            toks.set(wIdx, end, 1, toks.get(wIdx, 2, 1))
-
-    # Algorithm: 11-24
-    t = 2
-    while t <= maxT:
-
-        sortedWordIdx = outputIndices(toks, words, end, t - 1)
-
-        for wIdx in sortedWordIdx:
-            wPrime = primeWords[wIdx]
-
-            # 15-17
-            # if bigrams should be used, these lines have to be adapted
-            bestOutputTok = toks.get(sortedWordIdx[-1], end, t - 1)
-            wBestPrime = primeWords[sortedWordIdx[-1]]
-            toks.set(wIdx, beg, t, Token(bestOutputTok.score, bestOutputTok.history + [wIdx]))
-
-            # 18-24
-            s = 1
-            while s <= len(wPrime):
-                if s == 1:
-                    P = [toks.get(wIdx, 1, t - 1), toks.get(wIdx, 0, t)]
-                else:
-                    P = [toks.get(wIdx, s, t - 1), toks.get(wIdx, s - 1, t - 1)]
-                    # allow direct transition in state 2 (first char) if the last word ended with another char
-                    if s == 2 and (wBestPrime[-2] != wPrime[1]):
-                        P.append(toks.get(wIdx, 0, t))
-
-                if wPrime[s - 1] != blankIdx and s > 2 and wPrime[s - 2 - 1] != wPrime[s - 1]:
-                    tok = toks.get(wIdx, s - 2, t - 1)
-                    P.append(Token(tok.score, tok.history))
-
-                maxTok = max(P, key=lambda x: x.score)
-                cIdx = wPrime[s - 1]
-
-                score = maxTok.score + log(mat[t - 1, cIdx])
-                history = maxTok.history
-
-                toks.set(wIdx, s, t, Token(score, history))
-                s += 1
-
-            maxTok = max(
-                [toks.get(wIdx, len(wPrime), t), toks.get(wIdx, len(wPrime) - 1, t)],
-                key=lambda x: x.score,
-            )
-            toks.set(wIdx, end, t, maxTok)
-
-        t += 1
-
-    # Termination: 26-28
-    bestWIdx = outputIndices(toks, words, end, maxT)[-1]
-    return word_separator.join([charWords[i] for i in toks.get(bestWIdx, end, maxT).history])
+    return TokenPassingLexicon(charWords, classes, blankIdx).decode(mat, word_separator=word_separator)
 
 
 if __name__ == "__main__":
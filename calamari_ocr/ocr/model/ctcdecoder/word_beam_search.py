@@ -0,0 +1,330 @@
+# Word beam search decoding, based on: https://github.com/githubharald/CTCWordBeamSearch
+# (see also calamari_ocr/thirdparty/ctcwordbeamsearch)
+#
+# In contrast to the original implementation, the decoding works in log space and on the labels of the codec
+# directly. The text of a beam is interned as a prefix (parent prefix + label) so that beams share their common
+# prefixes instead of copying them. All candidates of a time step are scored, merged and pruned with array operations.
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from typing import List, Dict, Tuple, Optional
+
+import numpy as np
+
+
+class WordBeamSearchLanguageModel:
+    """
+    Prefix tree of all words of the dictionary over the labels of the codec. A word is a maximal sequence of word
+    characters, i.e. the entries of the dictionary are split at all non-word characters.
+
+    The nodes of the tree are identified by an int (0 is the root, i.e. no developing word) and numbered in breadth
+    first order, hence the children of a node are consecutive nodes. The tree is thus fully described by three flat
+    arrays: the label of the edge leading to each node, the offset of the first child of each node, and whether a node
+    completes a word. These arrays can be stored in a cache directory and are then memory-mapped on load, so that
+    building the tree of a large dictionary is only required once and all processes share the same memory.
+    """
+
+    VERSION = 1
+    ARRAYS = ["labels", "child_offsets", "is_word", "non_word_labels"]
+
+    def __init__(self, labels: np.ndarray, child_offsets: np.ndarray, is_word: np.ndarray, non_word_labels: np.ndarray):
+        self.labels = labels
+        self.child_offsets = child_offsets
+        self.is_word = is_word
+        self.non_word_labels = non_word_labels
+        # the cache dir and key if the model is memory-mapped from a cache (see `create`)
+        self.cache: Optional[Tuple[str, str]] = None
+
+        self.start_labels, self.start_nodes = self.children(0)
+        self._next_cache: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @staticmethod
+    def build(
+        dictionary: List[str], charset: List[str], word_chars: List[str], blank_index: int = 0
+    ) -> "WordBeamSearchLanguageModel":
+        char_to_label = {c: i for i, c in enumerate(charset) if i != blank_index and len(c) > 0}
+        word_chars = [c for c in word_chars if c in char_to_label]
+        word_labels = {char_to_label[c] for c in word_chars}
+        non_word_labels = np.array(sorted(set(char_to_label.values()).difference(word_labels)), dtype=np.int32)
+
+        # insert all words into a tree of dicts, then number the nodes in breadth first order
+        children: List[Dict[int, int]] = [{}]
+        is_word = [False]
+        if word_chars:
+            word_pattern = "[" + re.escape("".join(word_chars)) + "]+"
+            for word in set(re.findall(word_pattern, " ".join(dictionary))):
+                node = 0
+                for label in (char_to_label[c] for c in word):
+                    child = children[node].get(label)
+                    if child is None:
+                        child = children[node][label] = len(children)
+                        children.append({})
+                        is_word.append(False)
+                    node = child
+                is_word[node] = True
+
+        order, labels, child_offsets = [0], [-1], []
+        for node in order:
+            child_offsets.append(len(order))
+            for label, child in sorted(children[node].items()):
+                order.append(child)
+                labels.append(label)
+        child_offsets.append(len(order))
+
+        return WordBeamSearchLanguageModel(
+            labels=np.array(labels, dtype=np.int32),
+            child_offsets=np.array(child_offsets, dtype=np.int32),
+            is_word=np.array(is_word, dtype=bool)[order],
+            non_word_labels=non_word_labels,
+        )
+
+    @staticmethod
+    def cache_key(dictionary: List[str], charset: List[str], word_chars: List[str], blank_index: int = 0) -> str:
+        h = hashlib.sha1()
+        h.update(
+            json.dumps(
+                {
+                    "version": WordBeamSearchLanguageModel.VERSION,
+                    "charset": list(charset),
+                    "word_chars": sorted(word_chars),
+                    "blank_index": blank_index,
+                }
+            ).encode("utf-8")
+        )
+        for word in sorted(set(dictionary)):
+            h.update(word.encode("utf-8"))
+            h.update(b"\n")
+        return h.hexdigest()
+
+    def save(self, path: str):
+        """Store the arrays in the directory `path`, the directory is replaced atomically"""
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent)
+        try:
+            for name in self.ARRAYS:
+                np.save(os.path.join(tmp_dir, name + ".npy"), getattr(self, name))
+            os.replace(tmp_dir, path)
+        except OSError:
+            # another process stored the same model concurrently
+            if not os.path.exists(path):
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def load(path: str, mmap_mode: Optional[str] = "r") -> "WordBeamSearchLanguageModel":
+        return WordBeamSearchLanguageModel(
+            **{
+                name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+                for name in WordBeamSearchLanguageModel.ARRAYS
+            }
+        )
+
+    @staticmethod
+    def create(
+        dictionary: List[str],
+        charset: List[str],
+        word_chars: List[str],
+        blank_index: int = 0,
+        cache_dir: Optional[str] = None,
+    ) -> "WordBeamSearchLanguageModel":
+        """
+        Build the language model or load it from the cache directory (if given). The model is identified by the hash
+        of its dictionary, charset, and word characters. Models of the same process are shared.
+        """
+        key = WordBeamSearchLanguageModel.cache_key(dictionary, charset, word_chars, blank_index)
+        lm = _loaded_language_models.get(key)
+        if lm is not None:
+            return lm
+
+        if cache_dir:
+            path = os.path.join(cache_dir, "word_beam_search_" + key)
+            if not os.path.exists(path):
+                WordBeamSearchLanguageModel.build(dictionary, charset, word_chars, blank_index).save(path)
+            return WordBeamSearchLanguageModel.load_cached(cache_dir, key)
+
+        lm = WordBeamSearchLanguageModel.build(dictionary, charset, word_chars, blank_index)
+        _loaded_language_models[key] = lm
+        return lm
+
+    @staticmethod
+    def load_cached(cache_dir: str, key: str) -> "WordBeamSearchLanguageModel":
+        """Memory-map the model of the given key that `create` stored in the cache directory"""
+        lm = _loaded_language_models.get(key)
+        if lm is None:
+            lm = WordBeamSearchLanguageModel.load(os.path.join(cache_dir, "word_beam_search_" + key))
+            lm.cache = cache_dir, key
+            _loaded_language_models[key] = lm
+        return lm
+
+    def __reduce__(self):
+        if self.cache is not None:
+            # e.g. sent to the workers of a `CTCDecoderPool`: the model is memory-mapped again instead of copied, so
+            # that all processes share the pages of the cache files
+            return WordBeamSearchLanguageModel.load_cached, self.cache
+        return WordBeamSearchLanguageModel, tuple(getattr(self, name) for name in self.ARRAYS)
+
+    def children(self, node: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = int(self.child_offsets[node]), int(self.child_offsets[node + 1])
+        return np.asarray(self.labels[start:end], dtype=np.int64), np.arange(start, end, dtype=np.int64)
+
+    def next_labels(self, node: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The labels that may follow the developing word of the given node and the nodes reached by these labels.
+        Non-word characters are allowed in between two words or after a complete word, they lead back to the root.
+        """
+        r = self._next_cache.get(node)
+        if r is None:
+            labels, nodes = self.children(node)
+            if node == 0 or self.is_word[node]:
+                labels = np.concatenate([labels, self.non_word_labels])
+                nodes = np.concatenate([nodes, np.zeros(len(self.non_word_labels), dtype=np.int64)])
+            r = self._next_cache[node] = labels, nodes
+        return r
+
+    def completion(self, node: int) -> List[int]:
+        """
+        The labels that complete the developing word of the node if there is exactly one word with this prefix
+        """
+        if node == 0 or self.is_word[node]:
+            return []
+        labels = []
+        while not self.is_word[node]:
+            start, end = int(self.child_offsets[node]), int(self.child_offsets[node + 1])
+            if end - start != 1:
+                return []
+            node = start
+            labels.append(int(self.labels[node]))
+        if self.child_offsets[node + 1] > self.child_offsets[node]:
+            return []  # the word is the prefix of other words
+        return labels
+
+
+_loaded_language_models: Dict[str, WordBeamSearchLanguageModel] = {}
+
+
+class BeamPrefixes:
+    """Interned texts of the beams: each prefix is identified by an int and stored as its parent prefix and label"""
+
+    def __init__(self):
+        self.parents = [-1]  # 0 is the empty text
+        self.labels = [-1]
+        self.word_nodes = [0]
+        self._ids: Dict[Tuple[int, int], int] = {}
+
+    def get(self, parent: int, label: int, word_node: int) -> int:
+        key = (parent, label)
+        prefix = self._ids.get(key)
+        if prefix is None:
+            # the word node is only set by the first beam with that text
+            prefix = self._ids[key] = len(self.parents)
+            self.parents.append(parent)
+            self.labels.append(label)
+            self.word_nodes.append(word_node)
+        return prefix
+
+    def to_labels(self, prefix: int) -> List[int]:
+        labels = []
+        while prefix > 0:
+            labels.append(self.labels[prefix])
+            prefix = self.parents[prefix]
+        return labels[::-1]
+
+
+def word_beam_search(
+    mat, beam_width: int, lm: WordBeamSearchLanguageModel, blank_index=0, allow_word_to_word_transition=False
+) -> List[int]:
+    """
+    Decode the probabilities (shape T x C) with the given beam width and language model.
+
+    Returns
+    -------
+        the labels of the most probable beam
+    """
+    with np.errstate(divide="ignore"):
+        log_mat = np.log(np.asarray(mat, dtype=np.float64))
+
+    prefixes = BeamPrefixes()
+
+    # the current beams: their prefix, the log probability of ending with a blank or a non-blank
+    beam_prefixes = np.zeros(1, dtype=np.int64)
+    beam_pr_blank = np.zeros(1)
+    beam_pr_non_blank = np.full(1, -np.inf)
+
+    for t in range(len(log_mat)):
+        log_p = log_mat[t]
+        beam_pr_total = np.logaddexp(beam_pr_blank, beam_pr_non_blank)
+        beam_last_labels = np.array([prefixes.labels[p] for p in beam_prefixes], dtype=np.int64)
+
+        # all candidates of this time step: each candidate is (parent prefix, label) or an existing beam (label -1)
+        cand_parents = [beam_prefixes]
+        cand_labels = [np.full(len(beam_prefixes), -1, dtype=np.int64)]
+        cand_nodes = [np.array([prefixes.word_nodes[p] for p in beam_prefixes], dtype=np.int64)]
+        # keep the text of a beam: ends with blank, or ends with non-blank if the last char is repeated
+        cand_pr_blank = [beam_pr_total + log_p[blank_index]]
+        cand_pr_non_blank = [np.where(beam_last_labels >= 0, beam_pr_non_blank + log_p[beam_last_labels], -np.inf)]
+
+        # extend the beams by the labels that are allowed by the language model
+        for prefix, word_node, last_label, pr_blank, pr_total in zip(
+            beam_prefixes.tolist(), cand_nodes[0].tolist(), beam_last_labels.tolist(), beam_pr_blank, beam_pr_total
+        ):
+            labels, nodes = lm.next_labels(word_node)
+            if allow_word_to_word_transition and lm.is_word[word_node]:
+                # allow words to directly follow words without a space (or any other sign)
+                labels = np.concatenate([labels, lm.start_labels])
+                nodes = np.concatenate([nodes, lm.start_nodes])
+            cand_parents.append(np.full(len(labels), prefix, dtype=np.int64))
+            cand_labels.append(labels)
+            cand_nodes.append(nodes)
+            cand_pr_blank.append(np.full(len(labels), -np.inf))
+            # same chars must be separated by blank, different chars can be neighbours
+            cand_pr_non_blank.append(log_p[labels] + np.where(labels == last_label, pr_blank, pr_total))
+
+        cand_parents = np.concatenate(cand_parents)
+        cand_labels = np.concatenate(cand_labels)
+        cand_nodes = np.concatenate(cand_nodes)
+        cand_pr_blank = np.concatenate(cand_pr_blank)
+        cand_pr_non_blank = np.concatenate(cand_pr_non_blank)
+
+        # existing beams are identified by their parent and last label, too
+        is_beam = cand_labels < 0
+        cand_labels[is_beam] = beam_last_labels
+        cand_parents[is_beam] = [prefixes.parents[p] for p in beam_prefixes]
+
+        # merge candidates with the same text, the first candidate (in order of creation) defines the word node
+        keys = cand_parents * (len(log_p) + 1) + (cand_labels + 1)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        first = order[starts]
+        pr_blank = np.logaddexp.reduceat(cand_pr_blank[order], starts)
+        pr_non_blank = np.logaddexp.reduceat(cand_pr_non_blank[order], starts)
+
+        # keep the best beams
+        pr_total = np.logaddexp(pr_blank, pr_non_blank)
+        if len(pr_total) > beam_width:
+            best = np.argpartition(-pr_total, beam_width - 1)[:beam_width]
+        else:
+            best = np.arange(len(pr_total))
+        first = first[best]
+        beam_prefixes = np.array(
+            [
+                0 if parent < 0 else prefixes.get(parent, label, node)
+                for parent, label, node in zip(
+                    cand_parents[first].tolist(), cand_labels[first].tolist(), cand_nodes[first].tolist()
+                )
+            ],
+            dtype=np.int64,
+        )
+        beam_pr_blank = pr_blank[best]
+        beam_pr_non_blank = pr_non_blank[best]
+
+    # return most probable beam, complete the last word if it is unique
+    best = int(np.argmax(np.logaddexp(beam_pr_blank, beam_pr_non_blank)))
+    prefix = int(beam_prefixes[best])
+    return prefixes.to_labels(prefix) + lm.completion(prefixes.word_nodes[prefix])
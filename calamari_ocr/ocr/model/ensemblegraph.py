@@ -9,10 +9,37 @@ from tensorflow.python.ops import ctc_ops as ctc
 from calamari_ocr.ocr.model.graph import CalamariGraph
 from calamari_ocr.ocr.model.params import ModelParams
 
-
 logger = logging.getLogger(__name__)
 
 
+def ensemble_outputs(blank_last_softmax, lstm_seq_len, complete_outputs):
+    """
+    The outputs of an ensemble: the outputs of the (voted) blank_last_softmax, and the outputs of each voter with a
+    `_i` suffix
+    """
+    softmax = tf.roll(blank_last_softmax, shift=1, axis=-1)
+
+    greedy_decoded = ctc.ctc_greedy_decoder(
+        inputs=tf.transpose(blank_last_softmax, perm=[1, 0, 2]),
+        sequence_length=tf.cast(K.flatten(lstm_seq_len), "int32"),
+    )[0][0]
+
+    outputs = {
+        "blank_last_logits": tf.math.log(blank_last_softmax),
+        "blank_last_softmax": blank_last_softmax,
+        "logits": tf.math.log(softmax),
+        "softmax": softmax,
+        "out_len": lstm_seq_len,
+        "decoded": tf.sparse.to_dense(greedy_decoded, default_value=-1) + 1,
+    }
+
+    for i, voter_output in enumerate(complete_outputs):
+        for k, v in voter_output.items():
+            outputs[f"{k}_{i}"] = v
+
+    return outputs
+
+
 class EnsembleGraph(GenericGraphBase[ModelParams]):
     def __init__(self, params: ModelParams, name="CalamariGraph", **kwargs):
         super(EnsembleGraph, self).__init__(params, name=name, **kwargs)
@@ -22,27 +49,7 @@ class EnsembleGraph(GenericGraphBase[ModelParams]):
             logger.warning("Changed masking during training. This should only be used for evaluation!")
 
     def make_outputs(self, blank_last_softmax, lstm_seq_len, complete_outputs):
-        softmax = tf.roll(blank_last_softmax, shift=1, axis=-1)
-
-        greedy_decoded = ctc.ctc_greedy_decoder(
-            inputs=tf.transpose(blank_last_softmax, perm=[1, 0, 2]),
-            sequence_length=tf.cast(K.flatten(lstm_seq_len), "int32"),
-        )[0][0]
-
-        outputs = {
-            "blank_last_logits": tf.math.log(blank_last_softmax),
-            "blank_last_softmax": blank_last_softmax,
-            "logits": tf.math.log(softmax),
-            "softmax": softmax,
-            "out_len": lstm_seq_len,
-            "decoded": tf.sparse.to_dense(greedy_decoded, default_value=-1) + 1,
-        }
-
-        for i, voter_output in enumerate(complete_outputs):
-            for k, v in voter_output.items():
-                outputs[f"{k}_{i}"] = v
-
-        return outputs
+        return ensemble_outputs(blank_last_softmax, lstm_seq_len, complete_outputs)
 
     def build_prediction_graph(self, inputs, training=None):
         # Prediction Graph: standard voting
@@ -112,6 +119,7 @@ class EnsembleGraph(GenericGraphBase[ModelParams]):
                 }
 
             empty_output = gen_empty_output(1)
+
             # Validation: Compute output for each graph but only for its own partition
             # Per sample this is one CER which is then used e. g. for early stopping
             def apply_single_model(batch):
@@ -0,0 +1,200 @@
+import itertools
+import time
+from copy import copy
+from queue import Queue, Empty
+from threading import Thread
+from typing import Iterable, Iterator, List, Optional, Union
+
+from tfaip.data.pipeline.datapipeline import DataPipeline, DataGenerator
+from tfaip.data.pipeline.definitions import Sample
+from tfaip.data.pipeline.processor.params import SequentialProcessorPipelineParams
+
+from calamari_ocr.ocr.predict.chunking import split_line
+from calamari_ocr.ocr.predict.params import PredictorParams
+from calamari_ocr.ocr.predict.skipping import LineSkipper
+
+# meta of a sample: the position of its line in the generated (and pre-processed) samples
+BATCHING_INDEX = "batching_index"
+
+
+def width_batches(samples: Iterable[Sample], max_batch_pixels: int, window: int) -> Iterator[List[Sample]]:
+    """
+    Sort each window of samples by the width of the pre-processed line image and batch lines of similar width so that
+    a padded batch has at most `max_batch_pixels` pixels (a wider line is a batch on its own). All batches of a window
+    are yielded before the next window is read, so only one window of samples is kept in memory.
+    """
+    samples = iter(samples)
+    while True:
+        window_samples = list(itertools.islice(samples, window))
+        if not window_samples:
+            return
+
+        batch, batch_width = [], 0
+        for sample in sorted(window_samples, key=lambda s: s.inputs["img"].shape[0]):
+            width, height = sample.inputs["img"].shape[:2]
+            if batch and (len(batch) + 1) * max(width, batch_width) * height > max_batch_pixels:
+                yield batch
+                batch, batch_width = [], 0
+            batch.append(sample)
+            batch_width = max(width, batch_width)
+        if batch:
+            yield batch
+
+
+def micro_batches(samples: Iterable[Sample], max_batch_size: int, max_wait_ms: int) -> Iterator[List[Sample]]:
+    """
+    Batch the samples as they arrive: a batch is yielded when it has `max_batch_size` samples or `max_wait_ms` after its
+    first sample arrived, so that a stream of samples (e.g. concurrent requests) is not blocked until a full batch is
+    available. The samples are read in a separate thread with a bounded queue.
+    """
+    queue = Queue(max(1, max_batch_size))
+    end = object()
+    errors = []
+
+    def read():
+        try:
+            for sample in samples:
+                queue.put(sample)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            queue.put(end)
+
+    Thread(target=read, daemon=True).start()
+    while True:
+        sample = queue.get()
+        if sample is end:
+            break
+
+        batch = [sample]
+        deadline = time.monotonic() + max_wait_ms / 1000
+        while len(batch) < max_batch_size:
+            try:
+                sample = queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except Empty:
+                break
+            if sample is end:
+                break
+            batch.append(sample)
+        yield batch
+        if sample is end:
+            break
+
+    if errors:
+        raise errors[0]
+
+
+def restore_order(samples: Iterable[Sample]) -> Iterator[Sample]:
+    """Yield the samples (and remove their BATCHING_INDEX) in the order of the BATCHING_INDEX"""
+    pending = {}
+    next_index = 0
+    for sample in samples:
+        pending[sample.meta.pop(BATCHING_INDEX)] = sample
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+
+    for index in sorted(pending.keys()):
+        yield pending[index]
+
+
+class PredictionInputPipeline(DataPipeline):
+    """
+    Wraps a DataPipeline: the pre-processing of the wrapped pipeline is applied, then blank and duplicate lines are
+    skipped (see `LineSkipper`), the lines that are wider than `chunk_width` are split into overlapping chunks (see
+    `split_line`), and the lines are batched by their width (see `width_batches`) if `max_batch_pixels` is set instead
+    of padding fixed size batches to their widest line. If `max_batch_wait_ms` is set, the lines are batched as they
+    arrive (see `micro_batches`) and the micro batches are then split by their width. The samples are tagged with the
+    BATCHING_INDEX of their line so that `stitch_chunks`, `LineSkipper.merge`, and `restore_order` can be applied on the
+    predictions.
+    """
+
+    def __init__(
+        self,
+        pipeline: DataPipeline,
+        params: PredictorParams,
+        downscale_factor: int,
+        line_skipper: Optional[LineSkipper] = None,
+    ):
+        if pipeline.data.params.tf_image_processing:
+            raise ValueError(
+                "The width batching, chunking, and line skipping of the predictor require the pre-processed lines, "
+                "they are not supported with data.tf_image_processing."
+            )
+        pipeline_params = copy(pipeline.pipeline_params)
+        pipeline_params.limit = -1  # the limit is applied by the wrapped pipeline
+        if params.max_batch_wait_ms > 0:
+            # the prefetching of the tf.data.Dataset waits for further batches before the first one is predicted, which
+            # blocks a stream whose next lines only arrive after the predictions of the previous ones
+            pipeline_params.prefetch = 0
+        super().__init__(
+            pipeline_params,
+            pipeline.data,
+            pipeline.generator_params,
+            SequentialProcessorPipelineParams(run_parallel=False),
+            pipeline._output_processors,
+        )
+        self.pipeline = pipeline
+        self.params = params
+        self.downscale_factor = downscale_factor
+        self.line_skipper = line_skipper
+
+    @staticmethod
+    def required(params: PredictorParams) -> bool:
+        return (
+            params.max_batch_pixels > 0
+            or params.max_batch_wait_ms > 0
+            or params.chunk_width > 0
+            or LineSkipper.required(params)
+        )
+
+    def to_mode(self, mode):
+        return PredictionInputPipeline(
+            self.pipeline.to_mode(mode), self.params, self.downscale_factor, self.line_skipper
+        )
+
+    def create_data_generator(self) -> DataGenerator:
+        wrapped = self
+        params = self.params
+
+        class Gen(DataGenerator):
+            def __len__(self):
+                limit = wrapped.pipeline.pipeline_params.limit
+                length = len(wrapped.pipeline.create_data_generator())
+                return min(limit, length) if limit > 0 else length
+
+            def yields_batches(self) -> bool:
+                return params.max_batch_pixels > 0 or params.max_batch_wait_ms > 0
+
+            def generate(self) -> Iterable[Union[Sample, List[Sample]]]:
+                with wrapped.pipeline as rd:
+                    samples = (
+                        s.new_meta({**s.meta, BATCHING_INDEX: i})
+                        for i, s in enumerate(rd.generate_input_samples(auto_repeat=False))
+                    )
+                    if wrapped.line_skipper is not None:
+                        samples = wrapped.line_skipper.filter(samples)
+                    if params.chunk_width > 0:
+                        samples = itertools.chain.from_iterable(
+                            split_line(
+                                s,
+                                s.meta[BATCHING_INDEX],
+                                params.chunk_width,
+                                params.chunk_overlap,
+                                wrapped.downscale_factor,
+                            )
+                            for s in samples
+                        )
+                    if params.max_batch_wait_ms > 0:
+                        batches = micro_batches(samples, wrapped.pipeline_params.batch_size, params.max_batch_wait_ms)
+                        if params.max_batch_pixels > 0:
+                            batches = itertools.chain.from_iterable(
+                                width_batches(batch, params.max_batch_pixels, len(batch)) for batch in batches
+                            )
+                        yield from batches
+                    elif params.max_batch_pixels > 0:
+                        yield from width_batches(samples, params.max_batch_pixels, params.batching_window)
+                    else:
+                        yield from samples
+
+        return Gen(self.mode, self.generator_params)
@@ -0,0 +1,90 @@
+from typing import List
+
+import tensorflow as tf
+from tensorflow import keras
+
+from calamari_ocr.ocr.predict.params import CascadeParams, CascadeConfidence
+
+# Output of the first model that marks the samples that were also predicted by the remaining models
+ESCALATED = "cascade_escalated"
+
+
+def greedy_avg_char_probability(softmax, out_len):
+    """
+    The avg char probability of the greedy decoding (as computed by the DefaultCTCDecoder): the mean of the highest
+    probability of each char over the frames of the char. The blank index must be 0.
+    """
+    out_len = tf.reshape(tf.cast(out_len, tf.int32), [-1])
+    best = tf.argmax(softmax, axis=-1, output_type=tf.int32)
+    best_p = tf.reduce_max(softmax, axis=-1)
+    batch_size, max_len = tf.shape(best)[0], tf.shape(best)[1]
+    best = tf.where(tf.sequence_mask(out_len, max_len), best, -1)  # padding is neither blank nor char
+
+    # runs of the same label, their max probability
+    starts = tf.not_equal(best, tf.pad(best[:, :-1], [[0, 0], [1, 0]], constant_values=-1))
+    runs = tf.cumsum(tf.cast(starts, tf.int32), axis=1) - 1 + tf.range(batch_size)[:, tf.newaxis] * max_len
+    run_p = tf.math.unsorted_segment_max(tf.reshape(best_p, [-1]), tf.reshape(runs, [-1]), batch_size * max_len)
+
+    chars = starts & (best > 0)
+    char_p = tf.where(chars, tf.gather(run_p, runs), 0)
+    num_chars = tf.reduce_sum(tf.cast(chars, char_p.dtype), axis=1)
+    return tf.reduce_sum(char_p, axis=1) / tf.maximum(num_chars, 1)
+
+
+def greedy_sentence_probability(logits, decoded, out_len):
+    """
+    The probability of the sentence of the greedy decoding (sum of all paths), the blank index must be 0 and decoded
+    is padded by 0
+    """
+    decoded = tf.cast(decoded, tf.int32)
+    loss = tf.nn.ctc_loss(
+        labels=decoded,
+        logits=logits,
+        label_length=tf.reduce_sum(tf.cast(decoded > 0, tf.int32), axis=1),
+        logit_length=tf.reshape(tf.cast(out_len, tf.int32), [-1]),
+        logits_time_major=False,
+        blank_index=0,
+    )
+    return tf.exp(-loss)
+
+
+class CascadeModel(keras.Model):
+    """
+    Applies the first model on all samples of a batch, the remaining models only on the samples whose confidence of
+    the first model is below the threshold. The outputs of the remaining models are scattered into batches of full
+    size, the ESCALATED output of the first model marks the samples for which they are valid.
+    """
+
+    def __init__(self, models: List[keras.Model], params: CascadeParams, **kwargs):
+        super().__init__(**kwargs)
+        self.cascade_models = models
+        self.cascade_params = params
+
+    def confidence(self, outputs):
+        if self.cascade_params.confidence == CascadeConfidence.SentenceProbability:
+            return greedy_sentence_probability(outputs["logits"], outputs["decoded"], outputs["out_len"])
+        return greedy_avg_char_probability(outputs["softmax"], outputs["out_len"])
+
+    def call(self, inputs, training=None, mask=None):
+        outputs = dict(self.cascade_models[0](inputs))
+        escalated = self.confidence(outputs) < self.cascade_params.threshold
+        outputs[ESCALATED] = escalated
+
+        # run at least one sample to get outputs of a valid shape, it is only used if escalated
+        indices = tf.where(escalated)[:, 0]
+        indices = tf.cond(tf.size(indices) > 0, lambda: indices, lambda: tf.zeros([1], dtype=tf.int64))
+        escalated_inputs = {k: tf.gather(v, indices) for k, v in inputs.items()}
+        batch_size = tf.shape(escalated, out_type=tf.int64)[:1]
+
+        complete_outputs = [outputs]
+        for model in self.cascade_models[1:]:
+            complete_outputs.append(
+                {
+                    k: tf.scatter_nd(indices[:, tf.newaxis], v, tf.concat([batch_size, tf.shape(v, tf.int64)[1:]], 0))
+                    for k, v in model(escalated_inputs).items()
+                }
+            )
+        return complete_outputs
+
+    def get_config(self):
+        raise NotImplementedError
@@ -0,0 +1,97 @@
+from typing import Iterable, Iterator, List
+
+import numpy as np
+from tfaip.data.pipeline.definitions import Sample
+
+# meta of a chunk of a line: [index of the line, index of the chunk, number of chunks, start and end of the chunk in
+# the line (pixels)]
+LINE_CHUNK = "line_chunk"
+
+# outputs of the model that are stitched frame by frame (each also with the suffix of an ensemble member)
+FRAME_OUTPUTS = ["logits", "softmax", "blank_last_logits", "blank_last_softmax"]
+
+
+def split_line(sample: Sample, line: int, chunk_width: int, overlap: int, downscale_factor: int) -> List[Sample]:
+    """
+    Split a pre-processed line that is wider than `chunk_width` into chunks of this width that overlap by (at least)
+    `overlap` pixels. The chunks start at multiples of the `downscale_factor` of the model so that their frames are
+    aligned to the frames of the complete line. `line` is a unique index of the line.
+    """
+    width = sample.inputs["img"].shape[0]
+    if width <= chunk_width:
+        return [sample]
+
+    stride = max(downscale_factor, (chunk_width - overlap) // downscale_factor * downscale_factor)
+    bounds = []
+    start = 0
+    while not bounds or bounds[-1][1] < width:
+        bounds.append((start, min(start + chunk_width, width)))
+        start += stride
+
+    return [
+        Sample(
+            inputs={"img": sample.inputs["img"][start:end], "img_len": np.asarray([end - start])},
+            meta={**sample.meta, LINE_CHUNK: [line, i, len(bounds), start, end]},
+        )
+        for i, (start, end) in enumerate(bounds)
+    ]
+
+
+def stitch_outputs(chunks: List[Sample], outputs: List[dict], downscale_factor: int) -> dict:
+    """
+    Stitch the outputs of the model for the chunks of a line at the frame level: each chunk contributes the frames up
+    to the middle of its overlap with the next chunk. The frames of a chunk start at its start // downscale_factor.
+    """
+    bounds = [chunk.meta[LINE_CHUNK][3:] for chunk in chunks]
+    cuts = [0] + [(start + prev_end) // 2 // downscale_factor for (_, prev_end), (start, _) in zip(bounds, bounds[1:])]
+
+    stitched = {}
+    for out_len in [k for k in outputs[0].keys() if k.startswith("out_len")]:
+        suffix = out_len[len("out_len") :]
+        lengths = [int(np.reshape(o[out_len], -1)[0]) for o in outputs]
+        ends = cuts[1:] + [bounds[-1][0] // downscale_factor + lengths[-1]]
+        frames = [
+            (max(0, cut - start // downscale_factor), max(0, min(length, end - start // downscale_factor)))
+            for cut, end, (start, _), length in zip(cuts, ends, bounds, lengths)
+        ]
+        for name in FRAME_OUTPUTS:
+            if name + suffix in outputs[0]:
+                stitched[name + suffix] = np.concatenate(
+                    [o[name + suffix][first:last] for o, (first, last) in zip(outputs, frames)], axis=0
+                )
+        stitched[out_len] = np.asarray([sum(last - first for first, last in frames)], dtype=outputs[0][out_len].dtype)
+
+    return stitched
+
+
+def stitch_chunks(samples: Iterable[Sample], downscale_factors: List[int]) -> Iterator[Sample]:
+    """
+    Merge the predicted chunks of each line (see `split_line`) into one sample whose outputs are stitched (see
+    `stitch_outputs`), other samples are passed through. The chunks of a line can arrive in any order.
+    For a MultiPredictor the outputs of each model are stitched with the downscale factor of the model.
+    """
+    pending = {}
+    for sample in samples:
+        if LINE_CHUNK not in sample.meta:
+            yield sample
+            continue
+
+        line, index, num_chunks, _, _ = sample.meta[LINE_CHUNK]
+        line_chunks = pending.setdefault(line, {})
+        line_chunks[index] = sample
+        if len(line_chunks) < num_chunks:
+            continue
+
+        del pending[line]
+        chunks = [line_chunks[i] for i in range(num_chunks)]
+        meta = {k: v for k, v in chunks[0].meta.items() if k != LINE_CHUNK}
+        inputs = {"img_len": np.asarray([chunks[-1].meta[LINE_CHUNK][4]], dtype=np.int32)}
+        if isinstance(chunks[0].outputs, dict):
+            outputs = stitch_outputs(chunks, [c.outputs for c in chunks], downscale_factors[0])
+        else:
+            # MultiPredictor: only stitch the models that predicted all chunks (see the cascade)
+            num_models = min(len(c.outputs) for c in chunks)
+            outputs = [
+                stitch_outputs(chunks, [c.outputs[m] for c in chunks], downscale_factors[m]) for m in range(num_models)
+            ]
+        yield Sample(inputs=inputs, outputs=outputs, targets=chunks[0].targets, meta=meta)
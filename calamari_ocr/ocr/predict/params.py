@@ -6,6 +6,7 @@ import tfaip as tfaip
 from dataclasses_json import dataclass_json
 from paiargparse import pai_meta
 from tfaip.data.pipeline.definitions import Sample
+from tfaip.util.enum import StrEnum
 
 
 @dataclass_json
@@ -58,6 +59,65 @@ class PredictorParams(tfaip.PredictorParams):
     # override defaults
     silent: bool = field(default=True, metadata=pai_meta(mode="ignore"))
 
+    max_batch_pixels: int = field(
+        default=0,
+        metadata=pai_meta(
+            help="If > 0, batch lines of similar width so that a padded batch has at most this many pixels (width x "
+            "line height) instead of batches of pipeline.batch_size lines. The predictions keep their order."
+        ),
+    )
+    batching_window: int = field(
+        default=512,
+        metadata=pai_meta(
+            help="Number of lines that are sorted by their width for max_batch_pixels (bounds the memory)"
+        ),
+    )
+    max_batch_wait_ms: int = field(
+        default=0,
+        metadata=pai_meta(
+            help="If > 0, the lines are batched as they arrive (e.g. the requests of calamari-serve): a batch is "
+            "predicted when it has pipeline.batch_size lines or this many milliseconds after its first line arrived."
+        ),
+    )
+    chunk_width: int = field(
+        default=0,
+        metadata=pai_meta(
+            help="If > 0, pre-processed lines that are wider are predicted in overlapping chunks of this width whose "
+            "outputs are stitched before decoding."
+        ),
+    )
+    chunk_overlap: int = field(default=256, metadata=pai_meta(help="Overlap of the chunks of a line (pixels)"))
+    blank_ink_ratio: float = field(
+        default=0,
+        metadata=pai_meta(
+            help="If > 0, lines whose ratio of ink pixels (after pre-processing) is below are not predicted but yield "
+            "an empty prediction."
+        ),
+    )
+    skip_duplicate_lines: bool = field(
+        default=False,
+        metadata=pai_meta(help="Predict identical (pre-processed) line images only once."),
+    )
+    duplicate_cache_size: int = field(
+        default=256,
+        metadata=pai_meta(help="Number of distinct lines whose outputs are kept for their duplicates."),
+    )
+
+
+class CascadeConfidence(StrEnum):
+    AvgCharProbability = "avg_char_probability"
+    SentenceProbability = "sentence_probability"
+
+
+@dataclass_json
+@dataclass
+class CascadeParams:
+    # Cascade of a MultiPredictor: the first model predicts all lines, the remaining models are only applied (and
+    # voted) on lines whose confidence of the first model is below the threshold (0 disables the cascade)
+    threshold: float = 0
+    # confidence of the greedy decoding of the first model: avg char probability or probability of the sentence
+    confidence: CascadeConfidence = CascadeConfidence.AvgCharProbability
+
 
 class PredictionResult:
     def __init__(
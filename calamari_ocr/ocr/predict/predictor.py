@@ -1,16 +1,30 @@
-from typing import List
+from typing import Any, AsyncIterable, AsyncIterator, List, Iterable, Optional, Tuple
 
+import numpy as np
+
+import tensorflow as tf
 from tensorflow import keras
 
+from tfaip.data.pipeline.datapipeline import DataPipeline
+from tfaip.data.pipeline.definitions import Sample
 from tfaip.data.pipeline.processor.params import SequentialProcessorPipelineParams
 from tfaip.device.device_config import DeviceConfig
 import tfaip.imports as tfaip_cls
+from tfaip.predict.multimodelpostprocessor import MultiModelPostProcessorParams
 from tfaip.predict.multimodelpredictor import MultiModelVoter
+from tfaip.util.multiprocessing.parallelmap import tqdm_wrapper
 
-from calamari_ocr.ocr.predict.params import PredictorParams
+from calamari_ocr.ocr.predict.batching import PredictionInputPipeline, restore_order
+from calamari_ocr.ocr.predict.chunking import stitch_chunks
+from calamari_ocr.ocr.predict.cascade import CascadeModel, ESCALATED
+from calamari_ocr.ocr.predict.params import Prediction, PredictorParams, CascadeParams
+from calamari_ocr.ocr.predict.skipping import LineSkipper, empty_outputs
+from calamari_ocr.ocr.predict.streaming import predict_stream
 from calamari_ocr.ocr.scenario import CalamariScenario
 from calamari_ocr.ocr.voting import VoterParams
 from calamari_ocr.ocr import SavedCalamariModel, DataParams
+from calamari_ocr.ocr.dataset.postprocessors.ctcdecoder import BatchCTCDecoder, DECODED_PREDICTION
+from calamari_ocr.ocr.model.ensemblegraph import ensemble_outputs
 from calamari_ocr.ocr.voting.adapter import CalamariMultiModelVoter
 from calamari_ocr.utils.output_to_input_transformer import OutputToInputTransformer
 
@@ -31,6 +45,105 @@ class Predictor(tfaip_cls.Predictor):
         )
         return predictor
 
+    @staticmethod
+    def from_checkpoints(params: PredictorParams, checkpoints: List[str], auto_update_checkpoints=True):
+        """
+        Fuse independently trained checkpoints into one model that is applied like an ensemble model: the input is
+        pre-processed and fed once, the softmax outputs of the models are averaged, and the outputs of the individual
+        models are decoded as the `voter_predictions` of each prediction.
+
+        The checkpoints must be compatible, i.e. have the same line height, input channels, codec, downscale factor
+        and pre-processing.
+        """
+        if not checkpoints:
+            raise ValueError("No checkpoints provided.")
+        if len(checkpoints) == 1:
+            return Predictor.from_checkpoint(params, checkpoints[0], auto_update_checkpoints)
+
+        DeviceConfig(params.device)  # Device must be specified first
+        ckpts = [SavedCalamariModel(checkpoint, auto_update=auto_update_checkpoints) for checkpoint in checkpoints]
+        scenario_params = [CalamariScenario.params_from_dict(ckpt.dict) for ckpt in ckpts]
+        data_params = scenario_params[0].data
+        if data_params.ensemble > 0:
+            raise ValueError(f"Checkpoint {ckpts[0].ckpt_path} is an ensemble and can not be fused")
+        for ckpt, p in zip(ckpts[1:], scenario_params[1:]):
+            for name in ["line_height", "input_channels", "downscale_factor", "ensemble", "pre_proc"]:
+                if getattr(p.data, name) != getattr(data_params, name):
+                    raise ValueError(f"Checkpoint {ckpt.ckpt_path} can not be fused, its {name} differs")
+            if p.data.codec.charset != data_params.codec.charset:
+                raise ValueError(f"Checkpoint {ckpt.ckpt_path} can not be fused, its codec differs")
+
+        data_params.ensemble = len(ckpts)
+        scenario = CalamariScenario(scenario_params[0])
+        predictor = Predictor(params, scenario.create_data())
+        models = [
+            keras.models.load_model(
+                ckpt.ckpt_path + ".h5",
+                custom_objects=CalamariScenario.model_cls().all_custom_objects(),
+            )
+            for ckpt in ckpts
+        ]
+        for i, model in enumerate(models):
+            model._name = f"{i}_{model.name}"  # the names of the models must be unique
+        predictor.set_model(FusedModel(models))
+        return predictor
+
+    def __init__(self, params: PredictorParams, data):
+        super().__init__(params, data)
+        self._batch_ctc_decoder = BatchCTCDecoder(data.params, self.params.pipeline.mode)
+        self.line_skipper: Optional[LineSkipper] = None
+
+    def predict_pipeline(self, pipeline: DataPipeline) -> Iterable[Sample]:
+        if not PredictionInputPipeline.required(self.params):
+            return super().predict_pipeline(pipeline)
+
+        if LineSkipper.required(self.params):
+            self.line_skipper = LineSkipper(self.params, empty_outputs(self.data.params))
+        pipeline = PredictionInputPipeline(pipeline, self.params, self.data.params.downscale_factor, self.line_skipper)
+        return restore_order(super().predict_pipeline(pipeline))
+
+    def predict_dataset(self, dataset) -> Iterable[Sample]:
+        samples = super().predict_dataset(dataset)
+        if self.params.chunk_width > 0:
+            samples = stitch_chunks(samples, [self.data.params.downscale_factor])
+        if self.line_skipper is not None:
+            samples = self.line_skipper.merge(samples)
+        return samples
+
+    def _unwrap_batch(self, inputs, targets, outputs, meta):
+        predictions = self._batch_ctc_decoder(outputs)
+        for i, sample in enumerate(super()._unwrap_batch(inputs, targets, outputs, meta)):
+            if predictions is not None:
+                sample.outputs[DECODED_PREDICTION] = predictions[i]
+            yield sample
+
+    def predict_stream(
+        self, images: AsyncIterable[Tuple[Any, np.ndarray]], max_queue_size: int = 64
+    ) -> AsyncIterator[Prediction]:
+        """Asynchronously predict the `(id, image)` pairs of an async iterable, see `streaming.predict_stream`"""
+        return predict_stream(self, images, max_queue_size)
+
+
+class FusedModel(keras.Model):
+    """
+    Applies independently trained models on the same inputs within one graph, so that TF can schedule them
+    concurrently. The outputs are those of an ensemble (see `EnsembleGraph`): the outputs of the averaged softmax and
+    the outputs of each model with a `_i` suffix.
+    """
+
+    def __init__(self, models: List[keras.Model], **kwargs):
+        super().__init__(**kwargs)
+        self.fused_models = models
+
+    def call(self, inputs, training=None, mask=None):
+        complete_outputs = [model(inputs) for model in self.fused_models]
+        lstm_seq_len = complete_outputs[0]["out_len"]  # is the same for all models (same downscale factor)
+        softmax_outputs = tf.stack([out["blank_last_softmax"] for out in complete_outputs], axis=0)
+        return ensemble_outputs(tf.reduce_mean(softmax_outputs, axis=0), lstm_seq_len, complete_outputs)
+
+    def get_config(self):
+        raise NotImplementedError
+
 
 class MultiPredictor(tfaip_cls.MultiModelPredictor):
     @classmethod
@@ -40,6 +153,7 @@ class MultiPredictor(tfaip_cls.MultiModelPredictor):
         auto_update_checkpoints=True,
         predictor_params: PredictorParams = None,
         voter_params: VoterParams = None,
+        cascade_params: CascadeParams = None,
         **kwargs,
     ) -> "tfaip_cls.MultiModelPredictor":
         if not checkpoints:
@@ -55,18 +169,106 @@ class MultiPredictor(tfaip_cls.MultiModelPredictor):
             predictor_params,
             CalamariScenario,
             model_paths=[ckpt.ckpt_path + ".h5" for ckpt in checkpoints],
-            predictor_args={"voter_params": voter_params},
+            predictor_args={"voter_params": voter_params, "cascade_params": cascade_params},
         )
 
         return multi_predictor
 
-    def __init__(self, voter_params, *args, **kwargs):
+    def __init__(self, voter_params, *args, cascade_params=None, **kwargs):
         super(MultiPredictor, self).__init__(*args, **kwargs)
         self.voter_params = voter_params or VoterParams()
+        self.cascade_params = cascade_params or CascadeParams()
+        self._batch_ctc_decoders = []
+        self.cascade_lines = 0
+        self.cascade_escalated = 0
+        self.line_skipper: Optional[LineSkipper] = None
+
+    def set_models(self, models, datas):
+        models = [self._load_model(model) for model in models]
+        super().set_models(models, datas)
+        if self.cascade_params.threshold > 0 and len(models) > 1:
+            self._keras_model = CascadeModel(models, self.cascade_params)
+        self._batch_ctc_decoders = [BatchCTCDecoder(data.params, self.params.pipeline.mode) for data in datas]
+
+    @property
+    def escalation_rate(self) -> float:
+        """Fraction of the lines that were predicted by all models of the cascade (only the first model otherwise)"""
+        return self.cascade_escalated / max(1, self.cascade_lines)
+
+    def predict_stream(
+        self, images: AsyncIterable[Tuple[Any, np.ndarray]], max_queue_size: int = 64
+    ) -> AsyncIterator[Prediction]:
+        """Asynchronously predict the `(id, image)` pairs of an async iterable, see `streaming.predict_stream`"""
+        return predict_stream(self, images, max_queue_size)
+
+    def _unwrap_batch(self, inputs, targets, outputs, meta):
+        escalated = outputs[0].pop(ESCALATED, None)
+        predictions = [decoder(model_outputs) for decoder, model_outputs in zip(self._batch_ctc_decoders, outputs)]
+        for i, sample in enumerate(super()._unwrap_batch(inputs, targets, outputs, meta)):
+            if escalated is not None:
+                # the outputs of the remaining models are only valid for escalated lines, otherwise only the first
+                # model is post-processed and "voted"
+                self.cascade_lines += 1
+                if escalated[i]:
+                    self.cascade_escalated += 1
+                else:
+                    sample = sample.new_outputs(sample.outputs[:1])
+            for model_outputs, model_predictions in zip(sample.outputs, predictions):
+                if model_predictions is not None:
+                    model_outputs[DECODED_PREDICTION] = model_predictions[i]
+            yield sample
+
+    def predict_pipeline(self, pipeline: DataPipeline) -> Iterable[Sample]:
+        if not PredictionInputPipeline.required(self.params):
+            return self._predict_pipeline(pipeline)
+
+        if LineSkipper.required(self.params):
+            self.line_skipper = LineSkipper(self.params, [empty_outputs(data.params) for data in self.datas])
+        # the chunks must be aligned to the frames of all models
+        downscale_factor = np.lcm.reduce([data.params.downscale_factor for data in self.datas])
+        pipeline = PredictionInputPipeline(pipeline, self.params, int(downscale_factor), self.line_skipper)
+        return restore_order(self._predict_pipeline(pipeline))
+
+    def predict_dataset(self, dataset) -> Iterable[Sample]:
+        samples = super().predict_dataset(dataset)
+        if self.params.chunk_width > 0:
+            samples = stitch_chunks(samples, [data.params.downscale_factor for data in self.datas])
+        if self.line_skipper is not None:
+            samples = self.line_skipper.merge(samples)
+        return samples
+
+    def _predict_pipeline(self, pipeline: DataPipeline) -> Iterable[Sample]:
+        if self.voter_params.processes <= 1:
+            yield from super().predict_pipeline(pipeline)
+            return
+
+        # As the MultiModelPredictor, but only the post-processing of the individual models runs in the pipeline.
+        # The samples are voted in batches in the voter pool, so only the decoded predictions are sent to its processes
+        voter = self.create_voter(self._data.params)
+        post_processors = [
+            d.get_or_create_pipeline(self.params.pipeline, pipeline.generator_params).create_output_pipeline()
+            for d in self._datas
+        ]
+        post_proc_pipeline = SequentialProcessorPipelineParams(
+            processors=[MultiModelPostProcessorParams(voter=_JoinVoter(), post_processors=post_processors)],
+            run_parallel=False,
+        )
+
+        with pipeline as rd:
+            post_proc_pipeline = post_proc_pipeline.create(pipeline.pipeline_params, self.data.params)
+
+            results = tqdm_wrapper(
+                self.predict_dataset(rd.input_dataset()),
+                progress_bar=self._params.progress_bar,
+                desc="Prediction",
+                total=len(rd),
+            )
+            for r in voter.vote_samples(post_proc_pipeline.apply(results)):
+                yield voter.finalize_sample(r)
 
     def create_voter(self, data_params: "DataParams") -> MultiModelVoter:
         # Cut non text processors (first two)
-        # force run_parallel = False because the voter itself already runs in separate threads
+        # force run_parallel = False because the voter itself already runs in separate threads (or processes)
         post_proc_params = [
             SequentialProcessorPipelineParams(run_parallel=False, processors=data.params.post_proc.processors[2:])
             for data in self.datas
@@ -75,3 +277,9 @@ class MultiPredictor(tfaip_cls.MultiModelPredictor):
         pre_proc = self.data.params.pre_proc.create(self.params.pipeline, self.data.params)
         out_to_in_transformer = OutputToInputTransformer(pre_proc)
         return CalamariMultiModelVoter(self.voter_params, self.datas, post_proc, out_to_in_transformer)
+
+
+class _JoinVoter(MultiModelVoter):
+    # keeps the joined outputs of all models, they are voted afterwards by the CalamariMultiModelVoter
+    def vote(self, sample: Sample) -> Sample:
+        return sample
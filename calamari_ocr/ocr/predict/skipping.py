@@ -0,0 +1,118 @@
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from copy import deepcopy
+from typing import Iterable, Iterator, List, Union
+
+import numpy as np
+from tfaip.data.pipeline.definitions import Sample
+
+from calamari_ocr.ocr.predict.chunking import FRAME_OUTPUTS
+from calamari_ocr.ocr.predict.params import PredictorParams
+
+# meta of a sample: the hash of its pre-processed line image if duplicates of the line are skipped
+LINE_HASH = "line_hash"
+
+
+def ink_ratio(img: np.ndarray) -> float:
+    """Ratio of the ink pixels of a pre-processed line (the line is inverted, i.e. ink is bright)"""
+    if img.size == 0:
+        return 0
+    return np.count_nonzero(img > 127) / img.size
+
+
+def line_hash(img: np.ndarray) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(img.shape).encode("utf-8"))
+    h.update(np.ascontiguousarray(img).tobytes())
+    return h.hexdigest()
+
+
+def empty_outputs(data_params) -> dict:
+    """The outputs of the model for a line without any frame (also for the members of an ensemble)"""
+    outputs = {}
+    for suffix in [""] + [f"_{i}" for i in range(data_params.ensemble)]:
+        for name in FRAME_OUTPUTS:
+            outputs[name + suffix] = np.zeros((0, len(data_params.codec)), dtype=np.float32)
+        outputs["out_len" + suffix] = np.zeros((1,), dtype=np.int32)
+    return outputs
+
+
+class LineSkipper:
+    """
+    Skips the inference of blank lines (whose ink ratio is below `PredictorParams.blank_ink_ratio`) and of the
+    duplicates of a line (identical pre-processed line images) if `PredictorParams.skip_duplicate_lines` is set.
+
+    `filter` is applied on the pre-processed samples before they are fed to the model, `merge` on the predicted samples
+    of the model: it adds the skipped lines with empty outputs (blank lines) or with a copy of the outputs of the line
+    that was predicted (duplicates). The outputs of the last `duplicate_cache_size` distinct lines are kept for this.
+    The filter runs in the thread of the input pipeline, thus the state is locked.
+    """
+
+    def __init__(self, params: PredictorParams, outputs: Union[dict, List[dict]]):
+        self.params = params
+        self.empty_outputs = outputs
+        self.blank_lines = 0
+        self.duplicate_lines = 0
+        self._lock = threading.Lock()
+        self._skipped = deque()  # skipped samples with outputs that can be yielded
+        self._waiting = {}  # duplicates of lines that are predicted but whose outputs did not arrive yet
+        self._outputs = OrderedDict()  # outputs of the last distinct lines
+
+    @staticmethod
+    def required(params: PredictorParams) -> bool:
+        return params.blank_ink_ratio > 0 or params.skip_duplicate_lines
+
+    @property
+    def skipped_lines(self) -> int:
+        return self.blank_lines + self.duplicate_lines
+
+    def filter(self, samples: Iterable[Sample]) -> Iterator[Sample]:
+        for sample in samples:
+            img = sample.inputs["img"]
+            skipped = Sample(inputs={"img_len": sample.inputs["img_len"]}, meta=sample.meta)
+            if ink_ratio(img) < self.params.blank_ink_ratio:
+                with self._lock:
+                    self.blank_lines += 1
+                    self._skipped.append(skipped.new_outputs(deepcopy(self.empty_outputs)))
+                continue
+
+            if self.params.skip_duplicate_lines:
+                h = line_hash(img)
+                with self._lock:
+                    if h in self._outputs:
+                        self.duplicate_lines += 1
+                        self._outputs.move_to_end(h)
+                        self._skipped.append(skipped.new_outputs(deepcopy(self._outputs[h])))
+                        continue
+                    if h in self._waiting:
+                        self.duplicate_lines += 1
+                        self._waiting[h].append(skipped)
+                        continue
+                    self._waiting[h] = []
+                sample = sample.new_meta({**sample.meta, LINE_HASH: h})
+
+            yield sample
+
+    def merge(self, samples: Iterable[Sample]) -> Iterator[Sample]:
+        for sample in samples:
+            h = sample.meta.pop(LINE_HASH, None)
+            if h is not None:
+                with self._lock:
+                    for duplicate in self._waiting.pop(h, []):
+                        self._skipped.append(duplicate.new_outputs(deepcopy(sample.outputs)))
+                    self._outputs[h] = deepcopy(sample.outputs)
+                    while len(self._outputs) > self.params.duplicate_cache_size:
+                        self._outputs.popitem(last=False)
+            yield sample
+            yield from self._pop_skipped()
+
+        yield from self._pop_skipped()
+
+    def _pop_skipped(self) -> Iterator[Sample]:
+        while True:
+            with self._lock:
+                if not self._skipped:
+                    return
+                sample = self._skipped.popleft()
+            yield sample
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from collections import deque
+from queue import Queue
+from typing import Any, AsyncIterable, AsyncIterator, Tuple
+
+import numpy as np
+
+from calamari_ocr.ocr.predict.params import Prediction
+
+
+class _End:
+    pass
+
+
+async def predict_stream(
+    predictor, images: AsyncIterable[Tuple[Any, np.ndarray]], max_queue_size: int = 64
+) -> AsyncIterator[Prediction]:
+    """
+    Predict the `(id, image)` pairs of an async iterable with the (blocking) `predict_raw` of a Predictor or
+    MultiPredictor that runs in a worker thread, so that the producer of the images and the inference overlap.
+    At most `max_queue_size` images are read ahead of the yielded predictions (back-pressure on the producer).
+
+    The predictions are yielded in the order of the images, their `id` is the id of the image. The MultiPredictor
+    yields the voted predictions.
+    The lines are batched as they arrive, `PredictorParams.max_batch_wait_ms` must be set: otherwise the tf.data
+    pipeline reads further lines (a full batch and its prefetching) before the first one is predicted, which the
+    back-pressure of `max_queue_size` would block forever.
+    """
+    from calamari_ocr.ocr.predict.predictor import Predictor
+
+    if predictor.params.max_batch_wait_ms <= 0:
+        raise ValueError(
+            "The prediction of a stream requires predictor.max_batch_wait_ms > 0, otherwise the predictor waits for "
+            "lines that are only read after the predictions of the previous ones."
+        )
+
+    voted = not isinstance(predictor, Predictor)
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(max(1, max_queue_size))
+    lines = Queue()
+    ids = deque()
+    results = asyncio.Queue()
+
+    def line_generator():
+        while True:
+            image = lines.get()
+            if isinstance(image, _End):
+                return
+            yield image
+
+    def predict():
+        try:
+            for sample in predictor.predict_raw(line_generator(), size=1):
+                prediction = sample.outputs[1] if voted else sample.outputs
+                prediction.id = ids.popleft()
+                loop.call_soon_threadsafe(results.put_nowait, prediction)
+        except BaseException as e:
+            loop.call_soon_threadsafe(results.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(results.put_nowait, _End())
+
+    async def produce():
+        try:
+            async for line_id, image in images:
+                await slots.acquire()
+                ids.append(line_id)
+                lines.put(image)
+        finally:
+            lines.put(_End())
+
+    worker = threading.Thread(target=predict, daemon=True)
+    worker.start()
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            result = await results.get()
+            if isinstance(result, _End):
+                break
+            if isinstance(result, BaseException):
+                raise result
+            slots.release()
+            yield result
+        await producer  # raises the errors of the producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+            # the worker finishes the images of the queue and stops
+        await loop.run_in_executor(None, worker.join)
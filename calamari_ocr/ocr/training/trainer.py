@@ -98,6 +98,16 @@ class Trainer(AIPTrainer):
                         "Alternative select train only data generator mode."
                     )
 
+        if data.params.tf_image_processing and any(
+            p.generator_params.preload for p in [train_pipeline, val_pipeline] if p is not None
+        ):
+            raise ValueError("Preloading is not supported with data.tf_image_processing, disable preload.")
+        if data.params.tf_image_processing and any(
+            p.n_augmentations != 0 for p in data.params.pre_proc.processors_of_type(AugmentationProcessorParams)
+        ):
+            # the augmentation expects prepared lines, but the image processors are applied later in the input graph
+            raise ValueError("Data augmentation is not supported with data.tf_image_processing, set n_augmentations 0.")
+
         if self.params.gen.train_data(data).generator_params.preload:
             # preload before codec was created (not all processors can be applied, yet)
             data.preload(progress_bar=self._params.progress_bar)
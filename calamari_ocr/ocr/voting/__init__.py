@@ -1,6 +1,7 @@
 from calamari_ocr.ocr.voting.params import VoterParams, VoterType
 from calamari_ocr.ocr.voting.sequence_voter import SequenceVoter, Voter
 from calamari_ocr.ocr.voting.confidence_voter import ConfidenceVoter
+from calamari_ocr.ocr.voting.logit_voter import LogitVoter
 
 
 def voter_from_params(voter_params: VoterParams) -> Voter:
@@ -8,5 +9,7 @@ def voter_from_params(voter_params: VoterParams) -> Voter:
         return SequenceVoter()
     elif voter_params.type == VoterType.ConfidenceVoterDefaultCTC:
         return ConfidenceVoter(blank_index=voter_params.blank_index)
+    elif voter_params.type == VoterType.LogitVoterDefaultCTC:
+        return LogitVoter(blank_index=voter_params.blank_index)
     else:
         raise Exception("Unknown voter type '{}'".format(voter_params.type))
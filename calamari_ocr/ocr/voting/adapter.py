@@ -1,10 +1,11 @@
-from typing import List
+from typing import List, Iterable, Iterator
 
 from tfaip.data.pipeline.definitions import Sample
 from tfaip.predict.multimodelvoter import MultiModelVoter
 
-from calamari_ocr.ocr.predict.params import PredictionResult
-from calamari_ocr.ocr.voting import voter_from_params
+from calamari_ocr.ocr.predict.params import PredictionResult, Prediction
+from calamari_ocr.ocr.voting import voter_from_params, LogitVoter
+from calamari_ocr.ocr.voting.voter_pool import VoterPool
 from calamari_ocr.utils.output_to_input_transformer import OutputToInputTransformer
 
 
@@ -16,16 +17,26 @@ class CalamariMultiModelVoter(MultiModelVoter):
         post_proc,
         out_to_in_transformer: OutputToInputTransformer,
     ):
+        self.voter_params = voter_params
         self.voter = voter_from_params(voter_params)
         self.codecs = [d.params.codec for d in datas]
         self.out_to_in_transformer = out_to_in_transformer
         self.post_proc = post_proc
 
     def _convert_sample_to_prediction_results(self, sample: Sample) -> List[PredictionResult]:
-        inputs, outputs, meta = sample.inputs, sample.outputs, sample.meta
+        return self._prediction_results(
+            sample.outputs,
+            sample.meta,
+            sample.inputs["img_len"],
+            [prediction.logits.shape[0] for prediction in sample.outputs],
+        )
+
+    def _prediction_results(self, predictions, meta, img_len, frames) -> List[PredictionResult]:
         prediction_results = []
 
-        for i, (prediction, m, codec, post_) in enumerate(zip(outputs, meta, self.codecs, self.post_proc)):
+        for i, (prediction, m, codec, post_, f) in enumerate(
+            zip(predictions, meta, self.codecs, self.post_proc, frames)
+        ):
             prediction.id = f"fold_{i}"
             prediction_results.append(
                 PredictionResult(
@@ -35,23 +46,46 @@ class CalamariMultiModelVoter(MultiModelVoter):
                     out_to_in_trans=make_out_to_in(
                         meta=m,
                         out_to_in_transformer=self.out_to_in_transformer,
-                        model_factor=sample.inputs["img_len"] / prediction.logits.shape[0],
+                        model_factor=img_len / f,
                     ),
                 )
             )
 
         return prediction_results
 
-    def vote(self, sample: Sample) -> Sample:
-        inputs, outputs, meta = sample.inputs, sample.outputs, sample.meta
-        prediction_results = self._convert_sample_to_prediction_results(sample)
+    def requires_logits(self) -> bool:
+        return isinstance(self.voter, LogitVoter)
+
+    def vote_predictions(self, predictions: List[Prediction], meta, img_len, frames) -> Prediction:
+        """
+        Vote the decoded predictions of the models for one sample, `frames` is the number of frames of the output of
+        each model
+        """
+        prediction_results = self._prediction_results(predictions, meta, img_len, frames)
 
         # vote the results (if only one model is given, this will just return the sentences)
         prediction = self.voter.vote_prediction_result(prediction_results)
         prediction.id = "voted"
+        return prediction
+
+    def vote(self, sample: Sample) -> Sample:
+        inputs, outputs, meta = sample.inputs, sample.outputs, sample.meta
+        frames = [prediction.logits.shape[0] for prediction in outputs]
+        prediction = self.vote_predictions(outputs, meta, inputs["img_len"], frames)
 
         return Sample(inputs=inputs, outputs=(outputs, prediction), meta=meta)
 
+    def vote_samples(self, samples: Iterable[Sample]) -> Iterator[Sample]:
+        """
+        Vote all samples, in a pool of processes if `VoterParams.processes` > 1. The samples are returned in order.
+        """
+        if self.voter_params.processes <= 1:
+            yield from map(self.vote, samples)
+            return
+
+        with VoterPool(self, self.voter_params.processes, self.voter_params.batch_size) as pool:
+            yield from pool.vote_samples(samples)
+
     def finalize_sample(self, sample: Sample) -> Sample:
         prediction_results = self._convert_sample_to_prediction_results(sample.new_outputs(sample.outputs[0]))
         return sample.new_outputs((prediction_results, sample.outputs[1])).new_meta(sample.meta[0])
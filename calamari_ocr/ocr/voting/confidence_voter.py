@@ -1,4 +1,7 @@
 import operator
+from typing import List
+
+import numpy as np
 
 from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder import (
     PredictionPosition,
@@ -8,14 +11,6 @@ from calamari_ocr.ocr.dataset.textprocessors import synchronize
 from calamari_ocr.ocr.voting.voter import Voter
 
 
-def add_llocs(s, new):
-    for char in new.keys():
-        if char in s:
-            s[char] += new[char]
-        else:
-            s[char] = new[char]
-
-
 def find_voters_with_most_frequent_length(sync, voters):
     lengths = {}
 
@@ -32,68 +27,93 @@ def find_voters_with_most_frequent_length(sync, voters):
     return [i for i, voter in enumerate(voters) if sync.length(i) == most_freq], most_freq
 
 
-class MergeableCharacter:
-    def __init__(self, char, p, start, stop):
-        self.char = char
-        self.p = p
-        self.start = start
-        self.stop = stop
-
-    def merge(self, char, p, start, stop):
-        assert self.char == char
-        self.p += p
-        self.start = min(start, self.start)
-        self.stop = max(stop, self.stop)
-
-
-def perform_conf_vote(voters):
-    results = [voter["sequence"] for voter in voters]
-    synclist = synchronize(results)
-
-    final_result = []
-
-    for sync in synclist:
-        actual_voters, most_freq_length = find_voters_with_most_frequent_length(sync, voters)
-
-        # set of all characters (check if all say the same, then the set size is one)
-        s = []
-        for r in [
-            voters[voter_id]["sequence"][sync.start(voter_id) : sync.stop(voter_id) + 1] for voter_id in actual_voters
-        ]:
-            if r not in s:
-                s.append(r)
-
-        def add_char(actual_voters, i):
-            c_p = {}
-            for voter_id in actual_voters:
-                idx = i + sync.start(voter_id)
-                alts = voters[voter_id]["alternatives"][idx]
-                pos = voters[voter_id]["positions"][idx]
-                for k, p in alts.items():
-                    if k in c_p:
-                        c_p[k].merge(k, p / len(actual_voters), pos.global_start, pos.global_end)
-                    else:
-                        c_p[k] = MergeableCharacter(k, p / len(actual_voters), pos.global_start, pos.global_end)
-
-            chars = sorted(c_p.values(), key=lambda v: -v.p)
-            final_result.append(chars)
-
-        if len(s) == 1:
-            sentence = s.pop()
-            for i in range(len(sentence)):
-                add_char(actual_voters, i)
-
+class VoterAlternatives:
+    """
+    The alternatives of all positions of a voter as arrays over a charset shared by all voters: the probability of each
+    char, its rank within the alternatives of the position (-1 if it is no alternative), and the global start and end
+    of each position.
+    """
+
+    def __init__(self, positions: List[PredictionPosition], cols: np.ndarray, num_chars: int):
+        # cols: the index of each alternative of all positions (flattened) in the shared charset
+        rows = np.repeat(np.arange(len(positions)), [len(pos.chars) for pos in positions])
+        probabilities = np.array([c.probability for pos in positions for c in pos.chars], dtype=np.float64)
+        ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+
+        # a char that is listed twice keeps its first rank but the last probability
+        keys = rows * num_chars + cols
+        _, first = np.unique(keys, return_index=True)
+        _, last = np.unique(keys[::-1], return_index=True)
+        last = len(keys) - 1 - last
+
+        self.probabilities = np.zeros((len(positions), num_chars))
+        self.probabilities.flat[keys[last]] = probabilities[last]
+        self.ranks = np.full((len(positions), num_chars), -1, dtype=np.int64)
+        self.ranks.flat[keys[first]] = ranks[first]
+        self.global_start = np.array([pos.global_start for pos in positions], dtype=np.int64)
+        self.global_end = np.array([pos.global_end for pos in positions], dtype=np.int64)
+
+
+def perform_conf_vote(sequences, alternatives: List[VoterAlternatives]):
+    """
+    Vote the alternatives of synchronized sequences. At each position, the probabilities of the voters that agree on
+    the most frequent length of the synchronized segment are averaged.
+
+    Returns
+    -------
+        for each voted position: the indices of the chars of the shared charset sorted by descending probability
+        (ties by their first occurrence in the voters), their probabilities, and the global start and end of the best
+        char (the range of all voters that list it as alternative)
+    """
+    if all(sequence == sequences[0] for sequence in sequences[1:]):
+        # all voters agree (common case): a single segment that covers all positions
+        segments = [(list(range(len(sequences))), [0] * len(sequences), len(sequences[0]))]
+    else:
+        segments = []
+        for sync in synchronize(sequences):
+            actual_voters, most_freq_length = find_voters_with_most_frequent_length(sync, sequences)
+            segments.append((actual_voters, [sync.start(v) for v in actual_voters], most_freq_length))
+
+    num_chars = alternatives[0].probabilities.shape[1] if alternatives else 0
+    # key of the first occurrence of a char: the index of the voter, then the rank within its alternatives
+    max_rank = max(a.ranks.max(initial=0) for a in alternatives) + 1 if alternatives else 1
+    voted = []
+    for actual_voters, starts, length in segments:
+        if length == 0:
             continue
 
-        if len(actual_voters) == 1:
-            voter_id = actual_voters[0]
-            for i in range(sync.length(voter_id)):
-                add_char([voter_id], i)
-        else:
-            for i in range(most_freq_length):
-                add_char(actual_voters, i)
-
-    return final_result
+        probabilities = np.zeros((length, num_chars))
+        first_occurrence = np.full((length, num_chars), np.iinfo(np.int64).max)
+        for i, (voter, start) in enumerate(zip(actual_voters, starts)):
+            a = alternatives[voter]
+            probabilities += a.probabilities[start : start + length] / len(actual_voters)
+            ranks = a.ranks[start : start + length]
+            first_occurrence = np.where(
+                (ranks >= 0) & (first_occurrence == np.iinfo(np.int64).max), i * max_rank + ranks, first_occurrence
+            )
+
+        is_alternative = first_occurrence < np.iinfo(np.int64).max
+        order = np.lexsort((first_occurrence, np.where(is_alternative, -probabilities, np.inf)), axis=-1)
+        num_alternatives = np.count_nonzero(is_alternative, axis=1)
+        best = order[:, 0]
+
+        # the range of the best char covers all voters that list it as alternative
+        global_start = np.full(length, np.iinfo(np.int64).max)
+        global_end = np.full(length, np.iinfo(np.int64).min)
+        for voter, start in zip(actual_voters, starts):
+            a = alternatives[voter]
+            has_best = a.ranks[np.arange(start, start + length), best] >= 0
+            global_start = np.where(
+                has_best, np.minimum(global_start, a.global_start[start : start + length]), global_start
+            )
+            global_end = np.where(has_best, np.maximum(global_end, a.global_end[start : start + length]), global_end)
+
+        p = np.take_along_axis(probabilities, order, axis=1)
+        for row in range(length):
+            n = num_alternatives[row]
+            voted.append((order[row, :n], p[row, :n], global_start[row], global_end[row]))
+
+    return voted
 
 
 class ConfidenceVoter(Voter):
@@ -104,40 +124,37 @@ class ConfidenceVoter(Voter):
         self.min_candidate_probability = 1e-4
 
     def _apply_vote(self, predictions, prediction_out):
-        def extract_data(prediction):
-            # We need to vote by chars not labels, because the labels
-            # can be different for different predictions, but labels are universal
-            alternatives = []
-            for pos in prediction.prediction.positions:
-                d = {}
-                alternatives.append(d)
-                for c in pos.chars:
-                    d[c.char] = c.probability
-
-            return {
-                "sequence": prediction.chars,
-                "alternatives": alternatives,
-                "positions": prediction.prediction.positions,
-            }
-
-        voted = perform_conf_vote([extract_data(p) for p in predictions])
+        # We need to vote by chars not labels, because the labels
+        # can be different for different predictions, but labels are universal
+        voter_chars = [[c.char for pos in p.prediction.positions for c in pos.chars] for p in predictions]
+        chars, cols = np.unique(np.array(sum(voter_chars, []), dtype=str), return_inverse=True)
+        chars = chars.tolist()
+        splits = np.cumsum([len(c) for c in voter_chars])[:-1]
+
+        voted = perform_conf_vote(
+            [prediction.chars for prediction in predictions],
+            [
+                VoterAlternatives(prediction.prediction.positions, voter_cols, len(chars))
+                for prediction, voter_cols in zip(predictions, np.split(cols.reshape(-1), splits))
+            ],
+        )
 
         sentence = ""
 
-        for voted_pos in voted:
+        for voted_chars, voted_p, global_start, global_end in voted:
             pos = PredictionPosition()
             prediction_out.positions.append(pos)
-            for character in voted_pos:
+            for c, p in zip(voted_chars.tolist(), voted_p.tolist()):
                 pos.chars.append(
                     PredictionCharacter(
-                        char=character.char,
-                        probability=character.p,
+                        char=chars[c],
+                        probability=p,
                     )
                 )
 
-            if len(voted_pos) > 0:
-                pos.global_start = voted_pos[0].start
-                pos.global_end = voted_pos[0].stop
-                sentence += voted_pos[0].char
+            if len(voted_chars) > 0:
+                pos.global_start = int(global_start)
+                pos.global_end = int(global_end)
+                sentence += chars[voted_chars[0]]
 
         prediction_out.sentence = sentence
@@ -0,0 +1,75 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder import CTCDecoderParams, create_ctc_decoder
+from calamari_ocr.ocr.voting.confidence_voter import ConfidenceVoter
+from calamari_ocr.ocr.voting.voter import Voter
+
+
+class LogitVoter(Voter):
+    """
+    Votes on the frame level: if the outputs of all voters are frame-aligned (same number of frames, i.e. the same
+    downscale factor, and codecs with the same chars), the softmax matrices are averaged (as the `EnsembleGraph` does
+    in the graph) and decoded once by the default CTC decoder. Otherwise, the `fallback` voter is applied.
+    """
+
+    def __init__(self, blank_index=0, fallback: Optional[Voter] = None):
+        super().__init__()
+        self.blank_index = blank_index
+        self.fallback = fallback or ConfidenceVoter(blank_index=blank_index)
+        self._decoders = {}
+
+    def _decoder(self, codec):
+        key = tuple(codec.charset)
+        if key not in self._decoders:
+            self._decoders[key] = create_ctc_decoder(codec, CTCDecoderParams(blank_index=self.blank_index))
+        return self._decoders[key]
+
+    @staticmethod
+    def aligned_logits(predictions) -> Optional[np.ndarray]:
+        """
+        The logits of all voters with the columns in the order of the codec of the first voter (shape voters x frames
+        x chars), or None if the voters are not frame-aligned
+        """
+        codec = predictions[0].codec
+        columns: Dict[Tuple[str, ...], List[int]] = {}
+        logits = []
+        for prediction in predictions:
+            if prediction.logits is None or len(prediction.logits) != len(predictions[0].logits):
+                return None
+            charset = tuple(prediction.codec.charset)
+            if charset not in columns:
+                if len(charset) != len(codec.charset) or set(charset) != set(codec.charset):
+                    return None
+                columns[charset] = [prediction.codec.char2code[c] for c in codec.charset]
+            if columns[charset] == list(range(len(charset))):
+                logits.append(prediction.logits)
+            else:
+                logits.append(prediction.logits[:, columns[charset]])
+
+        return np.stack(logits, axis=0)
+
+    def _apply_vote(self, predictions, prediction_out):
+        logits = self.aligned_logits(predictions)
+        if logits is None:
+            self.fallback._apply_vote(predictions, prediction_out)
+            return
+
+        codec = predictions[0].codec
+        decoder = self._decoder(codec)
+        logits = np.mean(logits, axis=0)
+        prediction = decoder.decode(logits)
+
+        out_to_in_trans = predictions[0].out_to_in_trans
+        for pos in prediction.positions:
+            for c in pos.chars:
+                c.char = codec.code2char[c.label]
+            pos.global_start = int(out_to_in_trans(pos.local_start))
+            pos.global_end = int(out_to_in_trans(pos.local_end))
+
+        prediction_out.labels = list(map(int, prediction.labels))
+        prediction_out.positions = prediction.positions
+        prediction_out.logits = logits
+        prediction_out.total_probability = decoder.prob_of_sentence(logits, prediction_out.labels)
+        prediction_out.sentence = "".join(codec.decode(prediction_out.labels))
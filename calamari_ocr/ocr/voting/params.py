@@ -7,6 +7,8 @@ from tfaip.util.enum import StrEnum
 class VoterType(StrEnum):
     SequenceVoter = "sequence_voter"
     ConfidenceVoterDefaultCTC = "confidence_voter_default_ctc"
+    # average the frame-aligned softmax outputs and decode once (falls back to the confidence voter if not aligned)
+    LogitVoterDefaultCTC = "logit_voter_default_ctc"
 
 
 @dataclass_json
@@ -14,3 +16,7 @@ class VoterType(StrEnum):
 class VoterParams:
     type: VoterType = VoterType.ConfidenceVoterDefaultCTC
     blank_index: int = 0
+
+    # vote the samples of a MultiPredictor in a pool of processes (> 1), in batches of batch_size samples
+    processes: int = 1
+    batch_size: int = 16
@@ -0,0 +1,154 @@
+from collections import deque
+from typing import Iterable, Iterator, List
+
+import numpy as np
+from tfaip.data.pipeline.definitions import Sample
+
+from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder_pool import pool_context
+from calamari_ocr.ocr.predict.params import Prediction, PredictionPosition, PredictionCharacter
+
+# the voter (CalamariMultiModelVoter) of a worker process
+_worker_voter = None
+
+
+def compact_prediction(prediction: Prediction, with_logits: bool = False) -> dict:
+    """
+    A compact representation of a Prediction that is cheap to send to another process: the positions and their
+    alternatives are stored as flat arrays, the logits are only kept if required (otherwise only their length).
+    The predictions of ensemble members (voter_predictions) are dropped.
+    """
+    chars = [c for pos in prediction.positions for c in pos.chars]
+    return {
+        "id": prediction.id,
+        "sentence": prediction.sentence,
+        "labels": np.array(prediction.labels, dtype=np.int32),
+        "positions": np.array(
+            [[p.local_start, p.local_end, p.global_start, p.global_end, len(p.chars)] for p in prediction.positions],
+            dtype=np.int64,
+        ).reshape(-1, 5),
+        "char_labels": np.array([c.label for c in chars], dtype=np.int32),
+        "chars": np.array([c.char for c in chars], dtype=str),
+        "probabilities": np.array([c.probability for c in chars], dtype=np.float64),
+        "frames": len(prediction.logits) if prediction.logits is not None else 0,
+        "logits": prediction.logits if with_logits else None,
+        "total_probability": prediction.total_probability,
+        "avg_char_probability": prediction.avg_char_probability,
+        "is_voted_result": prediction.is_voted_result,
+        "line_path": prediction.line_path,
+    }
+
+
+def restore_prediction(compact: dict) -> Prediction:
+    """Inverse of `compact_prediction`"""
+    chars = [
+        PredictionCharacter(char=c, label=l, probability=p)
+        for c, l, p in zip(
+            compact["chars"].tolist(), compact["char_labels"].tolist(), compact["probabilities"].tolist()
+        )
+    ]
+    positions = []
+    offset = 0
+    for local_start, local_end, global_start, global_end, n in compact["positions"].tolist():
+        positions.append(
+            PredictionPosition(
+                chars=chars[offset : offset + n],
+                local_start=local_start,
+                local_end=local_end,
+                global_start=global_start,
+                global_end=global_end,
+            )
+        )
+        offset += n
+
+    return Prediction(
+        id=compact["id"],
+        sentence=compact["sentence"],
+        labels=compact["labels"].tolist(),
+        positions=positions,
+        logits=compact["logits"],
+        total_probability=compact["total_probability"],
+        avg_char_probability=compact["avg_char_probability"],
+        is_voted_result=compact["is_voted_result"],
+        line_path=compact["line_path"],
+    )
+
+
+def _init_worker(voter):
+    global _worker_voter
+    _worker_voter = voter
+
+
+def _vote_in_worker(batch):
+    results = []
+    for img_len, meta, compact_outputs in batch:
+        predictions = [restore_prediction(c) for c in compact_outputs]
+        frames = [c["frames"] for c in compact_outputs]
+        prediction = _worker_voter.vote_predictions(predictions, meta, img_len, frames)
+        results.append(compact_prediction(prediction, with_logits=True))
+    return results
+
+
+class VoterPool:
+    """
+    Votes the samples of a MultiPredictor in a pool of processes. Only the (compact) decoded predictions of the
+    individual models are sent to the workers, the samples are voted in batches of `batch_size` and returned in order.
+
+    As for the `CTCDecoderPool`, the processes are not forked from the predictor (which runs TensorFlow), each worker
+    receives a pickled copy of the voter (codecs and text post-processors) on start.
+    """
+
+    def __init__(self, voter, processes: int, batch_size: int = 16):
+        self.voter = voter
+        self.processes = processes
+        self.batch_size = max(1, batch_size)
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = pool_context().Pool(self.processes, initializer=_init_worker, initargs=(self.voter,))
+        return self._pool
+
+    def vote_samples(self, samples: Iterable[Sample]) -> Iterator[Sample]:
+        """See `CalamariMultiModelVoter.vote`, applied to all samples (multi-samples of the post-processing)"""
+        pending = deque()  # the batches that are voted, and their async results
+        batch = []
+        for sample in samples:
+            batch.append(sample)
+            if len(batch) == self.batch_size:
+                pending.append(self._submit(batch))
+                batch = []
+                # limit the number of samples that are kept in memory
+                while len(pending) > 2 * self.processes:
+                    yield from self._collect(*pending.popleft())
+
+        if batch:
+            pending.append(self._submit(batch))
+        while pending:
+            yield from self._collect(*pending.popleft())
+
+    def _submit(self, batch: List[Sample]):
+        with_logits = self.voter.requires_logits()
+        tasks = [
+            (sample.inputs["img_len"], sample.meta, [compact_prediction(p, with_logits) for p in sample.outputs])
+            for sample in batch
+        ]
+        return batch, self._get_pool().apply_async(_vote_in_worker, (tasks,))
+
+    @staticmethod
+    def _collect(batch: List[Sample], result) -> Iterator[Sample]:
+        for sample, compact in zip(batch, result.get()):
+            yield Sample(inputs=sample.inputs, outputs=(sample.outputs, restore_prediction(compact)), meta=sample.meta)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
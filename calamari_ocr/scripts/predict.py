@@ -11,11 +11,12 @@ from calamari_ocr import __version__
 from calamari_ocr.ocr.dataset.datareader.base import CalamariDataGeneratorParams
 from calamari_ocr.ocr.dataset.datareader.file import FileDataParams
 from calamari_ocr.ocr.dataset.params import DATA_GENERATOR_CHOICES
+from calamari_ocr.ocr.dataset.postprocessors.ctcdecoder import CTCDecoderProcessorParams
 from calamari_ocr.ocr.model.ctcdecoder.ctc_decoder import (
     CTCDecoderParams,
     CTCDecoderType,
 )
-from calamari_ocr.ocr.predict.params import Predictions, PredictorParams
+from calamari_ocr.ocr.predict.params import Predictions, PredictorParams, CascadeParams
 from calamari_ocr.ocr.voting import VoterParams
 from calamari_ocr.utils.glob import glob_all
 
@@ -54,8 +55,24 @@ class PredictArgs:
             help="Extension format: Either pred or json. Note that json will not print logits.",
         ),
     )
-    ctc_decoder: CTCDecoderParams = field(default_factory=CTCDecoderParams, metadata=pai_meta(mode="ignore"))
+    fuse_checkpoints: bool = field(
+        default=False,
+        metadata=pai_meta(
+            mode="flat",
+            help="Fuse the (compatible) checkpoints into one model that averages their outputs instead of voting the "
+            "results of the individual models.",
+        ),
+    )
+    ctc_decoder: CTCDecoderParams = field(
+        default_factory=CTCDecoderParams,
+        metadata=pai_meta(
+            mode="flat",
+            help="Parameters of the CTC decoder, e.g. a dictionary (with a cache dir for its language model) or a "
+            "character n-gram language model (ARPA file) for the beam search. By default, the decoder of the model.",
+        ),
+    )
     voter: VoterParams = field(default_factory=VoterParams)
+    cascade: CascadeParams = field(default_factory=CascadeParams)
     output_dir: Optional[str] = field(
         default=None,
         metadata=pai_meta(
@@ -79,14 +96,17 @@ def prepare_ctc_decoder_params(ctc_decoder: CTCDecoderParams):
         logger.info("Creating dictionary")
         for path in glob_all(ctc_decoder.dictionary):
             with open(path, "r") as f:
-                dictionary = dictionary.union({word for word in f.read().split()})
+                dictionary.update(f.read().split())
 
-        ctc_decoder.dictionary = dictionary
+        # sorted, so that the language model cache of the decoder is identified by the same key in every run
+        ctc_decoder.dictionary = sorted(dictionary)
         logger.info("Dictionary with {} unique words successfully created.".format(len(dictionary)))
 
     if ctc_decoder.dictionary:
-        logger.warning("USING A LANGUAGE MODEL IS CURRENTLY EXPERIMENTAL ONLY. NOTE: THE PREDICTION IS VERY SLOW!")
+        logger.warning("USING A LANGUAGE MODEL IS CURRENTLY EXPERIMENTAL ONLY.")
         ctc_decoder.type = CTCDecoderType.WordBeamSearch
+    elif ctc_decoder.lm_path and ctc_decoder.type == CTCDecoderType.Default:
+        ctc_decoder.type = CTCDecoderType.BeamSearch
 
 
 def run(args: PredictArgs):
@@ -112,13 +132,25 @@ def run(args: PredictArgs):
     prepare_ctc_decoder_params(args.ctc_decoder)
 
     # predict for all models
-    from calamari_ocr.ocr.predict.predictor import MultiPredictor
+    from calamari_ocr.ocr.predict.predictor import MultiPredictor, Predictor
+
+    if args.fuse_checkpoints:
+        predictor = Predictor.from_checkpoints(args.predictor, args.checkpoint)
+        datas = [predictor.data]
+    else:
+        predictor = MultiPredictor.from_paths(
+            checkpoints=args.checkpoint,
+            voter_params=args.voter,
+            cascade_params=args.cascade,
+            predictor_params=args.predictor,
+        )
+        datas = [predictor.data] + predictor.datas
+    if args.ctc_decoder != CTCDecoderParams():
+        # only override the decoder of the models if it was set
+        for data in datas:
+            for p in data.params.post_proc.processors_of_type(CTCDecoderProcessorParams):
+                p.ctc_decoder_params = args.ctc_decoder
 
-    predictor = MultiPredictor.from_paths(
-        checkpoints=args.checkpoint,
-        voter_params=args.voter,
-        predictor_params=args.predictor,
-    )
     do_prediction = predictor.predict(args.data)
     pipeline: CalamariPipeline = predictor.data.get_or_create_pipeline(predictor.params.pipeline, args.data)
     reader = pipeline.reader()
@@ -132,15 +164,20 @@ def run(args: PredictArgs):
 
     # output the voted results to the appropriate files
     for s in do_prediction:
-        _, (result, prediction), meta = s.inputs, s.outputs, s.meta
+        if args.fuse_checkpoints:
+            prediction, meta = s.outputs, s.meta
+            model_predictions = prediction.voter_predictions or []
+        else:
+            _, (result, prediction), meta = s.inputs, s.outputs, s.meta
+            model_predictions = [r.prediction for r in result]
         sample = reader.sample_by_id(meta["id"])
         n_predictions += 1
         sentence = prediction.sentence
 
         avg_sentence_confidence += prediction.avg_char_probability
         if args.verbose:
-            lr = "\u202A\u202B"
-            logger.info("{}: '{}{}{}'".format(meta["id"], lr[get_base_level(sentence)], sentence, "\u202C"))
+            lr = "\u202a\u202b"
+            logger.info("{}: '{}{}{}'".format(meta["id"], lr[get_base_level(sentence)], sentence, "\u202c"))
 
         output_dir = args.output_dir if args.output_dir else os.path.dirname(prediction.line_path)
 
@@ -149,7 +186,7 @@ def run(args: PredictArgs):
         if args.extended_prediction_data:
             ps = Predictions()
             ps.line_path = sample["image_path"] if "image_path" in sample else sample["id"]
-            ps.predictions.extend([prediction] + [r.prediction for r in result])
+            ps.predictions.extend([prediction] + model_predictions)
             output_dir = output_dir if output_dir else os.path.dirname(ps.line_path)
             if not os.path.exists(output_dir):
                 os.mkdir(output_dir)
@@ -173,6 +210,14 @@ def run(args: PredictArgs):
             )
 
     logger.info("Average sentence confidence: {:.2%}".format(avg_sentence_confidence / n_predictions))
+    if not args.fuse_checkpoints and args.cascade.threshold > 0:
+        logger.info("Lines predicted by all models of the cascade: {:.2%}".format(predictor.escalation_rate))
+    if predictor.line_skipper is not None:
+        logger.info(
+            "Skipped the prediction of {} blank and {} duplicate lines".format(
+                predictor.line_skipper.blank_lines, predictor.line_skipper.duplicate_lines
+            )
+        )
 
     reader.store()
     logger.info("All prediction files written")
@@ -0,0 +1,330 @@
+import base64
+import io
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from typing import List, Optional, Union
+
+import numpy as np
+import tfaip.util.logging
+from paiargparse import PAIArgumentParser, pai_meta, pai_dataclass
+from tfaip import PipelineMode
+
+from calamari_ocr import __version__
+from calamari_ocr.ocr.dataset.datareader.pagexml.reader import PageXML
+from calamari_ocr.ocr.predict.params import Prediction, Predictions, PredictorParams, CascadeParams
+from calamari_ocr.ocr.voting import VoterParams
+from calamari_ocr.utils import split_all_ext
+from calamari_ocr.utils.glob import glob_all
+from calamari_ocr.utils.image import ImageLoaderParams
+
+logger = tfaip.util.logging.logger(__name__)
+
+
+@pai_dataclass
+@dataclass
+class ServeArgs:
+    checkpoint: List[str] = field(metadata=pai_meta(mode="flat", help="Path to the checkpoint without file extension"))
+    fuse_checkpoints: bool = field(
+        default=False,
+        metadata=pai_meta(
+            mode="flat",
+            help="Fuse the (compatible) checkpoints into one model that averages their outputs instead of voting the "
+            "results of the individual models.",
+        ),
+    )
+    voter: VoterParams = field(default_factory=VoterParams)
+    cascade: CascadeParams = field(default_factory=CascadeParams)
+    predictor: PredictorParams = field(
+        default_factory=lambda: PredictorParams(max_batch_wait_ms=10),
+        metadata=pai_meta(
+            fix_dc=True,
+            mode="flat",
+        ),
+    )
+    host: str = field(default="127.0.0.1", metadata=pai_meta(mode="flat", help="Host of the HTTP server"))
+    port: int = field(default=8080, metadata=pai_meta(mode="flat", help="Port of the HTTP server"))
+    socket: Optional[str] = field(
+        default=None,
+        metadata=pai_meta(mode="flat", help="Serve on this Unix socket instead of host and port"),
+    )
+    max_queue_size: int = field(
+        default=1024,
+        metadata=pai_meta(
+            mode="flat",
+            help="Maximum number of lines that wait for their prediction, further requests block until lines are "
+            "predicted.",
+        ),
+    )
+
+
+class _Stop:
+    pass
+
+
+class PredictionService:
+    """
+    Keeps a Predictor or MultiPredictor warm and predicts the lines of all (concurrent) requests in one stream of
+    samples of the same `predict_raw` call. The lines that arrive within `PredictorParams.max_batch_wait_ms` are thus
+    coalesced into one batch (up to pipeline.batch_size lines, see `micro_batches`). Each line is queued with the future
+    of its prediction, the predictions arrive in the order in which the lines are read from the queue.
+    """
+
+    def __init__(self, predictor, max_queue_size: int = 1024, num_latencies: int = 1000):
+        from calamari_ocr.ocr.predict.predictor import Predictor
+
+        self.predictor = predictor
+        self.voted = not isinstance(predictor, Predictor)
+        self.predictor.params.progress_bar = False
+        self.predictor.params.silent = True
+        if self.predictor.params.max_batch_wait_ms <= 0:
+            raise ValueError(
+                "Serving requires predictor.max_batch_wait_ms > 0, otherwise the predictor waits for lines of further "
+                "requests before the lines of a request are predicted."
+            )
+
+        self._lines = Queue(max_queue_size)  # the lines and the futures of their predictions
+        self._pending = deque()  # the futures of the lines that were read from the queue, in order
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=num_latencies)
+        self.predicted_lines = 0
+        self.requests = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self._thread.start()
+        line_height = self.predictor.data.params.line_height
+        self.predict([np.zeros((line_height, line_height), dtype=np.uint8)])  # compile the model before serving
+        with self._stats_lock:
+            self.requests, self.predicted_lines = 0, 0
+            self._latencies.clear()
+
+    def stop(self):
+        self._lines.put(_Stop())
+        self._thread.join()
+
+    def _line_generator(self):
+        while True:
+            line = self._lines.get()
+            if isinstance(line, _Stop):
+                return
+            future, submitted, image = line
+            self._pending.append((future, submitted))
+            yield image
+
+    def _run(self):
+        while True:
+            try:
+                for sample in self.predictor.predict_raw(self._line_generator(), size=1):
+                    future, submitted = self._pending.popleft()
+                    with self._stats_lock:
+                        self.predicted_lines += 1
+                        self._latencies.append(time.monotonic() - submitted)
+                    future.set_result(sample.outputs[1] if self.voted else sample.outputs)
+                return
+            except Exception as e:
+                logger.exception("Prediction failed")
+                # the lines of the failed stream are lost, fail their requests and restart the stream. Requests that
+                # are blocked by the full queue continue to enqueue their lines, which are predicted by the new stream.
+                stop = False
+                while True:
+                    try:
+                        line = self._lines.get_nowait()
+                    except Empty:
+                        break
+                    if isinstance(line, _Stop):
+                        stop = True
+                    else:
+                        line[0].set_exception(e)
+                while self._pending:
+                    self._pending.popleft()[0].set_exception(e)
+                if stop:
+                    return
+
+    def submit(self, images: List[np.ndarray]) -> List[Future]:
+        """Enqueue the line images, blocks while the queue of lines is full"""
+        futures = [Future() for _ in images]
+        with self._stats_lock:
+            self.requests += 1
+        for future, image in zip(futures, images):
+            self._lines.put((future, time.monotonic(), image))
+        return futures
+
+    def predict(self, images: List[np.ndarray]) -> List[Prediction]:
+        return [future.result() for future in self.submit(images)]
+
+    def predict_page(self, image: str, xml: Optional[str] = None) -> Predictions:
+        """
+        Predict the lines of a PageXML page and write the page with the predicted text (pred_extension of PageXML).
+        Returns the predictions of the lines, their line_path is the written file.
+        """
+        params = PageXML(
+            images=[image],
+            xml_files=[xml] if xml else [],
+            channels=self.predictor.data.params.input_channels,
+        )
+        reader = params.create(PipelineMode.PREDICTION)
+        samples = list(reader.generate())
+        predictions = Predictions(line_path=split_all_ext(reader.params.xml_files[0])[0] + reader.params.pred_extension)
+        if not samples:
+            return predictions
+
+        reader.prepare_store()
+        for sample, prediction in zip(samples, self.predict([s.inputs for s in samples])):
+            prediction.id = sample.meta["id"]
+            reader.store_text_prediction(prediction, sample.meta["id"], output_dir=None)
+            predictions.predictions.append(prediction)
+        reader.store()
+        return predictions
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            latencies = np.asarray(self._latencies) * 1000
+            stats = {
+                "requests": self.requests,
+                "predicted_lines": self.predicted_lines,
+                "queue_depth": self._lines.qsize(),  # lines that were not read by the input pipeline yet
+                "pending_lines": self._lines.qsize() + len(self._pending),  # lines that wait for their prediction
+            }
+        if len(latencies) > 0:
+            stats.update(
+                {
+                    "latency_mean_ms": float(np.mean(latencies)),
+                    "latency_p50_ms": float(np.percentile(latencies, 50)),
+                    "latency_p95_ms": float(np.percentile(latencies, 95)),
+                }
+            )
+        return stats
+
+
+def predictions_json(predictions: Predictions) -> str:
+    for p in predictions.predictions:
+        p.logits = None
+        for vp in p.voter_predictions or []:
+            vp.logits = None
+    return predictions.to_json()
+
+
+def create_handler(service: PredictionService):
+    image_loader = ImageLoaderParams(channels=service.predictor.data.params.input_channels).create()
+
+    class Handler(BaseHTTPRequestHandler):
+        """
+        GET /stats: the stats of the service
+        POST /predict: a line image (body) or JSON {"images": [base64 encoded line images]}, returns the Predictions
+        POST /pagexml: JSON {"image": path, "xml": optional path}, writes the predicted page and returns the Predictions
+        """
+
+        def address_string(self):
+            return self.client_address[0] if self.client_address else "unix"
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def _respond(self, code: int, body: str):
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != "/stats":
+                self._respond(404, json.dumps({"error": f"Unknown path {self.path}"}))
+                return
+            self._respond(200, json.dumps(service.stats()))
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            is_json = self.headers.get("Content-Type", "").startswith("application/json")
+            try:
+                if self.path == "/predict":
+                    if is_json:
+                        images = [base64.b64decode(image) for image in json.loads(body)["images"]]
+                    else:
+                        images = [body]
+                    images = [image_loader.load_image(io.BytesIO(image)) for image in images]
+                    predictions = Predictions(predictions=service.predict(images))
+                elif self.path == "/pagexml":
+                    request = json.loads(body)
+                    predictions = service.predict_page(request["image"], request.get("xml"))
+                else:
+                    self._respond(404, json.dumps({"error": f"Unknown path {self.path}"}))
+                    return
+            except Exception as e:
+                logger.exception("Request failed")
+                self._respond(400, json.dumps({"error": str(e)}))
+                return
+
+            self._respond(200, predictions_json(predictions))
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(
+    service: PredictionService, host: str = "127.0.0.1", port: int = 8080, socket: Optional[str] = None
+) -> Union[ThreadingHTTPServer, ThreadingUnixHTTPServer]:
+    handler = create_handler(service)
+    if socket:
+        if os.path.exists(socket):
+            os.remove(socket)
+        return ThreadingUnixHTTPServer(socket, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def create_predictor(args: ServeArgs):
+    from calamari_ocr.ocr.predict.predictor import MultiPredictor, Predictor
+
+    args.checkpoint = [(cp if cp.endswith(".json") else cp + ".json") for cp in args.checkpoint]
+    args.checkpoint = [cp[:-5] for cp in glob_all(args.checkpoint)]
+    if args.fuse_checkpoints or len(args.checkpoint) == 1:
+        return Predictor.from_checkpoints(args.predictor, args.checkpoint)
+    return MultiPredictor.from_paths(
+        checkpoints=args.checkpoint,
+        voter_params=args.voter,
+        cascade_params=args.cascade,
+        predictor_params=args.predictor,
+    )
+
+
+def run(args: ServeArgs):
+    with PredictionService(create_predictor(args), args.max_queue_size) as service:
+        with create_server(service, args.host, args.port, args.socket) as server:
+            logger.info(f"Serving on {args.socket or f'http://{args.host}:{args.port}'}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+
+def main():
+    parser = PAIArgumentParser()
+
+    parser.add_argument("--version", action="version", version="%(prog)s v" + __version__)
+    parser.add_root_argument("root", ServeArgs, flat=True)
+    args = parser.parse_args()
+
+    run(args.root)
+
+
+if __name__ == "__main__":
+    main()